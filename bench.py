@@ -0,0 +1,243 @@
+import argparse
+import csv
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import registry
+from dataset import NUMERIC_ATTRIBUTES, load_queries
+from kdtree import FlatKDTree, KDTreeNode, build_flat_kd_tree, build_kd_tree
+from quadtree import FlatOctree, build_octree, build_linear_octree
+from rtree import FlatRTree, build_rtree, build_hilbert_rtree
+from range_tree import build_range_tree, build_layered_range_tree
+
+
+def _bounds(query):
+    return [query[attr][0] for attr in NUMERIC_ATTRIBUTES], [query[attr][1] for attr in NUMERIC_ATTRIBUTES]
+
+
+def _rtree_conditions(query):
+    return {attr: [(">=", query[attr][0]), ("<=", query[attr][1])] for attr in NUMERIC_ATTRIBUTES}
+
+
+# name -> (build(data), query(index, data, query) -> row ids), all over (price, rating, review date)
+STRUCTURES = {
+    "kdtree": (build_flat_kd_tree,
+               lambda index, data, query: index.range_query(*_bounds(query))),
+    "octree": (lambda data: FlatOctree.from_tree(build_octree(data)),
+               lambda index, data, query: index.range_query(*_bounds(query))),
+    "linear_octree": (build_linear_octree,
+                      lambda index, data, query: index.range_query(*_bounds(query))),
+    "rtree": (lambda data: FlatRTree.from_tree(build_rtree(data, NUMERIC_ATTRIBUTES)),
+              lambda index, data, query: index.search(data, NUMERIC_ATTRIBUTES, _rtree_conditions(query), {})),
+    "hilbert_rtree": (lambda data: build_hilbert_rtree(data, NUMERIC_ATTRIBUTES),
+                      lambda index, data, query: index.search(data, NUMERIC_ATTRIBUTES, _rtree_conditions(query), {})),
+    "range_tree": (lambda data: build_range_tree(data, NUMERIC_ATTRIBUTES),
+                   lambda index, data, query: index.search([query[attr] for attr in NUMERIC_ATTRIBUTES])),
+    "layered_range_tree": (lambda data: build_layered_range_tree(data, NUMERIC_ATTRIBUTES),
+                           lambda index, data, query: index.search([query[attr] for attr in NUMERIC_ATTRIBUTES])),
+}
+# The pointer range tree builds O(n log^2 n) Python nodes before flattening them, which takes minutes and
+# gigabytes past ~50k rows, so it only runs when asked for with --structure range_tree
+DEFAULT_STRUCTURES = [name for name in STRUCTURES if name != "range_tree"]
+
+
+def measure_build(build, data, memory=True):
+    """
+    Build an index once for timing and, if requested, once more under tracemalloc.
+    :return: Tuple of (index, build seconds, peak MB during the build, MB still held by the index).
+    """
+    gc.collect()
+    start = time.perf_counter()
+    index = build(data)
+    build_seconds = time.perf_counter() - start
+    peak_mb = retained_mb = None
+    if memory:
+        del index
+        gc.collect()
+        tracemalloc.start()
+        index = build(data)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb, retained_mb = peak / 2 ** 20, retained / 2 ** 20
+    return index, build_seconds, peak_mb, retained_mb
+
+
+def run_queries(query, index, data, queries, repeat=5, warmup=1):
+    """
+    Replay every query `warmup` times untimed, then `repeat` times timed.
+    :return: Tuple of (per-query list of latencies in seconds, per-query result count).
+    """
+    latencies = []
+    counts = []
+    for q in queries:
+        for _ in range(warmup):
+            query(index, data, q)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = query(index, data, q)
+            times.append(time.perf_counter() - start)
+        latencies.append(times)
+        counts.append(len(result))
+    return latencies, counts
+
+
+def benchmark(data, queries, structures, repeat=5, warmup=1, memory=True):
+    """Benchmark each structure on one dataset and return one summary dictionary per structure."""
+    reports = []
+    for name in structures:
+        build, query = STRUCTURES[name]
+        index, build_seconds, peak_mb, retained_mb = measure_build(build, data, memory)
+        latencies, counts = run_queries(query, index, data, queries, repeat, warmup)
+        all_ms = np.array([t for times in latencies for t in times]) * 1000
+        reports.append({
+            "structure": name,
+            "rows": len(data),
+            "build_s": build_seconds,
+            "build_peak_mb": peak_mb,
+            "index_mb": retained_mb,
+            "queries": len(queries),
+            "p50_ms": float(np.percentile(all_ms, 50)),
+            "p95_ms": float(np.percentile(all_ms, 95)),
+            "p99_ms": float(np.percentile(all_ms, 99)),
+            "mean_ms": float(all_ms.mean()),
+            "total_results": int(sum(counts)),
+            "per_query": [{"median_ms": float(np.median(times) * 1000), "results": count}
+                          for times, count in zip(latencies, counts)],
+        })
+        del index
+    return reports
+
+
+def _sorting_build_kd_tree(points, row_ids, depth=0):
+    """The previous build_kd_tree (full sort and list copies at every level), kept as a reference point."""
+    if not points:
+        return None
+    axis = depth % 3
+    sorted_indices = sorted(range(len(points)), key=lambda i: points[i][axis])
+    median = len(points) // 2
+    return KDTreeNode(point=points[sorted_indices[median]], row_id=row_ids[sorted_indices[median]],
+                      left=_sorting_build_kd_tree([points[i] for i in sorted_indices[:median]],
+                                                  [row_ids[i] for i in sorted_indices[:median]], depth + 1),
+                      right=_sorting_build_kd_tree([points[i] for i in sorted_indices[median + 1:]],
+                                                   [row_ids[i] for i in sorted_indices[median + 1:]], depth + 1))
+
+
+def kd_build_benchmark(sizes, reference_limit=1000000, seed=0):
+    """
+    Time k-d tree construction on uniform random points of each size.
+    :param sizes: Numbers of points.
+    :param reference_limit: Largest size the previous sort-per-level builder is timed on.
+    :return: One dictionary per size with seconds per builder and seconds / (n log2 n) for the array tree.
+    """
+    rng = np.random.default_rng(seed)
+    reports = []
+    for n in sizes:
+        points = rng.random((n, 3))
+        row_ids = list(range(n))
+        report = {"rows": n}
+        timed = [("flat_kd_tree_s", lambda: FlatKDTree.build(points)),
+                 ("kd_tree_s", lambda: build_kd_tree(points, row_ids))]
+        if n <= reference_limit:
+            point_list = points.tolist()
+            timed.append(("sorting_kd_tree_s", lambda: _sorting_build_kd_tree(point_list, row_ids)))
+        for name, build in timed:
+            gc.collect()
+            start = time.perf_counter()
+            build()
+            report[name] = time.perf_counter() - start
+        report["flat_ns_per_n_log_n"] = report["flat_kd_tree_s"] / (n * max(np.log2(n), 1)) * 1e9
+        reports.append(report)
+    return reports
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+CSV_FIELDS = ["dataset", "structure", "rows", "build_s", "build_peak_mb", "index_mb", "queries", "p50_ms",
+              "p95_ms", "p99_ms", "mean_ms", "total_results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a query file against every structure and report timings.")
+    parser.add_argument("--data", action="append",
+                        help="Dataset to benchmark (CSV or .snap, repeatable for a scaling series; "
+                             f"default: {registry.DATA_PATH})")
+    parser.add_argument("--queries", default="queries.txt", help="Query file to replay")
+    parser.add_argument("--structure", action="append", choices=list(STRUCTURES),
+                        help="Structure to benchmark (repeatable, default: all but range_tree)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions per query")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed repetitions per query")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc build (faster)")
+    parser.add_argument("--json", help="Write the full report (including per-query results) as JSON")
+    parser.add_argument("--csv", help="Write one summary row per dataset and structure as CSV")
+    parser.add_argument("--kd-build", type=int, nargs="+", metavar="N",
+                        help="Only time k-d tree construction on N random points (e.g. 100000 1000000)")
+    parser.add_argument("--reference-limit", type=int, default=1000000,
+                        help="Largest N for which the old sort-per-level k-d tree builder is timed")
+    args = parser.parse_args()
+
+    if args.kd_build:
+        reports = kd_build_benchmark(args.kd_build, args.reference_limit)
+        print(f"{'rows':>10}{'flat s':>10}{'kdnode s':>10}{'sorting s':>11}{'ns/nlogn':>10}")
+        for r in reports:
+            reference = f"{r['sorting_kd_tree_s']:.3f}" if "sorting_kd_tree_s" in r else "-"
+            print(f"{r['rows']:>10}{r['flat_kd_tree_s']:>10.3f}{r['kd_tree_s']:>10.3f}{reference:>11}"
+                  f"{r['flat_ns_per_n_log_n']:>10.2f}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"commit": _git_commit(), "python": platform.python_version(), "kd_build": reports}, f,
+                          indent=2)
+        if args.csv:
+            with open(args.csv, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["rows", "flat_kd_tree_s", "kd_tree_s", "sorting_kd_tree_s",
+                                                       "flat_ns_per_n_log_n"])
+                writer.writeheader()
+                writer.writerows(reports)
+        return
+
+    queries = load_queries(args.queries)
+    if not queries:
+        parser.error(f"{args.queries} holds no queries")
+    structures = args.structure or DEFAULT_STRUCTURES
+    runs = []
+    for path in args.data or [registry.DATA_PATH]:
+        start = time.perf_counter()
+        data = registry.load_dataset(path)
+        load_seconds = time.perf_counter() - start
+        reports = benchmark(data, queries, structures, args.repeat, args.warmup, memory=not args.no_memory)
+        runs.append({"dataset": path, "rows": len(data), "load_s": load_seconds, "results": reports})
+
+        print(f"\n{path}: {len(data)} rows, loaded in {load_seconds:.3f}s")
+        print(f"{'structure':<20}{'build s':>10}{'peak MB':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+              f"{'results':>10}")
+        for r in reports:
+            peak = f"{r['build_peak_mb']:.1f}" if r['build_peak_mb'] is not None else "-"
+            print(f"{r['structure']:<20}{r['build_s']:>10.3f}{peak:>10}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}"
+                  f"{r['p99_ms']:>10.3f}{r['total_results']:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"commit": _git_commit(), "python": platform.python_version(), "queries": args.queries,
+                       "repeat": args.repeat, "warmup": args.warmup, "runs": runs}, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for run in runs:
+                for r in run["results"]:
+                    writer.writerow({"dataset": run["dataset"], **r})
+
+
+if __name__ == "__main__":
+    main()
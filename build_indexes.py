@@ -0,0 +1,64 @@
+import argparse
+import itertools
+import os
+import time
+import registry
+from dataset import NUMERIC_ATTRIBUTES, CATEGORICAL_ATTRIBUTES
+from index_store import save_index, index_filename
+from kdtree import build_flat_kd_tree
+from quadtree import build_linear_octree
+from rtree import FlatRTree, build_rtree, build_hilbert_rtree
+from range_tree import build_range_tree, build_layered_range_tree
+
+
+STRUCTURES = ["kdtree", "linear_octree", "rtree", "hilbert_rtree", "range_tree", "layered_range_tree"]
+
+
+def index_builds(structures):
+    """Yield (name, key, build) for every index the *_main entry points can ask the registry for."""
+    subsets = [list(subset) for size in range(1, len(NUMERIC_ATTRIBUTES) + 1)
+               for subset in itertools.combinations(NUMERIC_ATTRIBUTES, size)]
+    if "kdtree" in structures:
+        yield "kdtree", None, build_flat_kd_tree
+        # Trees with one categorical axis; other combinations are built on first use
+        for attr in CATEGORICAL_ATTRIBUTES:
+            yield "kdtree", (attr,), lambda data, attr=attr: build_flat_kd_tree(data, NUMERIC_ATTRIBUTES + [attr])
+    if "linear_octree" in structures:
+        for subset in subsets:
+            yield "linear_octree", tuple(subset), lambda data, subset=subset: build_linear_octree(data, subset)
+    if "rtree" in structures:
+        # Used for distance browsing, which always works in (price, rating, review date) space
+        yield "rtree", tuple(NUMERIC_ATTRIBUTES), lambda data: FlatRTree.from_tree(
+            build_rtree(data, NUMERIC_ATTRIBUTES))
+    if "hilbert_rtree" in structures:
+        for subset in subsets:
+            yield "hilbert_rtree", tuple(subset), lambda data, subset=subset: build_hilbert_rtree(data, subset)
+    if "range_tree" in structures:
+        for subset in subsets:
+            yield "range_tree", tuple(subset), lambda data, subset=subset: build_range_tree(data, subset)
+    if "layered_range_tree" in structures:
+        for subset in subsets:
+            yield "layered_range_tree", tuple(subset), lambda data, subset=subset: build_layered_range_tree(
+                data, subset)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the indexes offline and save them for fast startup.")
+    parser.add_argument("--data", default=registry.DATA_PATH, help="Dataset to index (CSV or .snap snapshot)")
+    parser.add_argument("--out", default=registry.INDEX_DIR, help="Directory to write the index files to")
+    parser.add_argument("--structure", action="append", choices=STRUCTURES,
+                        help="Structure to build (repeatable, default: all)")
+    args = parser.parse_args()
+
+    data = registry.load_dataset(args.data)
+    os.makedirs(args.out, exist_ok=True)
+    for name, key, build in index_builds(args.structure or STRUCTURES):
+        start = time.perf_counter()
+        index = build(data)
+        path = os.path.join(args.out, index_filename(name, key))
+        save_index(path, index, data)
+        print(f"{path}: built in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import os
+import pytest
+from dataset import CoffeeDataset
+from synth import generate
+
+
+@pytest.fixture(scope="session")
+def dataset(tmp_path_factory):
+    """A small synthetic coffee dataset with skewed values, so that many rows share a price, rating or date."""
+    path = str(tmp_path_factory.mktemp("data") / "coffee.csv")
+    generate(path, 600, distribution="skewed", seed=7,
+             template=os.path.join(os.path.dirname(os.path.abspath(__file__)), "simplified_coffee.csv"))
+    return CoffeeDataset.from_csv(path)
@@ -0,0 +1,216 @@
+import csv
+import hashlib
+import json
+import math
+import numpy as np
+from datetime import datetime
+
+
+COLUMNS = ['name', 'roaster', 'roast', 'loc_country', 'origin', '100g_USD', 'rating', 'review_date', 'review']
+NUMERIC_ATTRIBUTES = ['100g_USD', 'rating', 'review_date']
+CATEGORICAL_ATTRIBUTES = ['roaster', 'roast', 'loc_country', 'origin']
+TEXT_ATTRIBUTES = ['name', 'review']
+AGGREGATE_ATTRIBUTES = ['100g_USD', 'rating']  # Attributes the augmented trees keep subtree totals of
+
+NUMERIC_DTYPES = {'100g_USD': np.float64, 'rating': np.int32, 'review_date': np.int32}
+
+
+def convert_date_to_numeric(date_str):
+    """Convert 'Month Year' date format to numeric YYYYMM format."""
+    try:
+        return int(datetime.strptime(date_str, "%B %Y").strftime("%Y%m"))
+    except ValueError:
+        raise ValueError(f"Invalid date format: {date_str}")
+
+
+def convert_numeric_to_date(value):
+    """Convert a numeric YYYYMM date back to the 'Month Year' format of the CSV."""
+    return datetime(int(value) // 100, int(value) % 100, 1).strftime("%B %Y")
+
+
+def summarize(count, sums, mins, maxs, attributes):
+    """
+    Turn the totals of an aggregate query into {"count", "sum", "min", "max", "avg"}.
+    The per-attribute entries are dictionaries keyed by attribute; min, max and avg are None when nothing matched.
+    """
+    summary = {"count": count, "sum": {}, "min": {}, "max": {}, "avg": {}}
+    for attr, total, low, high in zip(attributes, np.asarray(sums).tolist(), np.asarray(mins).tolist(),
+                                      np.asarray(maxs).tolist()):
+        summary["sum"][attr] = total
+        summary["min"][attr] = low if count else None
+        summary["max"][attr] = high if count else None
+        summary["avg"][attr] = total / count if count else None
+    return summary
+
+
+def parse_query_line(line):
+    """
+    Parse one line of a query file ('min price,max price,min rating,max rating,from date,to date').
+    :return: Dictionary of numeric attribute -> (min, max), dates as YYYYMM numbers.
+    """
+    parts = [part.strip() for part in line.split(",")]
+    if len(parts) != 6:
+        raise ValueError(f"Expected 6 comma-separated values, got: {line!r}")
+    return {
+        '100g_USD': (float(parts[0]), float(parts[1])),
+        'rating': (float(parts[2]), float(parts[3])),
+        'review_date': (convert_date_to_numeric(parts[4]), convert_date_to_numeric(parts[5])),
+    }
+
+
+def load_queries(filepath):
+    """Read a query file such as queries.txt, skipping blank lines."""
+    with open(filepath, encoding='utf-8') as f:
+        return [parse_query_line(line) for line in f if line.strip()]
+
+
+def normalize(value):
+    """Normalization used when matching categorical values."""
+    return str(value).strip().lower()
+
+
+class CoffeeDataset:
+    """
+    Column-oriented copy of the coffee reviews dataset.
+    Numeric attributes are NumPy arrays, categorical attributes are int32 codes into a vocabulary (-1 for a
+    missing value) and free text is stored as one UTF-8 buffer plus an offsets array. Indexes keep row ids
+    only and rows are materialised from here once a query is answered.
+    """
+
+    def __init__(self, numeric, codes, vocabularies, texts):
+        self.numeric = numeric  # attribute -> 1D array
+        self.codes = codes  # attribute -> int32 array of vocabulary indices
+        self.vocabularies = vocabularies  # attribute -> list of distinct values
+        self.texts = texts  # attribute -> (int64 offsets of length n + 1, uint8 buffer)
+        self._normalized = {attr: [normalize(v) for v in vocab] for attr, vocab in vocabularies.items()}
+        self._checksum = None
+
+    @classmethod
+    def from_csv(cls, filepath):
+        """Read the CSV in a single pass, encoding every column as it goes."""
+        numeric = {attr: [] for attr in NUMERIC_ATTRIBUTES}
+        codes = {attr: [] for attr in CATEGORICAL_ATTRIBUTES}
+        lookups = {attr: {} for attr in CATEGORICAL_ATTRIBUTES}
+        texts = {attr: (bytearray(), [0]) for attr in TEXT_ATTRIBUTES}
+        dates = {}  # Each distinct 'Month Year' string is parsed only once
+
+        with open(filepath, encoding='utf-8', newline='') as csvfile:
+            reader = csv.reader(csvfile, delimiter=",")
+            header = next(reader)
+            indices = {attr: header.index(attr) for attr in COLUMNS}
+            for row in reader:
+                numeric['100g_USD'].append(float(row[indices['100g_USD']]))
+                numeric['rating'].append(int(float(row[indices['rating']])))
+                date_str = row[indices['review_date']]
+                if date_str not in dates:
+                    dates[date_str] = convert_date_to_numeric(date_str)
+                numeric['review_date'].append(dates[date_str])
+                for attr in CATEGORICAL_ATTRIBUTES:
+                    value = row[indices[attr]]
+                    if value == '':
+                        codes[attr].append(-1)
+                    else:
+                        codes[attr].append(lookups[attr].setdefault(value, len(lookups[attr])))
+                for attr in TEXT_ATTRIBUTES:
+                    buffer, offsets = texts[attr]
+                    buffer += row[indices[attr]].encode('utf-8')
+                    offsets.append(len(buffer))
+
+        return cls(
+            numeric={attr: np.array(values, dtype=NUMERIC_DTYPES[attr]) for attr, values in numeric.items()},
+            codes={attr: np.array(values, dtype=np.int32) for attr, values in codes.items()},
+            vocabularies={attr: list(lookup) for attr, lookup in lookups.items()},
+            texts={attr: (np.array(offsets, dtype=np.int64), np.frombuffer(bytes(buffer), dtype=np.uint8))
+                   for attr, (buffer, offsets) in texts.items()},
+        )
+
+    def __len__(self):
+        return len(self.numeric['100g_USD'])
+
+    def checksum(self):
+        """SHA-256 of the dataset contents, used to tie snapshots and saved indexes to the data they hold."""
+        if self._checksum is None:
+            digest = hashlib.sha256()
+            for attr in NUMERIC_ATTRIBUTES:
+                digest.update(np.ascontiguousarray(self.numeric[attr], dtype=NUMERIC_DTYPES[attr]).tobytes())
+            for attr in CATEGORICAL_ATTRIBUTES:
+                digest.update(np.ascontiguousarray(self.codes[attr], dtype=np.int32).tobytes())
+            digest.update(json.dumps(self.vocabularies, sort_keys=True).encode('utf-8'))
+            for attr in TEXT_ATTRIBUTES:
+                offsets, buffer = self.texts[attr]
+                digest.update(np.ascontiguousarray(offsets, dtype=np.int64).tobytes())
+                digest.update(np.asarray(buffer).tobytes())
+            self._checksum = digest.hexdigest()
+        return self._checksum
+
+    def points(self, attributes):
+        """
+        Return an (n, len(attributes)) float64 array of the given attributes. Categorical attributes are
+        given as their integer codes (-1 where missing).
+        """
+        return np.column_stack([(self.numeric[attr] if attr in self.numeric else self.codes[attr]).astype(np.float64)
+                                for attr in attributes])
+
+    def text(self, attr, row_id):
+        """Decode one value of a text attribute."""
+        offsets, buffer = self.texts[attr]
+        return buffer[offsets[row_id]:offsets[row_id + 1]].tobytes().decode('utf-8')
+
+    def encode(self, attr, values):
+        """Return the codes of `attr` whose value matches any of `values` (case and whitespace insensitive)."""
+        wanted = {normalize(value) for value in values}
+        return np.array([code for code, value in enumerate(self._normalized[attr]) if value in wanted], dtype=np.int32)
+
+    def filter_categorical(self, row_ids, categorical_inputs):
+        """
+        Keep the row ids that satisfy every categorical condition.
+        :param row_ids: Sequence of row ids.
+        :param categorical_inputs: Dictionary of categorical conditions (e.g., {"loc_country": ["United States"]}).
+        :return: int32 array of the matching row ids, in their original order.
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int32)
+        for attr, values in categorical_inputs.items():
+            row_ids = row_ids[np.isin(self.codes[attr][row_ids], self.encode(attr, values))]
+        return row_ids
+
+    def value(self, attr, row_id, raw=False):
+        """Return one attribute of one row."""
+        if attr in self.numeric:
+            value = self.numeric[attr][row_id].item()
+            if raw:
+                return convert_numeric_to_date(value) if attr == 'review_date' else str(value)
+            return value
+        if attr in self.codes:
+            code = self.codes[attr][row_id]
+            if code < 0:
+                return '' if raw else math.nan
+            return self.vocabularies[attr][code]
+        return self.text(attr, row_id)
+
+    def record(self, row_id):
+        """Return one row as a dictionary keyed by column name."""
+        return {attr: self.value(attr, row_id) for attr in COLUMNS}
+
+    def rows(self, row_ids, raw=False):
+        """
+        Materialise rows in CSV column order.
+        :param row_ids: Sequence of row ids.
+        :param raw: If True return the values as the strings stored in the CSV, otherwise return numbers for the
+                    numeric attributes and NaN for missing categorical values.
+        :return: List of rows, each a list of values.
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        columns = []
+        for attr in COLUMNS:
+            if attr in self.numeric:
+                values = self.numeric[attr][row_ids].tolist()
+                if raw:
+                    values = [convert_numeric_to_date(v) if attr == 'review_date' else str(v) for v in values]
+            elif attr in self.codes:
+                vocab = self.vocabularies[attr]
+                missing = '' if raw else math.nan
+                values = [vocab[code] if code >= 0 else missing for code in self.codes[attr][row_ids].tolist()]
+            else:
+                values = [self.text(attr, row_id) for row_id in row_ids.tolist()]
+            columns.append(values)
+        return [list(row) for row in zip(*columns)]
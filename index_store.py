@@ -0,0 +1,59 @@
+"""
+Saving built indexes. Every flat index class (FlatKDTree, FlatOctree, LinearOctree, FlatRTree, HilbertRTree,
+FlatRangeTree, LayeredRangeTree) keeps its nodes in NumPy arrays and provides to_arrays() -> (arrays, params) and
+from_arrays(arrays, params). save_index writes those arrays to one file, and load_index memory-maps them back, so a
+saved index is queried in place without being rebuilt.
+"""
+import os
+from snapshot import write_arrays, read_arrays
+
+
+INDEX_MAGIC = b"COFFIDX\0"
+INDEX_VERSION = 7
+
+
+def index_filename(name, key=None):
+    """File name used for a saved index, e.g. 'rtree-100g_USD-rating.idx'."""
+    parts = [name] + [str(part) for part in (key or ())]
+    return "-".join(parts) + ".idx"
+
+
+def save_index(path, index, dataset):
+    """
+    Save a flat index next to the checksum of the dataset it was built from.
+    :param path: Output file.
+    :param index: A flat index providing to_arrays().
+    :param dataset: The CoffeeDataset the index was built from.
+    """
+    arrays, params = index.to_arrays()
+    meta = {"kind": type(index).__name__, "dataset_checksum": dataset.checksum(), "params": params}
+    write_arrays(path, INDEX_MAGIC, INDEX_VERSION, arrays, meta)
+
+
+def load_index(path, dataset, index_class):
+    """
+    Memory-map a saved index. The node arrays are used in place; no per-node objects are created.
+    :param path: Index file written by save_index.
+    :param dataset: The CoffeeDataset queries will run against.
+    :param index_class: Expected flat index class.
+    :return: An instance of index_class backed by the mapped arrays.
+    :raises ValueError: If the file holds another kind of index, was built from different data, or is truncated
+                        or corrupt.
+    """
+    arrays, meta = read_arrays(path, INDEX_MAGIC, INDEX_VERSION)
+    try:
+        if meta["kind"] != index_class.__name__:
+            raise ValueError(f"{path} holds a {meta['kind']}, expected {index_class.__name__}")
+        if meta["dataset_checksum"] != dataset.checksum():
+            raise ValueError(f"{path} was built from a different dataset")
+        return index_class.from_arrays(arrays, meta["params"])
+    except (KeyError, TypeError) as exc:
+        raise ValueError(f"{path} is missing index data: {exc!r}") from exc
+
+
+def find_index(directory, name, key=None):
+    """Return the path of a saved index if one exists in `directory`, else None."""
+    if not directory:
+        return None
+    path = os.path.join(directory, index_filename(name, key))
+    return path if os.path.exists(path) else None
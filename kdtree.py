@@ -1,47 +1,93 @@
-import pandas as pd
+import gc
+import heapq
 import math
-from datetime import datetime
+import numpy as np
 from lsh import lsh_query
-
-
-def convert_date_to_numeric(date_str):
-    # Convert 'Month Year' date format to numeric YYYYMM format.
-    try:
-        return int(datetime.strptime(date_str, "%B %Y").strftime("%Y%m"))
-    except ValueError:
-        raise ValueError(f"Invalid date format: {date_str}")
+from dataset import COLUMNS, CATEGORICAL_ATTRIBUTES, AGGREGATE_ATTRIBUTES, summarize
+import registry
 
 
 class KDTreeNode:
-    def __init__(self, point, full_data, left=None, right=None):
+    def __init__(self, point, row_id, left=None, right=None):
         self.point = point  # A 3D point for splitting (used for tree structure)
-        self.full_data = full_data  # Full row of data (all columns)
+        self.row_id = row_id  # Row id of the point in the dataset
         self.left = left  # Left subtree
         self.right = right  # Right subtree
 
 
-def build_kd_tree(points, full_data, depth=0):
-    if not points:
+def build_kd_tree(points, row_ids, depth=0):
+    """
+    Build a KDTreeNode tree in O(k n log n), one level at a time. Each axis is argsorted once; every level then
+    takes the median of each segment straight from the order on its splitting axis and stably splits the orders on
+    the other axes around it with a few whole-array passes, so there is no per-node NumPy call or copy. The nodes
+    are created bottom-up at the end.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
         return None
+    n, k = points.shape
+    row_ids = np.asarray(row_ids)
+    # orders[axis][lo:hi] holds the points of the segment [lo, hi) sorted on axis; the median slots between
+    # segments are left behind as the levels go down
+    orders = [np.argsort(points[:, axis], kind='stable') for axis in range(k)]
+    side = np.empty(n, dtype=np.int8)  # -1 / 0 / 1: left of, at or right of the median of the point's segment
+    lo, hi = np.zeros(1, dtype=np.int64), np.full(1, n, dtype=np.int64)
+    levels = []  # Per level: (median point of each segment, index of its left/right child segment or -1)
+    while len(lo):
+        axis = (depth + len(levels)) % k
+        lengths = hi - lo
+        mid = lo + lengths // 2
+        medians = orders[axis][mid]
+        positions = expand_ranges(lo, hi)
+        segment = np.repeat(np.arange(len(lo)), lengths)
+        mid_of = mid[segment]
+        side[orders[axis][positions]] = np.sign(positions - mid_of)
+        # The i-th left point of the level (counting from 1) goes to lo + i - 1 - (left points of earlier segments)
+        n_left, n_right = mid - lo, hi - mid - 1
+        left_shift = (lo - 1 - (np.cumsum(n_left) - n_left))[segment]
+        right_shift = (mid - (np.cumsum(n_right) - n_right))[segment]
+        for other in range(k):
+            if other == axis:
+                continue  # Already sorted on both sides of the median
+            ids = orders[other][positions]
+            is_left, is_right = side[ids] < 0, side[ids] > 0
+            orders[other][np.where(is_left, np.cumsum(is_left) + left_shift,
+                                   np.where(is_right, np.cumsum(is_right) + right_shift, mid_of))] = ids
+        has_left, has_right = n_left > 0, n_right > 0
+        left_child = np.where(has_left, np.cumsum(has_left) - 1, -1)
+        right_child = np.where(has_right, has_left.sum() + np.cumsum(has_right) - 1, -1)
+        levels.append((medians, left_child, right_child))
+        lo, hi = np.concatenate([lo[has_left], mid[has_right] + 1]), np.concatenate([mid[has_left], hi[has_right]])
 
-    # Cycle through dimensions 0, 1, 2 for splitting
-    k = 3  # The number of dimensions to use for splitting
-    axis = depth % k
+    # Creating millions of small objects otherwise triggers repeated garbage collections that find nothing to free
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        below = [None]
+        for medians, left_child, right_child in reversed(levels):
+            below.append(None)  # Child index -1 picks this None
+            below = [KDTreeNode(point=point, row_id=row_id, left=below[left], right=below[right])
+                     for point, row_id, left, right in zip(points[medians].tolist(), row_ids[medians].tolist(),
+                                                           left_child.tolist(), right_child.tolist())]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return below[0]
 
-    # Sort points based on the current axis (this is for splitting)
-    sorted_indices = sorted(range(len(points)), key=lambda i: points[i][axis])
-    median = len(points) // 2
 
-    # Create a node that holds the full row of data (all columns)
-    return KDTreeNode(point=points[sorted_indices[median]],  # This is the point used for splitting
-                      full_data=full_data[sorted_indices[median]],  # The full row of data (all columns)
-                      left=build_kd_tree([points[i] for i in sorted_indices[:median]],
-                                         [full_data[i] for i in sorted_indices[:median]], depth + 1),
-                      right=build_kd_tree([points[i] for i in sorted_indices[median + 1:]],
-                                          [full_data[i] for i in sorted_indices[median + 1:]], depth + 1))
+def collect_subtree(node, results):
+    """Append the row id of every node in the subtree, in the order range_query visits them."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node is not None:
+            results.append(node.row_id)
+            stack.append(node.right)
+            stack.append(node.left)
+    return results
 
 
-def range_query(node, range_min, range_max, depth=0, results=None):
+def range_query(node, range_min, range_max, depth=0, results=None, cell_min=None, cell_max=None):
     if results is None:
         results = []
 
@@ -51,54 +97,458 @@ def range_query(node, range_min, range_max, depth=0, results=None):
     k = len(range_min)  # Number of dimensions
     axis = depth % k  # Splitting axis
 
+    # The cell of the subtree, narrowed by the splitting values on the way down
+    if cell_min is None:
+        cell_min, cell_max = [-math.inf] * k, [math.inf] * k
+    # A cell that lies inside the query is reported whole, without testing its points
+    if all(range_min[dim] <= cell_min[dim] and cell_max[dim] <= range_max[dim] for dim in range(k)):
+        return collect_subtree(node, results)
+
     # Check if the current point is within the range
     if all(range_min[dim] <= node.point[dim] <= range_max[dim] for dim in range(k)):
-        results.append(node.full_data)
+        results.append(node.row_id)
 
     # Explore the left and right children based on the splitting axis
     if node.point[axis] >= range_min[axis]:  # Potential overlap with the left subtree
-        range_query(node.left, range_min, range_max, depth + 1, results)
+        left_max = list(cell_max)
+        left_max[axis] = node.point[axis]
+        range_query(node.left, range_min, range_max, depth + 1, results, cell_min, left_max)
     if node.point[axis] <= range_max[axis]:  # Potential overlap with the right subtree
-        range_query(node.right, range_min, range_max, depth + 1, results)
+        right_min = list(cell_min)
+        right_min[axis] = node.point[axis]
+        range_query(node.right, range_min, range_max, depth + 1, results, right_min, cell_max)
 
     return results
 
 
-def filter_by_categorical_inputs(results, categorical_inputs, attribute_indices):
+def expand_ranges(starts, ends):
+    """Concatenate the ranges [starts[i], ends[i]) into one int64 array."""
+    lengths = (ends - starts).astype(np.int64)
+    offsets = np.repeat(np.asarray(starts, dtype=np.int64) - (np.cumsum(lengths) - lengths), lengths)
+    return offsets + np.arange(lengths.sum(), dtype=np.int64)
+
+
+class FlatKDTree:
     """
-    Filter results based on categorical conditions.
-    :param results: List of rows from the dataset.
-    :param categorical_inputs: Dictionary of categorical conditions (e.g., {"loc_country": ["United States"]}).
-    :param attribute_indices: Dictionary mapping attribute names to column indices.
-    :return: Filtered list of rows.
+    KD-tree stored in contiguous NumPy arrays instead of one object per row.
+    Points are reordered so that every node covers the slice [start, end) of `points`/`row_ids`; leaves hold
+    buckets of up to `leaf_size` points that are tested with one vectorized comparison. Every node keeps the
+    bounding box of its points for pruning.
     """
-    filtered_results = []
-    for result in results:
-        match = True
-        for attr, values in categorical_inputs.items():
-            idx = attribute_indices[attr]
-            if attr in ["roaster", "roast", "loc_country", "origin"]:  # Non-numeric attributes
-                # Normalize the dataset value and search values for comparison
-                dataset_value = str(result[idx]).strip().lower()
-                search_values = [val.strip().lower() for val in values]
-                if dataset_value not in search_values:
-                    match = False
+
+    def __init__(self, points, row_ids, start, end, left, right, split_dim, split_value, bbox_min, bbox_max,
+                 leaf_size):
+        self.points = points  # (n, k) float64, in tree order
+        self.row_ids = row_ids  # (n,) int32, in tree order
+        self.start = start  # (m,) int64 first point of each node
+        self.end = end  # (m,) int64 one past the last point of each node
+        self.left = left  # (m,) int32 left child, -1 for a leaf
+        self.right = right  # (m,) int32 right child, -1 for a leaf
+        self.split_dim = split_dim  # (m,) int8 splitting axis, -1 for a leaf
+        self.split_value = split_value  # (m,) float64 splitting value
+        self.bbox_min = bbox_min  # (m, k) float64
+        self.bbox_max = bbox_max  # (m, k) float64
+        self.leaf_size = leaf_size
+        # Optional augmentation for aggregate queries, see augment()
+        self.aggregated = []  # Names of the aggregated attributes
+        self.agg_values = None  # (n, a) float64 aggregated values, in tree order
+        self.agg_prefix = None  # (n + 1, a) float64 prefix sums of agg_values; a node's sum is one subtraction
+        self.agg_min = None  # (m, a) float64 subtree minimum
+        self.agg_max = None  # (m, a) float64 subtree maximum
+
+    @classmethod
+    def build(cls, points, row_ids=None, leaf_size=32, leading_axes=()):
+        """
+        Build the tree in O(n log n), cycling through the dimensions and splitting each node at the median.
+        :param points: (n, k) array of coordinates.
+        :param row_ids: Row id of each point (defaults to 0..n-1).
+        :param leaf_size: Maximum number of points in a leaf bucket.
+        :param leading_axes: Axes split on before all others, until they are constant within a node. Used for
+                             coded categorical axes, so that an IN filter on them prunes near the root.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        n, k = points.shape
+        row_ids = np.arange(n, dtype=np.int32) if row_ids is None else np.asarray(row_ids, dtype=np.int32)
+        perm = np.arange(n)
+        start, end, left, right, split_dim, split_value = [0], [n], [-1], [-1], [-1], [np.nan]
+
+        stack = [(0, 0)]  # (node, depth)
+        while stack:
+            node, depth = stack.pop()
+            s, e = start[node], end[node]
+            if e - s <= leaf_size:
+                continue
+            # Split on the leading axes first, then cycle through the others; skip axes that are constant in
+            # this node (common for coded categorical axes with few distinct values)
+            segment = perm[s:e]
+            axis = depth % k
+            for candidate in list(leading_axes) + [(depth + offset) % k for offset in range(k)]:
+                values = points[segment, candidate]
+                if values.min() < values.max():
+                    axis = candidate
                     break
-        if match:
-            filtered_results.append(result)
-    return filtered_results
+            # Linear-time median selection on the node's slice of the permutation
+            mid = s + (e - s) // 2
+            segment[:] = segment[np.argpartition(points[segment, axis], mid - s)]
+            split_dim[node] = axis
+            split_value[node] = points[perm[mid], axis]
+            for child_start, child_end in ((s, mid), (mid, e)):
+                start.append(child_start)
+                end.append(child_end)
+                left.append(-1)
+                right.append(-1)
+                split_dim.append(-1)
+                split_value.append(np.nan)
+            left[node], right[node] = len(start) - 2, len(start) - 1
+            stack.append((right[node], depth + 1))
+            stack.append((left[node], depth + 1))
 
+        tree = cls(points=points[perm], row_ids=row_ids[perm], start=np.array(start, dtype=np.int64),
+                   end=np.array(end, dtype=np.int64), left=np.array(left, dtype=np.int32),
+                   right=np.array(right, dtype=np.int32), split_dim=np.array(split_dim, dtype=np.int8),
+                   split_value=np.array(split_value, dtype=np.float64),
+                   bbox_min=np.full((len(start), k), np.inf), bbox_max=np.full((len(start), k), -np.inf),
+                   leaf_size=leaf_size)
+        tree._compute_boxes()
+        return tree
 
-def kdtree_main(selected_attributes=None, conditions=None, review_keywords=None, num_neighbors=None):
-    if selected_attributes is None:
-        selected_attributes = []
-    if conditions is None:
-        conditions = {}
+    def _compute_boxes(self):
+        """Leaf boxes from their points, inner boxes from their children (children follow their parent)."""
+        leaves = np.flatnonzero(self.left < 0)
+        leaves = leaves[np.argsort(self.start[leaves])]  # Leaves partition the points; reduce them in order
+        if len(self.points):
+            self.bbox_min[leaves] = np.minimum.reduceat(self.points, self.start[leaves], axis=0)
+            self.bbox_max[leaves] = np.maximum.reduceat(self.points, self.start[leaves], axis=0)
+        for node in np.flatnonzero(self.left >= 0)[::-1].tolist():
+            self.bbox_min[node] = np.minimum(self.bbox_min[self.left[node]], self.bbox_min[self.right[node]])
+            self.bbox_max[node] = np.maximum(self.bbox_max[self.left[node]], self.bbox_max[self.right[node]])
+
+    def augment(self, values, attributes):
+        """
+        Store per-subtree count, sum, min and max of extra attributes so aggregate() can answer from whole nodes.
+        :param values: (rows, a) array of the attribute values, indexed by row id.
+        :param attributes: Names of the a attributes.
+        """
+        self.aggregated = list(attributes)
+        width = len(self.aggregated)
+        self.agg_values = np.asarray(values, dtype=np.float64)[self.row_ids].reshape(len(self.row_ids), width)
+        self.agg_prefix = np.vstack([np.zeros((1, self.agg_values.shape[1])), np.cumsum(self.agg_values, axis=0)])
+        m = len(self.start)
+        self.agg_min = np.full((m, self.agg_values.shape[1]), np.inf)
+        self.agg_max = np.full((m, self.agg_values.shape[1]), -np.inf)
+        leaves = np.flatnonzero(self.left < 0)
+        leaves = leaves[np.argsort(self.start[leaves])]
+        if len(self.row_ids):
+            self.agg_min[leaves] = np.minimum.reduceat(self.agg_values, self.start[leaves], axis=0)
+            self.agg_max[leaves] = np.maximum.reduceat(self.agg_values, self.start[leaves], axis=0)
+        for node in np.flatnonzero(self.left >= 0)[::-1].tolist():
+            self.agg_min[node] = np.minimum(self.agg_min[self.left[node]], self.agg_min[self.right[node]])
+            self.agg_max[node] = np.maximum(self.agg_max[self.left[node]], self.agg_max[self.right[node]])
+
+    def to_arrays(self):
+        arrays = {"points": self.points, "row_ids": self.row_ids, "start": self.start, "end": self.end,
+                  "left": self.left, "right": self.right, "split_dim": self.split_dim,
+                  "split_value": self.split_value, "bbox_min": self.bbox_min, "bbox_max": self.bbox_max}
+        if self.aggregated:
+            arrays.update(agg_values=self.agg_values, agg_prefix=self.agg_prefix, agg_min=self.agg_min,
+                          agg_max=self.agg_max)
+        return arrays, {"leaf_size": self.leaf_size, "aggregated": self.aggregated}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        tree = cls(arrays["points"], arrays["row_ids"], arrays["start"], arrays["end"], arrays["left"],
+                   arrays["right"], arrays["split_dim"], arrays["split_value"], arrays["bbox_min"],
+                   arrays["bbox_max"], params["leaf_size"])
+        if params["aggregated"]:
+            tree.aggregated = params["aggregated"]
+            tree.agg_values, tree.agg_prefix = arrays["agg_values"], arrays["agg_prefix"]
+            tree.agg_min, tree.agg_max = arrays["agg_min"], arrays["agg_max"]
+        return tree
+
+    def range_query(self, range_min, range_max, allowed=None):
+        """
+        Range query, walking the tree one level at a time with vectorized box tests.
+        :param allowed: Optional dictionary {axis: codes} restricting integer-coded (categorical) axes to a set
+                        of values; subtrees whose box holds none of the codes on such an axis are pruned.
+        :return: int32 array of the row ids whose point lies in [range_min, range_max] on every dimension, in
+                 tree order.
+        """
+        whole, partial, _, mask = self._walk(range_min, range_max, allowed)
+        nodes = np.concatenate([whole, partial])
+        crossing = np.concatenate([np.zeros(len(whole), dtype=bool), np.ones(len(partial), dtype=bool)])
+        order = np.argsort(self.start[nodes], kind='stable')
+        nodes, crossing = nodes[order], crossing[order]
+        lengths = self.end[nodes] - self.start[nodes]
+        positions = expand_ranges(self.start[nodes], self.end[nodes])
+        # Crossing leaves keep only their matching points (both are in start order), the other nodes all of them
+        keep = np.ones(len(positions), dtype=bool)
+        keep[np.repeat(crossing, lengths)] = mask
+        return self.row_ids[positions[keep]]
+
+    def aggregate(self, range_min, range_max, allowed=None):
+        """
+        COUNT, SUM, MIN and MAX of the augmented attributes over the points of a range query. Nodes inside the
+        query box contribute their stored subtree values, so only leaves crossing its boundary are scanned.
+        :return: Tuple of (count, sums, minimums, maximums), each but count an array with one entry per attribute.
+        """
+        if not self.aggregated:
+            raise ValueError("The tree has no aggregated attributes; call augment() first")
+        whole, _, positions, mask = self._walk(range_min, range_max, allowed)
+        block = self.agg_values[positions[mask]]
+        starts, ends = self.start[whole], self.end[whole]
+        count = int((ends - starts).sum()) + len(block)
+        sums = (self.agg_prefix[ends] - self.agg_prefix[starts]).sum(axis=0) + block.sum(axis=0)
+        mins = np.minimum(self.agg_min[whole].min(axis=0, initial=np.inf), block.min(axis=0, initial=np.inf))
+        maxs = np.maximum(self.agg_max[whole].max(axis=0, initial=-np.inf), block.max(axis=0, initial=-np.inf))
+        return count, sums, mins, maxs
+
+    def _walk(self, range_min, range_max, allowed):
+        """
+        Classify the nodes of a range query one tree level at a time.
+        :return: Tuple of (nodes inside the query box, leaves crossing its boundary in start order, the
+                 positions of the points of those leaves, and which of them match).
+        """
+        low = np.asarray(range_min, dtype=np.float64)
+        high = np.asarray(range_max, dtype=np.float64)
+        allowed = [(axis, np.unique(np.asarray(codes, dtype=np.float64))) for axis, codes in (allowed or {}).items()]
+        whole, partial = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        frontier = np.zeros(1 if len(self.row_ids) else 0, dtype=np.int64)
+        while len(frontier):
+            box_min, box_max = self.bbox_min[frontier], self.bbox_max[frontier]
+            # Nodes whose bounding box misses the query box are pruned, those inside it are reported whole
+            hit = ~((box_max < low).any(axis=1) | (box_min > high).any(axis=1))
+            contained = (box_min >= low).all(axis=1) & (box_max <= high).all(axis=1)
+            for axis, codes in allowed:
+                lo, hi = box_min[:, axis], box_max[:, axis]
+                first, last = np.searchsorted(codes, lo, 'left'), np.searchsorted(codes, hi, 'right')
+                hit &= last > first  # Some allowed code lies within the box on this axis
+                contained &= last - first == hi - lo + 1  # Every code in the box is allowed
+            whole.append(frontier[hit & contained])
+            crossing = frontier[hit & ~contained]
+            is_leaf = self.left[crossing] < 0
+            partial.append(crossing[is_leaf])
+            inner = crossing[~is_leaf]
+            frontier = np.concatenate([self.left[inner], self.right[inner]]).astype(np.int64)
+        whole, partial = np.concatenate(whole), np.concatenate(partial)
+        partial = partial[np.argsort(self.start[partial])]
+
+        # Test the points of the crossing leaves in one pass
+        positions = expand_ranges(self.start[partial], self.end[partial])
+        block = self.points[positions]
+        mask = ((block >= low) & (block <= high)).all(axis=1)
+        for axis, codes in allowed:
+            mask &= np.isin(block[:, axis], codes)
+        return whole, partial, positions, mask
+
+    def knn_query(self, point, k, weights=None):
+        """
+        Best-first branch-and-bound search for the k nearest points.
+        Distances are Euclidean after multiplying each coordinate difference by its weight, so dimensions on
+        very different scales (USD, rating points, YYYYMM dates) can be balanced.
+        :param point: Query coordinates, one per dimension.
+        :param k: Number of neighbours to return.
+        :param weights: Per-dimension scale factors (default 1 for every dimension).
+        :return: List of (row_id, distance) pairs, closest first.
+        """
+        if k <= 0 or len(self.row_ids) == 0:
+            return []
+        query = np.asarray(point, dtype=np.float64)
+        weights = np.ones_like(query) if weights is None else np.asarray(weights, dtype=np.float64)
+        best_dist = np.empty(0)  # Squared distances of the current k best candidates
+        best_ids = np.empty(0, dtype=np.int32)
+        nodes = [(0.0, 0)]  # Min-heap of (squared distance from the query to the node's box, node)
+        while nodes:
+            box_dist, node = heapq.heappop(nodes)
+            if len(best_dist) == k and box_dist > best_dist.max():
+                break  # No remaining node can hold a closer point
+            if self.left[node] < 0:
+                s, e = self.start[node], self.end[node]
+                dist = ((self.points[s:e] - query) * weights) ** 2
+                best_dist = np.concatenate([best_dist, dist.sum(axis=1)])
+                best_ids = np.concatenate([best_ids, self.row_ids[s:e]])
+                if len(best_dist) > k:
+                    keep = np.argpartition(best_dist, k - 1)[:k]
+                    best_dist, best_ids = best_dist[keep], best_ids[keep]
+            else:
+                for child in (self.left[node], self.right[node]):
+                    gap = np.maximum(np.maximum(self.bbox_min[child] - query, query - self.bbox_max[child]), 0.0)
+                    heapq.heappush(nodes, (float(((gap * weights) ** 2).sum()), int(child)))
+        order = np.lexsort((best_ids, best_dist))
+        return [(int(best_ids[i]), math.sqrt(best_dist[i])) for i in order]
+
+
+class DynamicKDTree:
+    """
+    k-d tree that accepts inserts and deletes, kept as a logarithmic forest of static FlatKDTrees.
+    New points go to a small buffer; when it fills, the buffer and the full levels 0..j-1 are rebuilt into level
+    j, which holds up to buffer_size * 2^j points. Every point is rebuilt O(log n) times, so inserts cost
+    amortized O(log^2 n), and a query visits at most log2(n / buffer_size) + 1 trees.
+    Deletes leave a tombstone in the point's level. Tombstoned points are dropped when their level is rebuilt,
+    and the whole forest is rebuilt into one tree once they outnumber the live points.
+    """
+
+    def __init__(self, k, leaf_size=32, buffer_size=256):
+        self.k = k
+        self.leaf_size = leaf_size
+        self.buffer_size = buffer_size
+        self.buffer_points = np.empty((buffer_size, k), dtype=np.float64)
+        self.buffer_ids = np.empty(buffer_size, dtype=np.int32)
+        self.buffer_count = 0
+        self.levels = []  # FlatKDTree or None per level
+        self.deleted = []  # Row ids tombstoned in each level
+        self.size = 0  # Live points
+        self.tombstones = 0
+
+    @classmethod
+    def build(cls, points, row_ids=None, leaf_size=32, buffer_size=256):
+        """Start from a bulk-loaded set of points, placed in the smallest level that can hold them."""
+        points = np.asarray(points, dtype=np.float64)
+        tree = cls(points.shape[1], leaf_size, buffer_size)
+        row_ids = np.arange(len(points), dtype=np.int32) if row_ids is None else np.asarray(row_ids, dtype=np.int32)
+        if len(points):
+            tree._place(points, row_ids, max(0, math.ceil(math.log2(len(points) / buffer_size))))
+        return tree
+
+    def __len__(self):
+        return self.size
+
+    def _place(self, points, row_ids, level):
+        while len(self.levels) <= level:
+            self.levels.append(None)
+            self.deleted.append(set())
+        self.levels[level] = FlatKDTree.build(points, row_ids, self.leaf_size)
+        self.deleted[level] = set()
+        self.size += len(row_ids)
+
+    def _take_level(self, level):
+        """Remove a level and return its live points and row ids."""
+        tree, deleted = self.levels[level], self.deleted[level]
+        self.levels[level] = None
+        self.deleted[level] = set()
+        live = np.ones(len(tree.row_ids), dtype=bool)
+        if deleted:
+            live = ~np.isin(tree.row_ids, np.fromiter(deleted, dtype=np.int32, count=len(deleted)))
+        self.size -= int(live.sum())
+        self.tombstones -= len(deleted)
+        return tree.points[live], tree.row_ids[live]
+
+    def _take_buffer(self):
+        points = self.buffer_points[:self.buffer_count].copy()
+        row_ids = self.buffer_ids[:self.buffer_count].copy()
+        self.size -= self.buffer_count
+        self.buffer_count = 0
+        return points, row_ids
 
-    # File reading and formatting
-    data = pd.read_csv("simplified_coffee.csv")
-    data["review_date"] = data["review_date"].apply(convert_date_to_numeric)
+    def insert(self, point, row_id):
+        """Add a point; amortized O(log^2 n)."""
+        self.buffer_points[self.buffer_count] = point
+        self.buffer_ids[self.buffer_count] = row_id
+        self.buffer_count += 1
+        self.size += 1
+        if self.buffer_count < self.buffer_size:
+            return
+        # Carry the buffer upwards through the full levels, like a binary counter
+        parts = [self._take_buffer()]
+        level = 0
+        while level < len(self.levels) and self.levels[level] is not None:
+            parts.append(self._take_level(level))
+            level += 1
+        self._place(np.concatenate([p for p, _ in parts]), np.concatenate([r for _, r in parts]), level)
 
+    def delete(self, point, row_id):
+        """
+        Remove the point stored under `row_id` at `point`.
+        :return: True if it was found, False otherwise.
+        """
+        point = np.asarray(point, dtype=np.float64)
+        # Points still in the buffer are removed directly, by moving the last buffered point into the gap
+        for i in np.flatnonzero(self.buffer_ids[:self.buffer_count] == row_id).tolist():
+            if np.array_equal(self.buffer_points[i], point):
+                last = self.buffer_count - 1
+                self.buffer_points[i], self.buffer_ids[i] = self.buffer_points[last], self.buffer_ids[last]
+                self.buffer_count = last
+                self.size -= 1
+                return True
+        for level, tree in enumerate(self.levels):
+            if tree is None or row_id in self.deleted[level]:
+                continue
+            if (tree.range_query(point, point) == row_id).any():
+                self.deleted[level].add(row_id)
+                self.tombstones += 1
+                self.size -= 1
+                if self.tombstones > self.size:
+                    self.rebuild()
+                return True
+        return False
+
+    def rebuild(self):
+        """Rebuild every live point into a single tree, dropping all tombstones."""
+        parts = [self._take_buffer()] + [self._take_level(level) for level, tree in enumerate(self.levels)
+                                         if tree is not None]
+        self.levels, self.deleted = [], []
+        points, row_ids = np.concatenate([p for p, _ in parts]), np.concatenate([r for _, r in parts])
+        if len(row_ids):
+            self._place(points, row_ids, max(0, math.ceil(math.log2(len(row_ids) / self.buffer_size))))
+
+    def range_query(self, range_min, range_max, allowed=None):
+        """
+        :param allowed: Optional dictionary {axis: codes}, as in FlatKDTree.range_query.
+        :return: int32 array of the live row ids whose point lies in [range_min, range_max] on every dimension.
+        """
+        low = np.asarray(range_min, dtype=np.float64)
+        high = np.asarray(range_max, dtype=np.float64)
+        block = self.buffer_points[:self.buffer_count]
+        mask = ((block >= low) & (block <= high)).all(axis=1)
+        for axis, codes in (allowed or {}).items():
+            mask &= np.isin(block[:, axis], codes)
+        found = [self.buffer_ids[:self.buffer_count][mask]]
+        for tree, deleted in zip(self.levels, self.deleted):
+            if tree is None:
+                continue
+            result = tree.range_query(low, high, allowed)
+            if deleted:
+                result = result[~np.isin(result, np.fromiter(deleted, dtype=np.int32, count=len(deleted)))]
+            found.append(result)
+        return np.concatenate(found)
+
+    def knn_query(self, point, k, weights=None):
+        """Same as FlatKDTree.knn_query, over the buffer and every level."""
+        query = np.asarray(point, dtype=np.float64)
+        weights = np.ones_like(query) if weights is None else np.asarray(weights, dtype=np.float64)
+        dist = np.sqrt(((((self.buffer_points[:self.buffer_count] - query) * weights) ** 2).sum(axis=1)))
+        candidates = list(zip(self.buffer_ids[:self.buffer_count].tolist(), dist.tolist()))
+        for tree, deleted in zip(self.levels, self.deleted):
+            if tree is not None:
+                # Ask for enough extra neighbours to make up for tombstoned ones
+                candidates.extend(pair for pair in tree.knn_query(query, k + len(deleted), weights)
+                                  if pair[0] not in deleted)
+        return sorted(candidates, key=lambda pair: (pair[1], pair[0]))[:k]
+
+
+def scale_weights(data, attributes):
+    """Weights of 1 / standard deviation per attribute, putting every dimension on a comparable scale."""
+    spread = data.points(attributes).std(axis=0)
+    return np.where(spread > 0, 1.0 / np.where(spread > 0, spread, 1.0), 1.0)
+
+
+def build_flat_kd_tree(data, attributes=None):
+    """
+    Build the KD-tree used by kdtree_main.
+    :param attributes: Axes of the tree; numeric attributes and dictionary-coded categorical ones can be mixed.
+                       Defaults to (price, rating, review date).
+    """
+    attributes = attributes or ['100g_USD', 'rating', 'review_date']
+    leading_axes = [axis for axis, attr in enumerate(attributes) if attr in CATEGORICAL_ATTRIBUTES]
+    tree = FlatKDTree.build(data.points(attributes), leading_axes=leading_axes)
+    tree.augment(data.points(AGGREGATE_ATTRIBUTES), AGGREGATE_ATTRIBUTES)
+    return tree
+
+
+def prepare_query(data, conditions):
+    """
+    Turn query conditions into a cached KD-tree and the arguments of its range_query/aggregate.
+    :return: Tuple of (tree, range_min, range_max, allowed).
+    """
     # Define the type of each attribute
     numeric_attributes = ['100g_USD', 'rating', 'review_date']
     categorical_attributes = ['roaster', 'roast', 'loc_country', 'origin']
@@ -116,11 +566,12 @@ def kdtree_main(selected_attributes=None, conditions=None, review_keywords=None,
             elif isinstance(value, list):
                 categorical_inputs[attr] = [val.strip().lower() for val in value]
 
-    # Build KD-tree
-    columns_for_splitting = ['100g_USD', 'rating', 'review_date']
-    points = list(data[columns_for_splitting].to_records(index=False))
-    full_data = data.values.tolist()  # Get all the data rows
-    kd_tree = build_kd_tree(points, full_data)
+    # Filtered categorical attributes become extra (integer-coded) axes of the tree, so their IN filters prune
+    # subtrees instead of post-filtering the numeric matches. One tree per set of axes, cached after the first query.
+    categorical_axes = [attr for attr in categorical_attributes if attr in categorical_inputs]
+    columns_for_splitting = ['100g_USD', 'rating', 'review_date'] + categorical_axes
+    kd_tree = registry.get_index("kdtree", lambda d: build_flat_kd_tree(d, columns_for_splitting),
+                                 key=tuple(categorical_axes) or None, index_class=FlatKDTree)
 
     # Prepare range_min and range_max for the range query
     range_min = []
@@ -134,23 +585,72 @@ def kdtree_main(selected_attributes=None, conditions=None, review_keywords=None,
             range_min.append(-math.inf)
             range_max.append(math.inf)
 
+    # Categorical axes are left unbounded above; the allowed codes restrict them instead
+    allowed = {axis: data.encode(attr, categorical_inputs[attr])
+               for axis, attr in enumerate(columns_for_splitting) if attr in categorical_inputs}
+    return kd_tree, range_min, range_max, allowed
+
+
+def kdtree_main(selected_attributes=None, conditions=None, review_keywords=None, num_neighbors=None):
+    if selected_attributes is None:
+        selected_attributes = []
+    if conditions is None:
+        conditions = {}
+
+    # Shared dataset, loaded once per process
+    data = registry.get_data()
+    kd_tree, range_min, range_max, allowed = prepare_query(data, conditions)
+
     # Perform range query
-    results = range_query(kd_tree, range_min, range_max)
+    results = kd_tree.range_query(range_min, range_max, allowed)
 
-    # Filter results based on categorical conditions (if any)
-    if categorical_inputs:
-        attribute_indices = {attr: list(data.columns).index(attr) for attr in categorical_inputs}
-        filtered_results = filter_by_categorical_inputs(results, categorical_inputs, attribute_indices)
-        results_to_hash = filtered_results
-    else:
-        results_to_hash = results
+    # Materialise the matching rows
+    results_to_hash = data.rows(results)
 
     # If review keywords are provided, perform LSH query
     if review_keywords and num_neighbors:
-        review_index = list(data.columns).index('review')
+        review_index = COLUMNS.index('review')
         lsh_results = lsh_query(review_keywords.split(), num_neighbors, results_to_hash, review_index)
         # Extract the rows from the LSH results and keep all fields
         final_results = [(row + [cosine_sim]) for row, cosine_sim in lsh_results]
         return final_results
     else:
         return results_to_hash
+
+
+def kdtree_aggregate_main(conditions=None):
+    """
+    Aggregate price and rating over the coffees matching `conditions` (same format as kdtree_main), without
+    materialising the rows.
+    :return: Dictionary with "count" and per-attribute "sum", "min", "max" and "avg".
+    """
+    kd_tree, range_min, range_max, allowed = prepare_query(registry.get_data(), conditions or {})
+    return summarize(*kd_tree.aggregate(range_min, range_max, allowed), kd_tree.aggregated)
+
+
+def kdtree_knn_main(point, k, weights=None):
+    """
+    Find the k coffees closest to `point` in (price, rating, review date) space.
+    :param point: Dictionary with a value for '100g_USD', 'rating' and 'review_date' (YYYYMM), or a row id to
+                  find the coffees most like an existing one.
+    :param k: Number of coffees to return.
+    :param weights: Per-dimension scale factors; defaults to 1 / standard deviation of each attribute.
+    :return: List of rows, each with its distance appended.
+    """
+    columns_for_splitting = ['100g_USD', 'rating', 'review_date']
+    data = registry.get_data()
+    kd_tree = registry.get_index("kdtree", build_flat_kd_tree, index_class=FlatKDTree)
+    query_id = None
+    if isinstance(point, dict):
+        point = [point[col] for col in columns_for_splitting]
+    else:
+        query_id = point
+        point = [data.value(col, point) for col in columns_for_splitting]
+    if weights is None:
+        weights = scale_weights(data, columns_for_splitting)
+
+    # A row id query would otherwise return the coffee itself at distance 0, so fetch one extra and drop it
+    neighbours = kd_tree.knn_query(point, k if query_id is None else k + 1, weights)
+    neighbours = [(row_id, distance) for row_id, distance in neighbours if row_id != query_id][:k]
+    rows = data.rows([row_id for row_id, _ in neighbours])
+    return [row + [distance] for row, (_, distance) in zip(rows, neighbours)]
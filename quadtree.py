@@ -1,81 +1,141 @@
-import pandas as pd
 import math
-from datetime import datetime
+import numpy as np
 from lsh import lsh_query
-
-
-# Helper to convert date to numeric
-def convert_date_to_numeric(date_str):
-    return int(datetime.strptime(date_str, "%B %Y").strftime("%Y%m"))
+from dataset import COLUMNS, AGGREGATE_ATTRIBUTES
+from kdtree import expand_ranges
+import registry
 
 
 # Octree Node Class
 class OctreeNode:
-    def __init__(self, bounds, capacity=4):
-        self.bounds = bounds  # Bounds: [[min_x, max_x], [min_y, max_y], [min_z, max_z]]
+    def __init__(self, bounds, capacity=4, max_depth=16, min_cell_size=None, depth=0):
+        self.bounds = bounds  # Bounds: [[min_x, max_x], [min_y, max_y], ...], one pair per dimension
         self.capacity = capacity
+        self.max_depth = max_depth  # Leaves at this depth are not split any further
+        self.min_cell_size = min_cell_size  # Per-dimension sizes; cells no larger on every dimension are not split
+        self.depth = depth
         self.points = []  # Stores points within the bounds
-        self.children = None  # Eight child nodes after splitting
+        self.mixed = False  # Whether the stored points are not all identical
+        self.children = None  # 2^d child nodes after splitting (eight for an octree, four for a quadtree)
 
     def is_within_bounds(self, point):
         """Check if a point lies within the node's bounds."""
-        for i in range(3):
+        for i in range(len(self.bounds)):
             if not (self.bounds[i][0] <= point[i] <= self.bounds[i][1]):
                 return False
         return True
 
     def split(self):
-        """Split the node into 8 children with equal sub-bounds."""
-        x_mid = (self.bounds[0][0] + self.bounds[0][1]) / 2
-        y_mid = (self.bounds[1][0] + self.bounds[1][1]) / 2
-        z_mid = (self.bounds[2][0] + self.bounds[2][1]) / 2
-
-        sub_bounds = [
-            [[self.bounds[0][0], x_mid], [self.bounds[1][0], y_mid], [self.bounds[2][0], z_mid]],  # Bottom-left-front
-            [[x_mid, self.bounds[0][1]], [self.bounds[1][0], y_mid], [self.bounds[2][0], z_mid]],  # Bottom-right-front
-            [[self.bounds[0][0], x_mid], [y_mid, self.bounds[1][1]], [self.bounds[2][0], z_mid]],  # Top-left-front
-            [[x_mid, self.bounds[0][1]], [y_mid, self.bounds[1][1]], [self.bounds[2][0], z_mid]],  # Top-right-front
-            [[self.bounds[0][0], x_mid], [self.bounds[1][0], y_mid], [z_mid, self.bounds[2][1]]],  # Bottom-left-back
-            [[x_mid, self.bounds[0][1]], [self.bounds[1][0], y_mid], [z_mid, self.bounds[2][1]]],  # Bottom-right-back
-            [[self.bounds[0][0], x_mid], [y_mid, self.bounds[1][1]], [z_mid, self.bounds[2][1]]],  # Top-left-back
-            [[x_mid, self.bounds[0][1]], [y_mid, self.bounds[1][1]], [z_mid, self.bounds[2][1]]],  # Top-right-back
-        ]
-
-        self.children = [OctreeNode(bounds, self.capacity) for bounds in sub_bounds]
-
-    def insert(self, point, full_data):
+        """
+        Split the node into 2^d children with equal sub-bounds. Bit i of a child's index selects the upper half
+        of dimension i, so in 3D the order is bottom-left-front, bottom-right-front, top-left-front, ...
+        """
+        sub_bounds = []
+        for child in range(2 ** len(self.bounds)):
+            child_bounds = []
+            for i, (low, high) in enumerate(self.bounds):
+                mid = (low + high) / 2
+                child_bounds.append([mid, high] if (child >> i) & 1 else [low, mid])
+            sub_bounds.append(child_bounds)
+
+        self.children = [OctreeNode(bounds, self.capacity, self.max_depth, self.min_cell_size, self.depth + 1)
+                         for bounds in sub_bounds]
+
+    def can_split(self, point):
+        """
+        Whether a full leaf should split to make room for `point`. It becomes an overflow bucket instead at the
+        maximum depth, once the cell reaches the minimum size, or when all its points are the same as `point`,
+        since no split could ever separate identical points.
+        """
+        if self.depth >= self.max_depth:
+            return False
+        if self.min_cell_size is not None and all(high - low <= size for (low, high), size
+                                                  in zip(self.bounds, self.min_cell_size)):
+            return False
+        return self.mixed or list(self.points[0][0]) != list(point)
+
+    def insert(self, point, row_id):
         """Insert a point into the Octree."""
         if not self.is_within_bounds(point):
             return False
 
         if self.children is None:
-            if len(self.points) < self.capacity:
-                self.points.append((point, full_data))
+            if len(self.points) < self.capacity or not self.can_split(point):
+                self.mixed = self.mixed or (bool(self.points) and list(self.points[0][0]) != list(point))
+                self.points.append((point, row_id))
                 return True
             else:
                 self.split()
 
         # Insert into child nodes
         for child in self.children:
-            if child.insert(point, full_data):
+            if child.insert(point, row_id):
                 return True
 
         return False
 
+    def stats(self):
+        """
+        Depth and occupancy statistics of the subtree, for tuning capacity, max_depth and min_cell_size.
+        :return: Dictionary with node/leaf counts, depths, points per leaf and the number of overflow buckets
+                 (leaves holding more than `capacity` points).
+        """
+        nodes = leaves = empty_leaves = overflow_leaves = points = 0
+        depth_histogram = {}
+        leaf_sizes = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            points += len(node.points)
+            if node.children is None:
+                leaves += 1
+                depth_histogram[node.depth] = depth_histogram.get(node.depth, 0) + 1
+                leaf_sizes.append(len(node.points))
+                empty_leaves += not node.points
+                overflow_leaves += len(node.points) > node.capacity
+            else:
+                stack.extend(node.children)
+        return {
+            "nodes": nodes,
+            "leaves": leaves,
+            "points": points,
+            "max_depth": max(depth_histogram),
+            "mean_leaf_depth": sum(depth * count for depth, count in depth_histogram.items()) / leaves,
+            "leaf_depths": dict(sorted(depth_histogram.items())),
+            "empty_leaves": empty_leaves,
+            "overflow_leaves": overflow_leaves,
+            "max_leaf_points": max(leaf_sizes),
+            "mean_leaf_points": sum(leaf_sizes) / leaves,
+        }
+
+    def collect(self, results):
+        """Append the row id of every point in the subtree, in the order range_query visits them."""
+        results.extend(row_id for _, row_id in self.points)
+        if self.children is not None:
+            for child in self.children:
+                child.collect(results)
+        return results
+
     def range_query(self, range_min, range_max, results=None):
         """Perform a range query and collect results."""
         if results is None:
             results = []
 
+        dims = range(len(self.bounds))
         # Check if the current node intersects with the range
-        for i in range(3):
+        for i in dims:
             if self.bounds[i][1] < range_min[i] or self.bounds[i][0] > range_max[i]:
                 return results
 
+        # A node whose bounds lie inside the range is reported whole, without testing its points
+        if all(range_min[i] <= self.bounds[i][0] and self.bounds[i][1] <= range_max[i] for i in dims):
+            return self.collect(results)
+
         # Check points within the current node
-        for point, full_data in self.points:
-            if all(range_min[i] <= point[i] <= range_max[i] for i in range(3)):
-                results.append(full_data)
+        for point, row_id in self.points:
+            if all(range_min[i] <= point[i] <= range_max[i] for i in dims):
+                results.append(row_id)
 
         # Query child nodes if they exist
         if self.children is not None:
@@ -85,22 +145,382 @@ class OctreeNode:
         return results
 
 
-# Filter for the categorical arguments
-def filter_by_categorical_inputs(results, categorical_inputs, attribute_indices):
-    """Filter results based on categorical conditions."""
-    filtered_results = []
-    for result in results:
-        match = True
-        for attr, values in categorical_inputs.items():
-            idx = attribute_indices[attr]
-            dataset_value = str(result[idx]).strip().lower()  # Normalize dataset value
-            search_values = [val.strip().lower() for val in values]  # Normalize search values
-            if dataset_value not in search_values:
-                match = False
+class FlatOctree:
+    """
+    Pointer-free copy of an OctreeNode tree. Nodes are stored breadth-first so the children of a node are
+    contiguous, while points are stored depth-first so every subtree owns one contiguous slice: node i holds
+    points[point_start[i]:point_end[i]] and its whole subtree points[point_start[i]:subtree_end[i]].
+    """
+
+    def __init__(self, bounds, first_child, point_start, point_end, subtree_end, points, row_ids):
+        self.bounds = bounds  # (m, d, 2) float64 [min, max] per dimension
+        self.first_child = first_child  # (m,) int32 index of the first child, -1 for a leaf
+        self.point_start = point_start  # (m,) int64 first point of the node
+        self.point_end = point_end  # (m,) int64 one past the node's own points
+        self.subtree_end = subtree_end  # (m,) int64 one past the last point of the subtree
+        self.points = points  # (n, d) float64
+        self.row_ids = row_ids  # (n,) int32
+        self.fanout = 2 ** bounds.shape[1]
+
+    @classmethod
+    def from_tree(cls, root):
+        """Lay out an OctreeNode tree: nodes breadth-first, points depth-first."""
+        nodes = [root]
+        first_child = []
+        for node in nodes:  # `nodes` grows while iterating, giving a breadth-first order
+            if node.children is None:
+                first_child.append(-1)
+            else:
+                first_child.append(len(nodes))
+                nodes.extend(node.children)
+        dims = len(root.bounds)
+        fanout = 2 ** dims
+
+        # Depth-first (pre-order) walk to place every node's points
+        point_start = np.zeros(len(nodes), dtype=np.int64)
+        point_end = np.zeros(len(nodes), dtype=np.int64)
+        order = []
+        position = 0
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            order.append(i)
+            point_start[i] = position
+            position += len(nodes[i].points)
+            point_end[i] = position
+            if first_child[i] >= 0:
+                stack.extend(range(first_child[i] + fanout - 1, first_child[i] - 1, -1))
+        # Children come after their parent in breadth-first order, so walk backwards
+        subtree_end = point_end.copy()
+        for i in range(len(nodes) - 1, -1, -1):
+            if first_child[i] >= 0:
+                subtree_end[i] = subtree_end[first_child[i] + fanout - 1]
+
+        return cls(
+            bounds=np.array([node.bounds for node in nodes], dtype=np.float64).reshape(len(nodes), dims, 2),
+            first_child=np.array(first_child, dtype=np.int32),
+            point_start=point_start,
+            point_end=point_end,
+            subtree_end=subtree_end,
+            points=np.array([list(point) for i in order for point, _ in nodes[i].points],
+                            dtype=np.float64).reshape(-1, dims),
+            row_ids=np.array([row_id for i in order for _, row_id in nodes[i].points], dtype=np.int32),
+        )
+
+    def to_arrays(self):
+        return {"bounds": self.bounds, "first_child": self.first_child, "point_start": self.point_start,
+                "point_end": self.point_end, "subtree_end": self.subtree_end, "points": self.points,
+                "row_ids": self.row_ids}, {}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        return cls(arrays["bounds"], arrays["first_child"], arrays["point_start"], arrays["point_end"],
+                   arrays["subtree_end"], arrays["points"], arrays["row_ids"])
+
+    def range_query(self, range_min, range_max):
+        """
+        Same result, in the same order, as OctreeNode.range_query on the original tree.
+        :return: int32 array of row ids.
+        """
+        found = []
+        low = np.asarray(range_min, dtype=np.float64)
+        high = np.asarray(range_max, dtype=np.float64)
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            bounds = self.bounds[node]
+            # Skip nodes that do not intersect the range
+            if np.any(bounds[:, 1] < low) or np.any(bounds[:, 0] > high):
+                continue
+            start = self.point_start[node]
+            # Nodes whose bounds lie inside the range are reported as one slice
+            if np.all(bounds[:, 0] >= low) and np.all(bounds[:, 1] <= high):
+                found.append(self.row_ids[start:self.subtree_end[node]])
+                continue
+            end = self.point_end[node]
+            if end > start:
+                block = self.points[start:end]
+                found.append(self.row_ids[start:end][np.all((block >= low) & (block <= high), axis=1)])
+            first = self.first_child[node]
+            if first >= 0:
+                stack.extend(range(first + self.fanout - 1, first - 1, -1))
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int32)
+
+
+def morton_codes(grid, bits):
+    """
+    Interleave the bits of integer grid coordinates into Morton (Z-order) codes, bit b of dimension i going to
+    bit b * d + i of the code.
+    :param grid: (n, d) array of coordinates in [0, 2^bits).
+    :return: (n,) uint64 array.
+    """
+    grid = np.asarray(grid, dtype=np.uint64)
+    dims = grid.shape[1]
+    codes = np.zeros(len(grid), dtype=np.uint64)
+    for bit in range(bits):
+        for dim in range(dims):
+            codes |= ((grid[:, dim] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(bit * dims + dim)
+    return codes
+
+
+class LinearOctree:
+    """
+    Octree stored as its leaves only, in Morton order. Points are quantised to a 2^bits grid per dimension and
+    sorted by Morton code, so every octree cell is a contiguous run of `codes`, located by binary search.
+    Leaf cells are kept as parallel arrays (code, level, row range); a cell at level L covers the codes sharing its
+    first d * L bits. Works for any number of dimensions d (a quadtree for d = 2).
+    """
+
+    def __init__(self, codes, points, row_ids, low, high, scale, bits, capacity, cell_code, cell_level, cell_start,
+                 cell_end):
+        self.codes = codes  # (n,) uint64 sorted Morton codes
+        self.points = points  # (n, d) float64, in code order
+        self.row_ids = row_ids  # (n,) int32, in code order
+        self.low = low  # (d,) float64 minimum of every dimension
+        self.high = high  # (d,) float64 maximum of every dimension
+        self.scale = scale  # (d,) float64 grid cells per unit of every dimension
+        self.bits = bits
+        self.capacity = capacity
+        self.cell_code = cell_code  # (c,) uint64 first code of each leaf cell
+        self.cell_level = cell_level  # (c,) int8
+        self.cell_start = cell_start  # (c,) int64 first point of the cell
+        self.cell_end = cell_end  # (c,) int64 one past the last point of the cell
+        self.dims = len(low)
+        # Optional augmentation for density(), see augment()
+        self.aggregated = []  # Names of the aggregated attributes
+        self.agg_values = None  # (n, a) float64, in code order
+        self.agg_prefix = None  # (n + 1, a) float64 prefix sums of agg_values; a cell's sum is one subtraction
+
+    @classmethod
+    def build(cls, points, row_ids=None, capacity=16, bits=None):
+        """
+        Quantise, sort once by Morton code, then split cells holding more than `capacity` points level by level.
+        :param points: (n, d) array of coordinates.
+        :param row_ids: Row id of each point (defaults to 0..n-1).
+        :param capacity: Maximum number of points in a leaf cell (exceeded only at the finest level).
+        :param bits: Grid resolution per dimension (default: as fine as a 64-bit code allows).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        n, dims = points.shape
+        bits = bits or min(63 // dims, 32)
+        row_ids = np.arange(n, dtype=np.int32) if row_ids is None else np.asarray(row_ids, dtype=np.int32)
+        low = points.min(axis=0) if n else np.zeros(dims)
+        high = points.max(axis=0) if n else np.zeros(dims)
+        scale = np.where(high > low, (2 ** bits - 1) / np.where(high > low, high - low, 1.0), 0.0)
+        tree = cls(None, None, None, low, high, scale, bits, capacity, None, None, None, None)
+        codes = morton_codes(tree._grid(points), bits)
+        order = np.argsort(codes, kind='stable')
+        tree.codes, tree.points, tree.row_ids = codes[order], points[order], row_ids[order]
+
+        # Split level by level; children of a cell are found with one binary search per child
+        cells = []
+        prefix, start, end = np.zeros(1, dtype=np.uint64), np.zeros(1, dtype=np.int64), np.full(1, n, dtype=np.int64)
+        for level in range(bits + 1):
+            occupied = end > start
+            prefix, start, end = prefix[occupied], start[occupied], end[occupied]
+            leaf = (end - start <= capacity) | (level == bits)
+            cells.append((prefix[leaf] << np.uint64(dims * (bits - level)), np.full(leaf.sum(), level),
+                          start[leaf], end[leaf]))
+            if leaf.all():
+                break
+            prefix, start, end = tree._children(prefix[~leaf], level)
+        tree.cell_code, tree.cell_level, tree.cell_start, tree.cell_end = (
+            np.concatenate([c[i] for c in cells]) for i in range(4))
+        order = np.argsort(tree.cell_start, kind='stable')
+        tree.cell_code, tree.cell_level = tree.cell_code[order], tree.cell_level[order].astype(np.int8)
+        tree.cell_start, tree.cell_end = tree.cell_start[order], tree.cell_end[order]
+        return tree
+
+    def augment(self, values, attributes):
+        """
+        Store extra attributes in code order with their prefix sums, so density() can average them per cell.
+        :param values: (rows, a) array of the attribute values, indexed by row id.
+        :param attributes: Names of the a attributes.
+        """
+        self.aggregated = list(attributes)
+        self.agg_values = np.asarray(values, dtype=np.float64)[self.row_ids].reshape(len(self.row_ids), -1)
+        self.agg_prefix = np.vstack([np.zeros((1, self.agg_values.shape[1])), np.cumsum(self.agg_values, axis=0)])
+
+    def to_arrays(self):
+        arrays = {"codes": self.codes, "points": self.points, "row_ids": self.row_ids, "low": self.low,
+                  "high": self.high, "scale": self.scale, "cell_code": self.cell_code, "cell_level": self.cell_level,
+                  "cell_start": self.cell_start, "cell_end": self.cell_end}
+        if self.aggregated:
+            arrays.update(agg_values=self.agg_values, agg_prefix=self.agg_prefix)
+        return arrays, {"bits": self.bits, "capacity": self.capacity, "aggregated": self.aggregated}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        tree = cls(arrays["codes"], arrays["points"], arrays["row_ids"], arrays["low"], arrays["high"],
+                   arrays["scale"], params["bits"], params["capacity"], arrays["cell_code"], arrays["cell_level"],
+                   arrays["cell_start"], arrays["cell_end"])
+        if params["aggregated"]:
+            tree.aggregated = params["aggregated"]
+            tree.agg_values, tree.agg_prefix = arrays["agg_values"], arrays["agg_prefix"]
+        return tree
+
+    def _grid(self, values):
+        """Quantise coordinates to grid cells; values outside the data's bounds are clamped to the edge cells."""
+        with np.errstate(invalid='ignore'):
+            grid = np.where(self.scale > 0, np.floor((np.asarray(values, dtype=np.float64) - self.low) * self.scale), 0)
+        return np.clip(np.nan_to_num(grid), 0, 2 ** self.bits - 1).astype(np.int64)
+
+    def range_query(self, range_min, range_max):
+        """
+        Decompose the query box into Morton intervals one level at a time, locating each with a binary search.
+        Cells strictly inside the quantised box are reported whole; leaf cells crossing its boundary are tested
+        point by point.
+        :return: int32 array of the row ids whose point lies in [range_min, range_max], in Morton order.
+        """
+        low = np.asarray(range_min, dtype=np.float64)
+        high = np.asarray(range_max, dtype=np.float64)
+        if not len(self.codes) or (high < self.low).any() or (low > self.high).any():
+            return np.empty(0, dtype=np.int32)
+        outer_lo, outer_hi, inner_lo, inner_hi = self._query_grid(low, high)
+
+        whole, partial = [], []
+        prefix, corner = np.zeros(1, dtype=np.uint64), np.zeros((1, self.dims), dtype=np.int64)
+        start, end = np.zeros(1, dtype=np.int64), np.full(1, len(self.codes), dtype=np.int64)
+        fanout = 2 ** self.dims
+        child_offset = (np.arange(fanout)[:, None] >> np.arange(self.dims)) & 1  # Bit i of child c is on dimension i
+        for level in range(self.bits + 1):
+            side = 2 ** (self.bits - level)
+            keep = (end > start) & ~((corner + side - 1 < outer_lo).any(axis=1) | (corner > outer_hi).any(axis=1))
+            prefix, corner, start, end = prefix[keep], corner[keep], start[keep], end[keep]
+            inside = (corner >= inner_lo).all(axis=1) & (corner + side - 1 <= inner_hi).all(axis=1)
+            whole.append(np.column_stack([start[inside], end[inside]]))
+            leaf = ~inside & ((end - start <= self.capacity) | (level == self.bits))
+            partial.append(np.column_stack([start[leaf], end[leaf]]))
+            split = ~inside & ~leaf
+            if not split.any():
                 break
-        if match:
-            filtered_results.append(result)
-    return filtered_results
+            prefix, start, end = self._children(prefix[split], level)
+            corner = (corner[split][:, None, :] + child_offset * (side // 2)).reshape(-1, self.dims)
+
+        whole, partial = np.concatenate(whole), np.concatenate(partial)
+        ranges = np.concatenate([whole, partial])
+        crossing = np.concatenate([np.zeros(len(whole), dtype=bool), np.ones(len(partial), dtype=bool)])
+        order = np.argsort(ranges[:, 0], kind='stable')
+        ranges, crossing = ranges[order], crossing[order]
+        positions = expand_ranges(ranges[:, 0], ranges[:, 1])
+        tested = np.repeat(crossing, ranges[:, 1] - ranges[:, 0])
+        block = self.points[positions[tested]]
+        keep = np.ones(len(positions), dtype=bool)
+        keep[tested] = ((block >= low) & (block <= high)).all(axis=1)
+        return self.row_ids[positions[keep]]
+
+    def _query_grid(self, low, high):
+        """
+        Grid boxes of a query: cells within [outer_lo, outer_hi] may hold matches, and every point of a cell within
+        [inner_lo, inner_hi] matches.
+        """
+        outer_lo, outer_hi = self._grid(low), self._grid(high)
+        inner_lo = np.where(low <= self.low, 0, outer_lo + 1)
+        inner_hi = np.where(high >= self.high, 2 ** self.bits - 1, outer_hi - 1)
+        return outer_lo, outer_hi, inner_lo, inner_hi
+
+    def density(self, range_min=None, range_max=None, resolution=64, attribute=None):
+        """
+        Point counts on a regular grid over the data's bounds, for heatmaps. The resolution is rounded up to a
+        power of two so that every grid cell is a cell of the tree: its count is one binary search, and only the
+        points of cells crossing the boundary of the query region are tested.
+        :param range_min: Optional lower corner of the region to count (None for no bound).
+        :param range_max: Optional upper corner of the region.
+        :param resolution: Grid cells per dimension.
+        :param attribute: Optional augmented attribute to average per cell.
+        :return: Tuple of (counts, means, edges): counts (and means, None without `attribute`; NaN in empty
+                 cells) have one axis per dimension, edges[i] holds the cell boundaries on dimension i.
+        """
+        level = min(self.bits, max(0, math.ceil(math.log2(max(resolution, 1)))))
+        side = 2 ** (self.bits - level)
+        cells = np.arange(2 ** (self.dims * level), dtype=np.uint64)
+        bounds = np.searchsorted(self.codes, np.append(cells, np.uint64(len(cells))) << np.uint64(
+            self.dims * (self.bits - level)), 'left')
+        starts, ends = bounds[:-1], bounds[1:]
+        counts = (ends - starts).astype(np.int64)
+        column = self.aggregated.index(attribute) if attribute is not None else None
+        sums = self.agg_prefix[ends, column] - self.agg_prefix[starts, column] if column is not None else None
+        # Grid coordinates of every cell, undoing the bit interleaving
+        coords = np.zeros((len(cells), self.dims), dtype=np.int64)
+        for bit in range(level):
+            for dim in range(self.dims):
+                coords[:, dim] |= ((cells >> np.uint64(bit * self.dims + dim)) & np.uint64(1)).astype(np.int64) << bit
+
+        if range_min is not None or range_max is not None:
+            low = np.full(self.dims, -np.inf) if range_min is None else np.asarray(
+                [-np.inf if v is None else v for v in range_min], dtype=np.float64)
+            high = np.full(self.dims, np.inf) if range_max is None else np.asarray(
+                [np.inf if v is None else v for v in range_max], dtype=np.float64)
+            outer_lo, outer_hi, inner_lo, inner_hi = self._query_grid(low, high)
+            corner = coords * side
+            inside = (corner >= inner_lo).all(axis=1) & (corner + side - 1 <= inner_hi).all(axis=1)
+            outside = (corner + side - 1 < outer_lo).any(axis=1) | (corner > outer_hi).any(axis=1)
+            if (high < self.low).any() or (low > self.high).any():
+                outside[:] = True
+            crossing = ~inside & ~outside & (counts > 0)
+            # Count the crossing cells point by point
+            positions = expand_ranges(starts[crossing], ends[crossing])
+            cell_of = np.repeat(np.flatnonzero(crossing), counts[crossing])
+            block = self.points[positions]
+            match = ((block >= low) & (block <= high)).all(axis=1)
+            counts[~inside] = 0
+            counts += np.bincount(cell_of[match], minlength=len(cells))
+            if sums is not None:
+                sums[~inside] = 0
+                sums += np.bincount(cell_of[match], weights=self.agg_values[positions[match], column],
+                                    minlength=len(cells))
+
+        shape = (2 ** level,) * self.dims
+        grid = np.zeros(shape, dtype=np.int64)
+        grid[tuple(coords.T)] = counts
+        means = None
+        if sums is not None:
+            means = np.full(shape, np.nan)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[tuple(coords.T)] = np.where(counts > 0, sums / counts, np.nan)
+        edges = [self.low[dim] + np.arange(2 ** level + 1) * side / self.scale[dim] if self.scale[dim] > 0
+                 else np.full(2 ** level + 1, self.low[dim]) for dim in range(self.dims)]
+        return grid, means, edges
+
+    def _children(self, prefix, level):
+        """Prefixes and point ranges of the 2^d children of the cells `prefix` at `level`."""
+        fanout = 2 ** self.dims
+        shift = np.uint64(self.dims * (self.bits - level - 1))
+        child = (prefix[:, None] * np.uint64(fanout) + np.arange(fanout, dtype=np.uint64)).ravel()
+        # d * bits <= 63, so the end code of the last child still fits in 64 bits
+        start = np.searchsorted(self.codes, child << shift, 'left').astype(np.int64)
+        end = np.searchsorted(self.codes, (child + np.uint64(1)) << shift, 'left').astype(np.int64)
+        return child, start, end
+
+
+def build_linear_octree(data, attributes=None):
+    """
+    Bulk-load a LinearOctree over the given numeric attributes of every row: an octree for three attributes, a
+    quadtree for two, a binary partition for one. Defaults to (price, rating, review date).
+    """
+    tree = LinearOctree.build(data.points(attributes or ['100g_USD', 'rating', 'review_date']))
+    tree.augment(data.points(AGGREGATE_ATTRIBUTES), AGGREGATE_ATTRIBUTES)
+    return tree
+
+
+def build_octree(data, capacity=4, max_depth=16, min_cell_size=None, attributes=None):
+    """
+    Build an Octree (or a quadtree / binary partition for fewer attributes) over every row.
+    :param capacity: Points a leaf holds before it splits.
+    :param max_depth: Depth after which leaves become overflow buckets instead of splitting.
+    :param min_cell_size: Optional cell size per attribute below which leaves stop splitting.
+    :param attributes: Numeric attributes to index, default (price, rating, review date).
+    """
+    columns_for_splitting = attributes or ['100g_USD', 'rating', 'review_date']
+    points = data.points(columns_for_splitting)
+
+    # Define overall bounds
+    bounds = [[lo, hi] for lo, hi in zip(points.min(axis=0).tolist(), points.max(axis=0).tolist())]
+
+    octree = OctreeNode(bounds, capacity, max_depth, min_cell_size)
+    for row_id, point in enumerate(points.tolist()):
+        octree.insert(point, row_id)
+    return octree
 
 
 # Main Function
@@ -110,26 +530,8 @@ def octree_main(selected_attributes=None, conditions=None, review_keywords=None,
     if conditions is None:
         conditions = {}
 
-    data = pd.read_csv("simplified_coffee.csv")
-    data["review_date"] = data["review_date"].apply(convert_date_to_numeric)
-
-    # Prepare data for Octree
-    columns_for_splitting = ['100g_USD', 'rating', 'review_date']
-    points = list(data[columns_for_splitting].to_records(index=False))
-    full_data = data.values.tolist()
-
-    # Define overall bounds
-    bounds = [
-        [data['100g_USD'].min(), data['100g_USD'].max()],
-        [data['rating'].min(), data['rating'].max()],
-        [data['review_date'].min(), data['review_date'].max()],
-    ]
-
-    # Build Octree
-    octree = OctreeNode(bounds)
-
-    for point, row in zip(points, full_data):
-        octree.insert(point, row)
+    # Shared dataset, loaded once per process
+    data = registry.get_data()
 
     # Define the type of each attribute
     numeric_attributes = ['100g_USD', 'rating', 'review_date']
@@ -150,35 +552,62 @@ def octree_main(selected_attributes=None, conditions=None, review_keywords=None,
             elif isinstance(value, list):
                 categorical_inputs[attr] = [val.strip().lower() for val in value]
 
+    # Index only the constrained dimensions: an octree for three, a quadtree for two, a binary partition for one.
+    # One tree per subset, cached after the first query.
+    columns_for_splitting = [col for col in numeric_attributes
+                             if col in numeric_ranges and any(bound is not None for bound in numeric_ranges[col])]
+
     # Prepare range_min and range_max for the range query
     range_min = []
     range_max = []
     for col in columns_for_splitting:
-        if col in numeric_ranges:
-            min_val, max_val = numeric_ranges[col]
-            range_min.append(min_val if min_val is not None else -math.inf)
-            range_max.append(max_val if max_val is not None else math.inf)
-        else:
-            range_min.append(-math.inf)
-            range_max.append(math.inf)
+        min_val, max_val = numeric_ranges[col]
+        range_min.append(min_val if min_val is not None else -math.inf)
+        range_max.append(max_val if max_val is not None else math.inf)
 
     # Perform range query
-    results = octree.range_query(range_min, range_max)
+    if columns_for_splitting:
+        octree = registry.get_index("linear_octree", lambda d: build_linear_octree(d, columns_for_splitting),
+                                    key=tuple(columns_for_splitting), index_class=LinearOctree)
+        results = octree.range_query(range_min, range_max)
+    else:
+        results = np.arange(len(data), dtype=np.int32)
 
     # Filter results based on categorical conditions (if any)
     if categorical_inputs:
-        attribute_indices = {attr: list(data.columns).index(attr) for attr in categorical_inputs}
-        filtered_results = filter_by_categorical_inputs(results, categorical_inputs, attribute_indices)
-        results_to_hash = filtered_results
-    else:
-        results_to_hash = results
+        results = data.filter_categorical(results, categorical_inputs)
+
+    # Materialise the matching rows
+    results_to_hash = data.rows(results)
 
     # If review keywords are provided, perform LSH query
     if review_keywords and num_neighbors:
-        review_index = list(data.columns).index('review')
+        review_index = COLUMNS.index('review')
         lsh_results = lsh_query(review_keywords.split(), num_neighbors, results_to_hash, review_index)
         # Extract the rows from the LSH results and keep all fields
         final_results = [(row + [cosine_sim]) for row, cosine_sim in lsh_results]
         return final_results
     else:
         return results_to_hash
+
+
+def octree_density_main(attributes=None, conditions=None, resolution=64, mean_of='rating'):
+    """
+    Density heatmap of the coffees, e.g. price x rating, computed from the cell counts of a quadtree/octree over
+    `attributes` without materialising any rows.
+    :param attributes: Numeric attributes spanning the grid (default price and rating).
+    :param conditions: Optional {attribute: (min, max)} limiting the counted region; only `attributes` can be bounded.
+    :param resolution: Grid cells per attribute (rounded up to a power of two).
+    :param mean_of: Attribute averaged per cell ('100g_USD' or 'rating'), or None.
+    :return: Tuple of (counts, means, edges) as returned by LinearOctree.density.
+    """
+    attributes = attributes or ['100g_USD', 'rating']
+    conditions = conditions or {}
+    unsupported = [attr for attr in conditions if attr not in attributes]
+    if unsupported:
+        raise ValueError(f"Conditions must be on the heatmap attributes {attributes}, got {unsupported}")
+    octree = registry.get_index("linear_octree", lambda d: build_linear_octree(d, attributes),
+                                key=tuple(attributes), index_class=LinearOctree)
+    range_min = [conditions.get(attr, (None, None))[0] for attr in attributes]
+    range_max = [conditions.get(attr, (None, None))[1] for attr in attributes]
+    return octree.density(range_min, range_max, resolution, mean_of)
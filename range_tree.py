@@ -1,6 +1,9 @@
-import csv
+import math
+import numpy as np
 from datetime import datetime
 from lsh import lsh_query
+from dataset import AGGREGATE_ATTRIBUTES, summarize
+import registry
 
 
 class Node(object):
@@ -12,7 +15,7 @@ class Node(object):
         self.right = None
         self.isLeaf = False
         self.assoc = None
-        self.full_row = None
+        self.row_id = None
 
 
 def date_to_numeric(date_str, reference_date="January 2017"):
@@ -22,42 +25,17 @@ def date_to_numeric(date_str, reference_date="January 2017"):
     return numeric_value
 
 
-def load_data(filepath, categories):
-    with open(filepath, encoding='utf-8') as csvfile:
-        readCSV = csv.reader(csvfile, delimiter=",")
-        header = next(readCSV)
-
-        indices = [header.index(category) for category in categories]
-        data = []
-        all_data = []
-        for row in readCSV:
-            if len(indices) == 1:
-                if indices[0] == 7:  # Index of 'review_date'
-                    date_str = row[indices[0]]
-                    try:
-                        date_numeric = int(datetime.strptime(date_str, "%B %Y").strftime("%Y%m"))
-                    except ValueError:
-                        date_numeric = 0
-                    data.append((date_numeric, row))
-                else:
-                    value = float(row[indices[0]]) if row[indices[0]] != '' else 0.0
-                    data.append((value, row))
-            else:
-                values = []
-                for i in indices:
-                    if header[i].lower() == 'review_date':
-                        date_str = row[i]
-                        try:
-                            date_numeric = int(datetime.strptime(date_str, "%B %Y").strftime("%Y%m"))
-                        except ValueError:
-                            date_numeric = 0
-                        values.append(date_numeric)
-                    else:
-                        value = float(row[i]) if row[i] != '' else 0.0
-                        values.append(value)
-                data.append((tuple(values), row))
-            all_data.append(row)
-    return data, all_data
+def load_data(dataset, categories):
+    """Return (value, row_id) pairs over the given numeric attributes and the ids of all rows."""
+    all_data = list(range(len(dataset)))
+    if not categories:
+        return [], all_data
+    points = dataset.points(categories)
+    if len(categories) == 1:
+        values = points[:, 0].tolist()
+    else:
+        values = [tuple(point) for point in points.tolist()]
+    return list(zip(values, all_data)), all_data
 
 
 def contains_comma(value):
@@ -92,12 +70,12 @@ def ConstructRangeTree1d(data):
         value, row = data[0]
         node = Node(value)
         node.isLeaf = True
-        node.full_row = row
+        node.row_id = row
     else:
         mid_val = len(data) // 2
         value, row = data[mid_val]
         node = Node(value)
-        node.full_row = row
+        node.row_id = row
         node.left = ConstructRangeTree1d(data[:mid_val])
         node.right = ConstructRangeTree1d(data[mid_val + 1:])
     return node
@@ -110,12 +88,12 @@ def ConstructRangeTree2d(data, cur_dim=1):
         value, row = data[0]
         node = Node(value)
         node.isLeaf = True
-        node.full_row = row
+        node.row_id = row
     else:
         mid_val = len(data) // 2
         value, row = data[mid_val]
         node = Node(value)
-        node.full_row = row
+        node.row_id = row
         node.left = ConstructRangeTree2d(data[:mid_val], cur_dim)
         node.right = ConstructRangeTree2d(data[mid_val + 1:], cur_dim)
     if cur_dim == 1:
@@ -130,12 +108,12 @@ def ConstructRangeTree3d(data, cur_dim=1):
         value, row = data[0]
         node = Node(value)
         node.isLeaf = True
-        node.full_row = row
+        node.row_id = row
     else:
         mid_val = len(data) // 2
         value, row = data[mid_val]
         node = Node(value)
-        node.full_row = row
+        node.row_id = row
         node.left = ConstructRangeTree3d(data[:mid_val], cur_dim)
         node.right = ConstructRangeTree3d(data[mid_val + 1:], cur_dim)
     if cur_dim == 1:
@@ -186,7 +164,7 @@ def SearchRangeTree1d(tree, p1, p2, dim, cur_dim=1):
     if splitnode is None:
         return nodes
     if withinRange(getValue(splitnode, cur_dim, dim), [(p1, p2)], 1):
-        nodes.append(splitnode.full_row)
+        nodes.append(splitnode.row_id)
     nodes += SearchRangeTree1d(splitnode.left, p1, p2, dim, cur_dim)
     nodes += SearchRangeTree1d(splitnode.right, p1, p2, dim, cur_dim)
     return nodes
@@ -197,13 +175,13 @@ def SearchRangeTree2d(tree, x1, x2, y1, y2, dim, cur_dim=1):
     splitnode = FindSplitNode(tree, x1, x2, dim, cur_dim)
     if splitnode is None:
         return results
-    if withinRange(splitnode.value, [(x1, x2), (y1, y2)], dim):
-        results.append(splitnode.full_row)
+    if withinRange(splitnode.value[cur_dim - 1:], [(x1, x2), (y1, y2)], 2):
+        results.append(splitnode.row_id)
     vl = splitnode.left
     while vl is not None:
-        if withinRange(vl.value, [(x1, x2), (y1, y2)], dim):
-            results.append(vl.full_row)
-        if x1 <= vl.value[0]:
+        if withinRange(vl.value[cur_dim - 1:], [(x1, x2), (y1, y2)], 2):
+            results.append(vl.row_id)
+        if x1 <= getValue(vl, cur_dim, dim):
             if vl.right is not None:
                 results += SearchRangeTree1d(vl.right.assoc, y1, y2, dim, cur_dim + 1)
             vl = vl.left
@@ -211,9 +189,9 @@ def SearchRangeTree2d(tree, x1, x2, y1, y2, dim, cur_dim=1):
             vl = vl.right
     vr = splitnode.right
     while vr is not None:
-        if withinRange(vr.value, [(x1, x2), (y1, y2)], dim):
-            results.append(vr.full_row)
-        if x2 >= vr.value[0]:
+        if withinRange(vr.value[cur_dim - 1:], [(x1, x2), (y1, y2)], 2):
+            results.append(vr.row_id)
+        if x2 >= getValue(vr, cur_dim, dim):
             if vr.left is not None:
                 results += SearchRangeTree1d(vr.left.assoc, y1, y2, dim, cur_dim + 1)
             vr = vr.right
@@ -228,11 +206,11 @@ def SearchRangeTree3d(tree, x1, x2, y1, y2, z1, z2, dim, cur_dim=1):
     if splitnode is None:
         return results
     if withinRange(splitnode.value, [(x1, x2), (y1, y2), (z1, z2)], dim):
-        results.append(splitnode.full_row)
+        results.append(splitnode.row_id)
     vl = splitnode.left
     while vl is not None:
         if withinRange(vl.value, [(x1, x2), (y1, y2), (z1, z2)], dim):
-            results.append(vl.full_row)
+            results.append(vl.row_id)
         if x1 <= vl.value[0]:
             if vl.right is not None:
                 results += SearchRangeTree2d(vl.right.assoc, y1, y2, z1, z2, dim, cur_dim + 1)
@@ -242,7 +220,7 @@ def SearchRangeTree3d(tree, x1, x2, y1, y2, z1, z2, dim, cur_dim=1):
     vr = splitnode.right
     while vr is not None:
         if withinRange(vr.value, [(x1, x2), (y1, y2), (z1, z2)], dim):
-            results.append(vr.full_row)
+            results.append(vr.row_id)
         if x2 >= vr.value[0]:
             if vr.left is not None:
                 results += SearchRangeTree2d(vr.left.assoc, y1, y2, z1, z2, dim, cur_dim + 1)
@@ -252,6 +230,407 @@ def SearchRangeTree3d(tree, x1, x2, y1, y2, z1, z2, dim, cur_dim=1):
     return results
 
 
+class FlatRangeTree:
+    """
+    Pointer-free copy of a range tree. The nodes of the main tree and of every associated tree share one set of
+    arrays; children and associated trees are referenced by index (-1 for none).
+    """
+
+    def __init__(self, values, row_ids, left, right, assoc):
+        self.values = values  # (m, dim) float64, the full point stored in each node
+        self.row_ids = row_ids  # (m,) int32
+        self.left = left  # (m,) int32
+        self.right = right  # (m,) int32
+        self.assoc = assoc  # (m,) int32 root of the associated tree on the next dimension
+        self.dim = values.shape[1]
+        # Optional augmentation for aggregate queries, see augment()
+        self.aggregated = []  # Names of the aggregated attributes
+        self.agg_values = None  # (m, a) float64 aggregated values of each node's own point
+        self.sub_count = None  # (m,) int64 points in the node's subtree (within its own tree)
+        self.sub_sum = None  # (m, a) float64
+        self.sub_min = None  # (m, a) float64
+        self.sub_max = None  # (m, a) float64
+
+    @classmethod
+    def from_tree(cls, root, dim):
+        """Lay out a tree built by ConstructRangeTree1d/2d/3d. Node 0 is the root."""
+        nodes = [root] if root is not None else []
+        index = {id(root): 0}
+        for node in nodes:  # `nodes` grows while iterating
+            for child in (node.left, node.right, node.assoc):
+                if child is not None and id(child) not in index:
+                    index[id(child)] = len(nodes)
+                    nodes.append(child)
+
+        def ref(node):
+            return index[id(node)] if node is not None else -1
+
+        return cls(
+            values=np.array([node.value for node in nodes], dtype=np.float64).reshape(len(nodes), dim),
+            row_ids=np.array([node.row_id for node in nodes], dtype=np.int32),
+            left=np.array([ref(node.left) for node in nodes], dtype=np.int32),
+            right=np.array([ref(node.right) for node in nodes], dtype=np.int32),
+            assoc=np.array([ref(node.assoc) for node in nodes], dtype=np.int32),
+        )
+
+    def augment(self, values, attributes):
+        """
+        Store the count, sum, min and max of extra attributes over every node's subtree, so aggregate() can take
+        canonical subtrees of the last dimension whole.
+        :param values: (rows, a) array of the attribute values, indexed by row id.
+        :param attributes: Names of the a attributes.
+        """
+        self.aggregated = list(attributes)
+        width = len(self.aggregated)
+        self.agg_values = np.asarray(values, dtype=np.float64)[self.row_ids].reshape(len(self.row_ids), width)
+        self.sub_count = np.ones(len(self.row_ids), dtype=np.int64)
+        self.sub_sum = self.agg_values.copy()
+        self.sub_min = self.agg_values.copy()
+        self.sub_max = self.agg_values.copy()
+        # Group the nodes by depth within their own tree (the main tree or an associated one), starting from the roots
+        levels = []
+        frontier = np.concatenate([np.zeros(1 if len(self.row_ids) else 0, dtype=np.int64),
+                                   self.assoc[self.assoc >= 0].astype(np.int64)])
+        while len(frontier):
+            levels.append(frontier)
+            children = np.concatenate([self.left[frontier], self.right[frontier]])
+            frontier = children[children >= 0].astype(np.int64)
+        # Deepest level first, so every child is complete before it is folded into its parent
+        for nodes in reversed(levels):
+            for child in (self.left[nodes], self.right[nodes]):
+                has = child >= 0
+                parent, child = nodes[has], child[has]
+                self.sub_count[parent] += self.sub_count[child]
+                self.sub_sum[parent] += self.sub_sum[child]
+                self.sub_min[parent] = np.minimum(self.sub_min[parent], self.sub_min[child])
+                self.sub_max[parent] = np.maximum(self.sub_max[parent], self.sub_max[child])
+
+    def to_arrays(self):
+        arrays = {"values": self.values, "row_ids": self.row_ids, "left": self.left, "right": self.right,
+                  "assoc": self.assoc}
+        if self.aggregated:
+            arrays.update(agg_values=self.agg_values, sub_count=self.sub_count, sub_sum=self.sub_sum,
+                          sub_min=self.sub_min, sub_max=self.sub_max)
+        return arrays, {"aggregated": self.aggregated}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        tree = cls(arrays["values"], arrays["row_ids"], arrays["left"], arrays["right"], arrays["assoc"])
+        if params["aggregated"]:
+            tree.aggregated = params["aggregated"]
+            tree.agg_values, tree.sub_count = arrays["agg_values"], arrays["sub_count"]
+            tree.sub_sum, tree.sub_min, tree.sub_max = arrays["sub_sum"], arrays["sub_min"], arrays["sub_max"]
+        return tree
+
+    def search(self, ranges):
+        """
+        Same result, in the same order, as SearchRangeTree1d/2d/3d on the original tree.
+        :param ranges: List of (min, max) pairs, one per dimension.
+        """
+        results = []
+        if len(self.row_ids):
+            self._search(0, ranges, 0, results)
+        return results
+
+    def _within(self, node, ranges, axis):
+        point = self.values[node, axis:].tolist()
+        return all(low <= x <= high for x, (low, high) in zip(point, ranges[axis:]))
+
+    def _search(self, tree, ranges, axis, results):
+        low, high = ranges[axis]
+        if axis == self.dim - 1:
+            # Last dimension: report every node in [low, high], pruning subtrees on the BST order
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                value = self.values[node, axis]
+                if high < value:
+                    children = [self.left[node]]
+                elif low > value:
+                    children = [self.right[node]]
+                else:
+                    results.append(int(self.row_ids[node]))
+                    children = [self.left[node], self.right[node]]
+                stack.extend(int(child) for child in reversed(children) if child >= 0)
+            return
+
+        # Find the split node
+        splitnode = tree
+        while splitnode >= 0:
+            value = self.values[splitnode, axis]
+            if high < value:
+                splitnode = self.left[splitnode]
+            elif low > value:
+                splitnode = self.right[splitnode]
+            else:
+                break
+        if splitnode < 0:
+            return
+        if self._within(splitnode, ranges, axis):
+            results.append(int(self.row_ids[splitnode]))
+
+        # Left path: right subtrees are canonical, continue on the next dimension
+        vl = self.left[splitnode]
+        while vl >= 0:
+            if self._within(vl, ranges, axis):
+                results.append(int(self.row_ids[vl]))
+            if low <= self.values[vl, axis]:
+                if self.right[vl] >= 0:
+                    self._search(int(self.assoc[self.right[vl]]), ranges, axis + 1, results)
+                vl = self.left[vl]
+            else:
+                vl = self.right[vl]
+
+        # Right path: left subtrees are canonical
+        vr = self.right[splitnode]
+        while vr >= 0:
+            if self._within(vr, ranges, axis):
+                results.append(int(self.row_ids[vr]))
+            if high >= self.values[vr, axis]:
+                if self.left[vr] >= 0:
+                    self._search(int(self.assoc[self.left[vr]]), ranges, axis + 1, results)
+                vr = self.right[vr]
+            else:
+                vr = self.left[vr]
+
+    def aggregate(self, ranges):
+        """
+        COUNT, SUM, MIN and MAX of the augmented attributes over the points of search(ranges). Canonical
+        subtrees of the last dimension contribute their stored totals, so O(log^dim n) nodes are visited
+        regardless of the number of matches.
+        :param ranges: List of (min, max) pairs, one per dimension.
+        :return: Tuple of (count, sums, minimums, maximums), each but count an array with one entry per attribute.
+        """
+        if not self.aggregated:
+            raise ValueError("The tree has no aggregated attributes; call augment() first")
+        width = len(self.aggregated)
+        totals = [0, np.zeros(width), np.full(width, np.inf), np.full(width, -np.inf)]
+        if len(self.row_ids):
+            self._aggregate(0, ranges, 0, totals)
+        return int(totals[0]), totals[1], totals[2], totals[3]
+
+    def _add_point(self, node, totals):
+        values = self.agg_values[node]
+        totals[0] += 1
+        totals[1] += values
+        totals[2] = np.minimum(totals[2], values)
+        totals[3] = np.maximum(totals[3], values)
+
+    def _add_subtree(self, node, totals):
+        totals[0] += self.sub_count[node]
+        totals[1] += self.sub_sum[node]
+        totals[2] = np.minimum(totals[2], self.sub_min[node])
+        totals[3] = np.maximum(totals[3], self.sub_max[node])
+
+    def _aggregate(self, tree, ranges, axis, totals):
+        low, high = ranges[axis]
+        last = axis == self.dim - 1
+
+        # Find the split node
+        splitnode = tree
+        while splitnode >= 0:
+            value = self.values[splitnode, axis]
+            if high < value:
+                splitnode = self.left[splitnode]
+            elif low > value:
+                splitnode = self.right[splitnode]
+            else:
+                break
+        if splitnode < 0:
+            return
+        if last or self._within(splitnode, ranges, axis):
+            self._add_point(splitnode, totals)
+
+        # Left path: right subtrees are canonical, taken whole on the last dimension
+        vl = self.left[splitnode]
+        while vl >= 0:
+            if low <= self.values[vl, axis]:
+                if last or self._within(vl, ranges, axis):
+                    self._add_point(vl, totals)
+                if self.right[vl] >= 0:
+                    if last:
+                        self._add_subtree(self.right[vl], totals)
+                    else:
+                        self._aggregate(int(self.assoc[self.right[vl]]), ranges, axis + 1, totals)
+                vl = self.left[vl]
+            else:
+                vl = self.right[vl]
+
+        # Right path: left subtrees are canonical
+        vr = self.right[splitnode]
+        while vr >= 0:
+            if high >= self.values[vr, axis]:
+                if last or self._within(vr, ranges, axis):
+                    self._add_point(vr, totals)
+                if self.left[vr] >= 0:
+                    if last:
+                        self._add_subtree(self.left[vr], totals)
+                    else:
+                        self._aggregate(int(self.assoc[self.left[vr]]), ranges, axis + 1, totals)
+                vr = self.right[vr]
+            else:
+                vr = self.left[vr]
+
+
+def halve(los, his):
+    """Bounds of the children of the nodes [los[i], his[i]); a node of one point is carried over unsplit."""
+    mids = np.where(his - los > 1, (los + his) // 2, his)
+    child_los = np.stack([los, mids], axis=1).ravel()
+    child_his = np.stack([mids, his], axis=1).ravel()
+    keep = child_his > child_los
+    return child_los[keep], child_his[keep]
+
+
+class LayeredRangeTree:
+    """
+    Range tree whose last level is a sorted array with fractional cascading instead of a tree of its own.
+    A layered tree over (y, z) is balanced over the points sorted by y: a node covers positions [lo, hi) of that
+    order and its children [lo, mid) and [mid, hi), mid = (lo + hi) // 2, so no node needs to be stored. Each node
+    keeps its points sorted by z, along with cum, the running count of those that belong to the left child. A
+    position in the node's array maps to cum[p] - cum[lo] in the left child's array and the remainder in the right
+    child's. A query locates its z range with one binary search at the root and follows these pointers down, so a 2D
+    query costs O(log n + k). With three dimensions a primary tree over x, laid out the same way, holds a layered
+    tree over (y, z) in every node, for O(log^2 n + k) instead of the O(log^3 n + k) of SearchRangeTree3d.
+    The nodes of one level tile [0, n), so each level is one row of the arrays below.
+    """
+
+    def __init__(self, dim, xs, row_ids, ys, zs, order, cum):
+        self.dim = dim
+        self.xs = xs  # (n,) float64 first coordinate, sorted
+        self.row_ids = row_ids  # (n,) int32, in x order
+        self.ys = ys  # (L, n) float64 y values of each primary node's points, sorted
+        self.zs = zs  # (L, n) float64 z values of each primary node's points, sorted
+        self.order = order  # (L, S, n) int32 x-order positions of each layered node's points, sorted by z
+        self.cum = cum  # (L, S, n + 1) int32 running count of points that go to the left child
+
+    @classmethod
+    def build(cls, points, row_ids=None):
+        """
+        Sort once on x, then lay out every level of the primary and layered trees with one lexsort each.
+        :param points: (n, d) array, 1 <= d <= 3.
+        :param row_ids: Row id of each point (defaults to 0..n-1).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        n, dim = points.shape
+        row_ids = np.arange(n, dtype=np.int32) if row_ids is None else np.asarray(row_ids, dtype=np.int32)
+        by_x = np.argsort(points[:, 0], kind='stable')
+        points, row_ids = points[by_x], row_ids[by_x]
+        ys, zs, order, cum = [], [], [], []
+        if dim > 1 and n:
+            y, z = points[:, dim - 2], points[:, dim - 1]
+            # Primary levels over x (a single node holding everything when there are only two axes)
+            primary = [(np.zeros(1, dtype=np.int64), np.full(1, n, dtype=np.int64))]
+            while dim == 3 and (primary[-1][1] - primary[-1][0] > 1).any():
+                primary.append(halve(*primary[-1]))
+            levels = max(1, math.ceil(math.log2(n)) + 1)
+            for los, his in primary:
+                primary_node = np.repeat(np.arange(len(los)), his - los)
+                # Each primary node's points in y order, the positions its layered tree is balanced over
+                by_y = np.lexsort((y, primary_node))
+                ys.append(y[by_y])
+                level_order, level_cum = [], []
+                child_los, child_his = los, his
+                for _ in range(levels):
+                    layered_node = np.repeat(np.arange(len(child_los)), child_his - child_los)
+                    by_z = np.lexsort((z[by_y], layered_node))
+                    mids = np.repeat((child_los + child_his) // 2, child_his - child_los)
+                    level_order.append(by_y[by_z])
+                    level_cum.append(np.concatenate([[0], np.cumsum(by_z < mids)]))
+                    child_los, child_his = halve(child_los, child_his)
+                zs.append(z[level_order[0]])
+                order.append(level_order)
+                cum.append(level_cum)
+        depth = len(order[0]) if order else 0
+        return cls(dim, points[:, 0].copy(), row_ids, np.array(ys, dtype=np.float64).reshape(len(ys), n),
+                   np.array(zs, dtype=np.float64).reshape(len(zs), n),
+                   np.array(order, dtype=np.int32).reshape(len(order), depth, n),
+                   np.array(cum, dtype=np.int32).reshape(len(cum), depth, n + 1))
+
+    def to_arrays(self):
+        return {"xs": self.xs, "row_ids": self.row_ids, "ys": self.ys, "zs": self.zs, "order": self.order,
+                "cum": self.cum}, {"dim": self.dim}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        return cls(params["dim"], arrays["xs"], arrays["row_ids"], arrays["ys"], arrays["zs"], arrays["order"],
+                   arrays["cum"])
+
+    def search(self, ranges):
+        """
+        Same points as FlatRangeTree.search, in no particular order.
+        :param ranges: List of (min, max) pairs, one per dimension.
+        :return: List of row ids.
+        """
+        n = len(self.row_ids)
+        x_low, x_high = ranges[0]
+        start, stop = int(np.searchsorted(self.xs, x_low, 'left')), int(np.searchsorted(self.xs, x_high, 'right'))
+        if self.dim == 1 or not n:
+            return self.row_ids[start:stop].tolist()
+        if self.dim == 2:
+            canonical = [(0, 0, n)]
+        else:
+            # Primary nodes covered by [start, stop), at most two per level
+            canonical = []
+            stack = [(0, 0, n)]
+            while stack:
+                level, lo, hi = stack.pop()
+                if stop <= lo or hi <= start:
+                    continue
+                if start <= lo and hi <= stop:
+                    canonical.append((level, lo, hi))
+                    continue
+                mid = (lo + hi) // 2
+                stack.extend([(level + 1, mid, hi), (level + 1, lo, mid)])
+
+        (y_low, y_high), (z_low, z_high) = ranges[-2], ranges[-1]
+        parts = []
+        for level, lo, hi in canonical:
+            ys, zs, order, cum = self.ys[level], self.zs[level], self.order[level], self.cum[level]
+            y_start = lo + int(np.searchsorted(ys[lo:hi], y_low, 'left'))
+            y_stop = lo + int(np.searchsorted(ys[lo:hi], y_high, 'right'))
+            # (depth, node bounds, node positions of the z range); the binary search happens once, at the root
+            stack = [(0, lo, hi, lo + int(np.searchsorted(zs[lo:hi], z_low, 'left')),
+                      lo + int(np.searchsorted(zs[lo:hi], z_high, 'right')))]
+            while stack:
+                depth, node_lo, node_hi, z_start, z_stop = stack.pop()
+                if z_start >= z_stop or y_stop <= node_lo or node_hi <= y_start:
+                    continue
+                if y_start <= node_lo and node_hi <= y_stop:
+                    parts.append(order[depth, z_start:z_stop])
+                    continue
+                mid = (node_lo + node_hi) // 2
+                base = int(cum[depth, node_lo])
+                left_start, left_stop = int(cum[depth, z_start]) - base, int(cum[depth, z_stop]) - base
+                stack.append((depth + 1, mid, node_hi, mid + z_start - node_lo - left_start,
+                              mid + z_stop - node_lo - left_stop))
+                stack.append((depth + 1, node_lo, mid, node_lo + left_start, node_lo + left_stop))
+        if not parts:
+            return []
+        return self.row_ids[np.concatenate(parts)].tolist()
+
+
+def build_range_tree(dataset, numeric_attributes):
+    """Build the range tree over the given numeric attributes of the dataset."""
+    data, all_data = load_data(dataset, numeric_attributes)
+    tree = None
+    dim = len(numeric_attributes)
+    data.sort()
+    if dim == 1:
+        tree = ConstructRangeTree1d(data)
+    elif dim == 2:
+        tree = ConstructRangeTree2d(data)
+    elif dim == 3:
+        tree = ConstructRangeTree3d(data)
+    tree = FlatRangeTree.from_tree(tree, dim)
+    tree.augment(dataset.points(AGGREGATE_ATTRIBUTES), AGGREGATE_ATTRIBUTES)
+    return tree
+
+
+def build_layered_range_tree(dataset, numeric_attributes):
+    """Build the layered range tree over the given numeric attributes of the dataset."""
+    return LayeredRangeTree.build(dataset.points(numeric_attributes))
+
+
 def range_tree_main(selected_attributes=None, conditions=None, review_keywords=None, num_neighbors=None):
     if selected_attributes is None:
         selected_attributes = []
@@ -262,7 +641,10 @@ def range_tree_main(selected_attributes=None, conditions=None, review_keywords=N
     numeric_attributes = [attr for attr in selected_attributes if attr in ['100g_USD', 'rating', 'review_date']]
     non_numeric_attributes = [attr for attr in selected_attributes if attr in ['roaster', 'roast', 'loc_country', 'origin']]
 
-    data, all_data = load_data("simplified_coffee.csv", numeric_attributes)
+    dataset = registry.get_data()
+    if numeric_attributes:
+        tree = registry.get_index("layered_range_tree", lambda d: build_layered_range_tree(d, numeric_attributes),
+                                  key=tuple(numeric_attributes), index_class=LayeredRangeTree)
 
     numeric_ranges = {}
     categorical_inputs = {}
@@ -278,47 +660,32 @@ def range_tree_main(selected_attributes=None, conditions=None, review_keywords=N
     results = []
     if numeric_attributes:
         dim = len(numeric_attributes)
-        data.sort()
-        if dim == 1:
-            tree = ConstructRangeTree1d(data)
-        elif dim == 2:
-            tree = ConstructRangeTree2d(data)
-        elif dim == 3:
-            tree = ConstructRangeTree3d(data)
-
         if dim == 1:
             attr = numeric_attributes[0]
             min_val, max_val = numeric_ranges.get(attr, (None, None))
             if min_val is not None and max_val is not None:
-                results = SearchRangeTree1d(tree, min_val, max_val, dim)
+                results = tree.search([(min_val, max_val)])
         elif dim == 2:
             attr1, attr2 = numeric_attributes
             min_val1, max_val1 = numeric_ranges.get(attr1, (None, None))
             min_val2, max_val2 = numeric_ranges.get(attr2, (None, None))
             if min_val1 is not None and max_val1 is not None and min_val2 is not None and max_val2 is not None:
-                results = SearchRangeTree2d(tree, min_val1, max_val1, min_val2, max_val2, dim)
+                results = tree.search([(min_val1, max_val1), (min_val2, max_val2)])
         elif dim == 3:
             attr1, attr2, attr3 = numeric_attributes
             min_val1, max_val1 = numeric_ranges.get(attr1, (None, None))
             min_val2, max_val2 = numeric_ranges.get(attr2, (None, None))
             min_val3, max_val3 = numeric_ranges.get(attr3, (None, None))
             if min_val1 is not None and max_val1 is not None and min_val2 is not None and max_val2 is not None and min_val3 is not None and max_val3 is not None:
-                results = SearchRangeTree3d(tree, min_val1, max_val1, min_val2, max_val2, min_val3, max_val3, dim)
+                results = tree.search([(min_val1, max_val1), (min_val2, max_val2), (min_val3, max_val3)])
     else:
-        results = all_data
+        results = list(range(len(dataset)))
 
     if categorical_inputs:
-        filtered_results = []
-        for result in results:
-            match = True
-            for attr, values in categorical_inputs.items():
-                idx = headings.index(attr)
-                if str(result[idx]).strip().lower() not in [v.lower() for v in values]:
-                    match = False
-                    break
-            if match:
-                filtered_results.append(result)
-        results = filtered_results
+        results = dataset.filter_categorical(results, categorical_inputs)
+
+    # Materialise the matching rows as they appear in the CSV
+    results = dataset.rows(results, raw=True)
 
     if review_keywords and num_neighbors:
         review_index = headings.index("review")
@@ -327,3 +694,27 @@ def range_tree_main(selected_attributes=None, conditions=None, review_keywords=N
         results = [row for row, _ in lsh_results]
 
     return results
+
+
+def range_tree_aggregate_main(conditions=None):
+    """
+    Aggregate price and rating over the coffees whose numeric attributes fall in the given ranges.
+    :param conditions: Dictionary {numeric attribute: (min, max)}; a None bound is open. Categorical conditions
+                       are not supported, as they cannot be answered from canonical subtrees.
+    :return: Dictionary with "count" and per-attribute "sum", "min", "max" and "avg".
+    """
+    conditions = conditions or {}
+    numeric_attributes = [attr for attr in ['100g_USD', 'rating', 'review_date'] if attr in conditions]
+    unsupported = [attr for attr in conditions if attr not in numeric_attributes]
+    if unsupported:
+        raise ValueError(f"Range tree aggregates only take numeric conditions, got {unsupported}")
+    dataset = registry.get_data()
+    if not numeric_attributes:
+        points = dataset.points(AGGREGATE_ATTRIBUTES)
+        return summarize(len(points), points.sum(axis=0), points.min(axis=0, initial=np.inf),
+                         points.max(axis=0, initial=-np.inf), AGGREGATE_ATTRIBUTES)
+    tree = registry.get_index("range_tree", lambda d: build_range_tree(d, numeric_attributes),
+                              key=tuple(numeric_attributes), index_class=FlatRangeTree)
+    ranges = [(-np.inf if low is None else low, np.inf if high is None else high)
+              for low, high in (conditions[attr] for attr in numeric_attributes)]
+    return summarize(*tree.aggregate(ranges), tree.aggregated)
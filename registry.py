@@ -0,0 +1,95 @@
+import os
+import threading
+from dataset import CoffeeDataset
+from snapshot import load_snapshot, snapshot_path_for, is_fresh
+from index_store import find_index, load_index
+
+
+DATA_PATH = "simplified_coffee.csv"
+INDEX_DIR = "indexes"  # Saved indexes written by build_indexes.py
+
+_lock = threading.RLock()
+_datasets = {}  # abs path -> (signature, data)
+_indexes = {}  # (abs path, name, key) -> index
+
+
+def file_signature(path):
+    """Return the (mtime, size) pair used to detect changes to a source file."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_dataset(path):
+    """
+    Load the dataset behind `path` as a columnar CoffeeDataset.
+    Snapshot files (.snap) are memory-mapped. For a CSV, an up-to-date snapshot next to it (written by
+    `python snapshot.py`) is used instead of parsing the text.
+    """
+    if path.endswith(".snap"):
+        return load_snapshot(path)
+    snapshot_path = snapshot_path_for(path)
+    if is_fresh(snapshot_path, path):
+        return load_snapshot(snapshot_path)
+    return CoffeeDataset.from_csv(path)
+
+
+def _drop(path):
+    _datasets.pop(path, None)
+    for key in [key for key in _indexes if key[0] == path]:
+        del _indexes[key]
+
+
+def get_data(path=DATA_PATH):
+    """
+    Return the dataset for `path`, loading it only on first use.
+    If the file changed on disk since it was loaded, the dataset and every index built from it are dropped
+    and the file is read again.
+    :param path: Path to the CSV file.
+    :return: The shared CoffeeDataset. Callers must treat it as read-only.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        signature = file_signature(path)
+        cached = _datasets.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        _drop(path)
+        data = load_dataset(path)
+        _datasets[path] = (signature, data)
+        return data
+
+
+def get_index(name, build, key=None, path=DATA_PATH, index_class=None):
+    """
+    Return a cached index, building it on first use.
+    :param name: Name of the structure (e.g. "kdtree").
+    :param build: Callable receiving the shared dataset and returning the built index.
+    :param key: Hashable build parameters (e.g. the indexed attributes); different keys are cached separately.
+    :param path: Path to the CSV file the index is built from.
+    :param index_class: Flat index class. If given and INDEX_DIR holds a saved index for (name, key) built from
+                        the same data, it is memory-mapped instead of calling `build`.
+    :return: The cached index. Callers must treat it as read-only.
+    """
+    with _lock:
+        data = get_data(path)
+        cache_key = (os.path.abspath(path), name, key)
+        if cache_key not in _indexes:
+            index = None
+            saved = find_index(INDEX_DIR, name, key) if index_class is not None else None
+            if saved is not None:
+                try:
+                    index = load_index(saved, data, index_class)
+                except (ValueError, OSError):
+                    index = None  # Stale, foreign, corrupt or unreadable index file, rebuild below
+            _indexes[cache_key] = index if index is not None else build(data)
+        return _indexes[cache_key]
+
+
+def invalidate(path=None):
+    """Forget the cached dataset and indexes for `path`, or everything when `path` is None."""
+    with _lock:
+        if path is None:
+            _datasets.clear()
+            _indexes.clear()
+        else:
+            _drop(os.path.abspath(path))
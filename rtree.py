@@ -1,6 +1,10 @@
-import pandas as pd
-from datetime import datetime
+import heapq
+import math
+import numpy as np
 from lsh import lsh_query
+from dataset import COLUMNS, load_queries
+from kdtree import expand_ranges, scale_weights
+import registry
 
 
 class BoundingBox:
@@ -19,138 +23,737 @@ class RTreeNode:
     def __init__(self, is_leaf=True):
         self.is_leaf = is_leaf
         self.entries = []  # Holds bounding boxes and children/objects
+        self.block = None  # Cached arrays of the entries, see arrays()
 
     def is_full(self, max_entries):
         """Check if the node is full."""
         return len(self.entries) >= max_entries
 
+    def arrays(self):
+        """
+        The entries as a block of arrays: (n, d) lower and upper corners plus an int64 array of row ids for a leaf,
+        or the list of children for an inner node. Built on first use after the entries last changed.
+        """
+        if self.block is None:
+            mins, maxs = box_arrays(self.entries)
+            refs = [ref for _, ref in self.entries]
+            self.block = (mins, maxs, np.array(refs, dtype=np.int64) if self.is_leaf else refs)
+        return self.block
+
+    def touch(self):
+        """Drop the cached block; call after changing the entries."""
+        self.block = None
+
+
+def str_order(centers, capacity):
+    """
+    Sort-Tile-Recursive order of boxes: sort on the first dimension, cut into vertical slabs of whole pages, then
+    tile each slab on the remaining dimensions the same way. Consecutive runs of `capacity` boxes form the nodes.
+    :param centers: (n, d) array of box centres.
+    :return: Permutation of range(n).
+    """
+    dims = centers.shape[1]
+
+    def tile(idx, dim):
+        idx = idx[np.argsort(centers[idx, dim], kind='stable')]
+        if dim == dims - 1 or len(idx) <= capacity:
+            return [idx]
+        pages = math.ceil(len(idx) / capacity)
+        slabs = math.ceil(pages ** (1.0 / (dims - dim)))
+        slab_size = math.ceil(pages / slabs) * capacity
+        return [part for start in range(0, len(idx), slab_size) for part in tile(idx[start:start + slab_size], dim + 1)]
+
+    return np.concatenate(tile(np.arange(len(centers)), 0))
+
+
+def hilbert_keys(grid, bits):
+    """
+    Position of integer grid points along a d-dimensional Hilbert curve (Skilling's transpose algorithm,
+    vectorized over the points).
+    :param grid: (n, d) array of coordinates in [0, 2^bits), with d * bits <= 63.
+    :return: (n,) int64 array.
+    """
+    x = np.array(grid, dtype=np.int64)
+    dims = x.shape[1]
+    # Inverse undo of the excess work
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = q - 1
+        for i in range(dims):
+            high = (x[:, i] & q) != 0
+            # Where bit q of axis i is set invert the low bits of the first axis, otherwise exchange them with axis i
+            t = np.where(high, 0, (x[:, 0] ^ x[:, i]) & p)
+            x[:, 0] ^= np.where(high, p, t)
+            if i:
+                x[:, i] ^= t
+        q >>= 1
+    # Gray encode
+    for i in range(1, dims):
+        x[:, i] ^= x[:, i - 1]
+    t = np.zeros(len(x), dtype=np.int64)
+    q = 1 << (bits - 1)
+    while q > 1:
+        t ^= np.where(x[:, dims - 1] & q, q - 1, 0)
+        q >>= 1
+    x ^= t[:, None]
+    # Interleave the transposed bits, most significant first
+    keys = np.zeros(len(x), dtype=np.int64)
+    for bit in range(bits - 1, -1, -1):
+        for i in range(dims):
+            keys = (keys << 1) | ((x[:, i] >> bit) & 1)
+    return keys
+
+
+def hilbert_order(centers, bits=16):
+    """Order boxes by the Hilbert value of their centres on a 2^bits grid over their bounds."""
+    bits = min(bits, 63 // centers.shape[1])
+    low, high = centers.min(axis=0), centers.max(axis=0)
+    scale = np.where(high > low, (2 ** bits - 1) / np.where(high > low, high - low, 1.0), 0.0)
+    return np.argsort(hilbert_keys(np.floor((centers - low) * scale), bits), kind='stable')
+
+
+def box_arrays(entries):
+    """Lower and upper corners of the boxes of a list of entries as two (n, d) arrays."""
+    dims = len(entries[0][0].mins) if entries else 0
+    return (np.array([bbox.mins for bbox, _ in entries], dtype=np.float64).reshape(len(entries), dims),
+            np.array([bbox.maxs for bbox, _ in entries], dtype=np.float64).reshape(len(entries), dims))
+
+
+def cover(entries):
+    """Minimum bounding box of a list of entries."""
+    mins, maxs = box_arrays(entries)
+    return BoundingBox(mins.min(axis=0).tolist(), maxs.max(axis=0).tolist())
+
+
+def overlap_areas(mins_a, maxs_a, mins_b, maxs_b):
+    """(n, m) array of the overlap area (volume) of every box in a with every box in b."""
+    sides = np.minimum(maxs_a[:, None], maxs_b[None]) - np.maximum(mins_a[:, None], mins_b[None])
+    return np.prod(np.clip(sides, 0, None), axis=2)
+
 
 class RTree:
-    """R-tree implementation."""
-    def __init__(self, max_entries=5):
+    """
+    R-tree implementation. Inserts follow the R*-tree: choose-subtree by overlap just above the leaves and by
+    area enlargement elsewhere, one forced reinsertion per level and insert before splitting, and a split that
+    minimises margin and overlap. Each insert keeps the path from the root on a stack and refits every box on it.
+    """
+    def __init__(self, max_entries=5, min_entries=None, reinsert_fraction=0.3):
         self.max_entries = max_entries
+        self.min_entries = min_entries or max(1, int(0.4 * max_entries))
+        self.reinsert_fraction = reinsert_fraction
         self.root = RTreeNode()
+        self.height = 0  # Levels above the leaves
+        self.boxes = {}  # Object -> its bounding box, so an object can be found again by update()
+
+    @classmethod
+    def bulk_load(cls, mins, maxs, objs, max_entries=5, method="str"):
+        """
+        Build a packed, balanced tree from all boxes at once: every level is ordered (STR tiles or Hilbert curve)
+        and cut into nodes of exactly `max_entries` entries (bar the last), then the node boxes are packed into
+        the level above the same way.
+        :param mins: (n, d) array of lower box corners.
+        :param maxs: (n, d) array of upper box corners.
+        :param objs: The n objects (row ids) stored in the leaves.
+        :param max_entries: Node capacity.
+        :param method: "str" (Sort-Tile-Recursive) or "hilbert".
+        """
+        if method not in ("str", "hilbert"):
+            raise ValueError(f"Unknown packing method: {method}")
+        tree = cls(max_entries)
+        if not len(objs):
+            return tree
+        mins = np.asarray(mins, dtype=np.float64).reshape(len(objs), -1)
+        maxs = np.asarray(maxs, dtype=np.float64).reshape(len(objs), -1)
+        entries = [(BoundingBox(lo, hi), obj) for lo, hi, obj in zip(mins.tolist(), maxs.tolist(), objs)]
+        tree.boxes = {obj: bbox for bbox, obj in entries}
+        is_leaf = True
+        while True:
+            centers = (mins + maxs) / 2
+            order = str_order(centers, max_entries) if method == "str" else hilbert_order(centers)
+            starts = np.arange(0, len(entries), max_entries)
+            nodes = []
+            for start in starts.tolist():
+                node = RTreeNode(is_leaf=is_leaf)
+                node.entries = [entries[i] for i in order[start:start + max_entries].tolist()]
+                nodes.append(node)
+            if len(nodes) == 1:
+                tree.root = nodes[0]
+                return tree
+            tree.height += 1
+            # Node boxes become the entries of the next level
+            mins = np.minimum.reduceat(mins[order], starts, axis=0)
+            maxs = np.maximum.reduceat(maxs[order], starts, axis=0)
+            entries = [(BoundingBox(lo, hi), node) for lo, hi, node in zip(mins.tolist(), maxs.tolist(), nodes)]
+            is_leaf = False
+
+    def search(self, data, selected_numeric, parsed_conditions, non_numeric_conditions):
+        """
+        Row ids of the leaf entries that satisfy every condition.
+        :param parsed_conditions: Dictionary of numeric attribute -> list of (operator, value).
+        :param non_numeric_conditions: Dictionary of categorical attribute -> list of accepted values.
+        """
+        encoded = {attr: data.encode(attr, values) for attr, values in non_numeric_conditions.items()}
+        matching_entries = []
+        if self.root.entries:
+            search_node(self.root, data, selected_numeric, parsed_conditions, encoded, matching_entries)
+        return matching_entries
 
     def insert(self, bbox, obj):
         """Insert a bounding box and associated object into the R-tree."""
-        node = self._choose_leaf(self.root, bbox)
-        node.entries.append((bbox, obj))
-        if node.is_full(self.max_entries):
-            self._split_node(node)
-
-    def _choose_leaf(self, node, bbox):
-        """Choose the appropriate leaf node for insertion."""
-        if node.is_leaf:
-            return node
-        best_entry = min(node.entries, key=lambda entry: self._calculate_enlargement(entry[0], bbox))
-        return self._choose_leaf(best_entry[1], bbox)
-
-    def _calculate_enlargement(self, node_bbox, new_bbox):
-        """Calculate the enlargement needed to include new_bbox in node_bbox."""
-        new_mins = [min(node_bbox.mins[i], new_bbox.mins[i]) for i in range(len(node_bbox.mins))]
-        new_maxs = [max(node_bbox.maxs[i], new_bbox.maxs[i]) for i in range(len(node_bbox.maxs))]
-        old_area = self._calculate_area(node_bbox)
-        new_area = self._calculate_area(BoundingBox(new_mins, new_maxs))
-        return new_area - old_area
-
-    def _calculate_area(self, bbox):
-        """Calculate the area of a bounding box."""
-        return sum(bbox.maxs[i] - bbox.mins[i] for i in range(len(bbox.mins)))
-
-    def _split_node(self, node):
-        """Split a node that exceeds max_entries."""
-        node.entries.sort(key=lambda entry: entry[0].mins[0])
-        mid = len(node.entries) // 2
-        new_node = RTreeNode(is_leaf=node.is_leaf)
-        new_node.entries = node.entries[mid:]
-        node.entries = node.entries[:mid]
-
-        def compute_bbox(entries):
-            mins = [min(entry[0].mins[i] for entry in entries) for i in range(len(entries[0][0].mins))]
-            maxs = [max(entry[0].maxs[i] for entry in entries) for i in range(len(entries[0][0].maxs))]
-            return BoundingBox(mins, maxs)
-
-        node_bbox = compute_bbox(node.entries)
-        new_node_bbox = compute_bbox(new_node.entries)
-
-        if node == self.root:
-            new_root = RTreeNode(is_leaf=False)
-            new_root.entries.append((node_bbox, node))
-            new_root.entries.append((new_node_bbox, new_node))
-            self.root = new_root
+        self.boxes[obj] = bbox
+        self._insert((bbox, obj), 0, set())
+
+    def delete(self, bbox, obj):
+        """
+        Remove the entry (bbox, obj) and condense the tree.
+        :return: True if the entry was found.
+        """
+        found = self._find_leaf(bbox, obj)
+        if found is None:
+            return False
+        path, slots, index = found
+        del path[-1].entries[index]
+        path[-1].touch()
+        del self.boxes[obj]
+        self._condense(path, slots)
+        return True
+
+    def update(self, obj, new_point):
+        """
+        Move a point entry to new coordinates, e.g. after a corrected price or rating. The entry is replaced in
+        place when the point stays inside its leaf's box, otherwise it is deleted and inserted again.
+        :return: True if the object was in the tree.
+        """
+        found = self._find_leaf(self.boxes[obj], obj) if obj in self.boxes else None
+        if found is None:
+            return False
+        path, slots, index = found
+        point = [float(value) for value in new_point]
+        bbox = BoundingBox(point, point[:])
+        leaf = path[-1]
+        mins, maxs, _ = leaf.arrays()
+        if np.all(mins.min(axis=0) <= point) and np.all(maxs.max(axis=0) >= point):
+            leaf.entries[index] = (bbox, obj)
+            leaf.touch()
+            self.boxes[obj] = bbox
+            self._condense(path, slots)
         else:
-            parent = self._find_parent(self.root, node)
-            parent.entries.append((new_node_bbox, new_node))
-            if parent.is_full(self.max_entries):
-                self._split_node(parent)
-
-    def _find_parent(self, current_node, target_node):
-        """Find the parent of a given node."""
-        if current_node.is_leaf:
-            return None
-        for entry in current_node.entries:
-            bbox, child = entry
-            if child == target_node:
-                return current_node
-            elif not child.is_leaf:
-                parent = self._find_parent(child, target_node)
-                if parent:
-                    return parent
+            del leaf.entries[index]
+            leaf.touch()
+            self._condense(path, slots)
+            self.insert(bbox, obj)
+        return True
+
+    def _find_leaf(self, bbox, obj):
+        """
+        Depth-first search for the leaf entry (bbox, obj), following only the entries whose box contains bbox.
+        :return: Tuple of (path, slots) as from _choose_path plus the entry's index in the leaf, or None.
+        """
+        stack = [([self.root], [None])] if self.root.entries else []
+        while stack:
+            path, slots = stack.pop()
+            mins, maxs, refs = path[-1].arrays()
+            inside = np.flatnonzero((mins <= bbox.mins).all(axis=1) & (maxs >= bbox.maxs).all(axis=1)).tolist()
+            if path[-1].is_leaf:
+                for index in inside:
+                    if refs[index] == obj:
+                        return path, slots, index
+            else:
+                stack.extend((path + [refs[slot]], slots + [slot]) for slot in reversed(inside))
         return None
 
-
-def convert_date_to_numeric(date_str):
-    """Convert 'Month Year' date format to numeric YYYYMM format."""
-    try:
-        return int(datetime.strptime(date_str, "%B %Y").strftime("%Y%m"))
-    except ValueError:
-        raise ValueError(f"Invalid date format: {date_str}")
-
-
-def satisfies_conditions(bbox, row, selected_numeric, parsed_conditions, non_numeric_conditions):
-    """Check if the bounding box satisfies the numeric and non-numeric conditions."""
-    for idx, attr in enumerate(selected_numeric):
-        if attr in parsed_conditions:
-            min_value = bbox.mins[idx]
-            max_value = bbox.maxs[idx]
-            for op, val in parsed_conditions[attr]:
-                if op == ">=" and max_value < val:
-                    return False
-                elif op == "<=" and min_value > val:
-                    return False
-                elif op == ">" and max_value <= val:
-                    return False
-                elif op == "<" and min_value >= val:
-                    return False
-
-    if row is not None:
-        for attr, condition_list in non_numeric_conditions.items():
-            if attr in row:
-                attr_value = str(row[attr]).strip().lower()
-                if isinstance(condition_list, list) and attr_value not in condition_list:
-                    return False
+    def _condense(self, path, slots):
+        """
+        Fix up the path after entries were removed from (or changed in) its last node. Nodes left with fewer than
+        min_entries are cut from their parent and their entries are inserted again at the same level; the other
+        boxes on the path shrink to fit. A root with a single child is then replaced by that child.
+        """
+        orphans = []
+        for depth in range(len(path) - 1, 0, -1):
+            node, parent = path[depth], path[depth - 1]
+            if len(node.entries) < self.min_entries:
+                del parent.entries[slots[depth]]
+                orphans.extend((entry, self.height - depth) for entry in node.entries)
             else:
-                return False
-    return True
+                parent.entries[slots[depth]] = (cover(node.entries), node)
+            parent.touch()
+        for entry, level in orphans:
+            self._insert(entry, level, set())
+        while not self.root.is_leaf and len(self.root.entries) == 1:
+            self.root = self.root.entries[0][1]
+            self.height -= 1
+
+    def _insert(self, entry, level, reinserted):
+        """
+        Add an entry to a node `level` levels above the leaves, then walk the path back up to the root, treating
+        overflows and refitting the parent entry of every node on the way.
+        :param reinserted: Levels that already had a forced reinsertion during this insert.
+        """
+        path, slots = self._choose_path(entry[0], level)
+        path[-1].entries.append(entry)
+        path[-1].touch()
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if len(node.entries) > self.max_entries:
+                node_level = self.height - depth
+                if depth > 0 and node_level not in reinserted:
+                    # First overflow on this level: move the outermost entries back through choose-subtree
+                    reinserted.add(node_level)
+                    removed = self._pick_reinsert(node)
+                    for d in range(depth, 0, -1):
+                        path[d - 1].entries[slots[d]] = (cover(path[d].entries), path[d])
+                        path[d - 1].touch()
+                    for item in removed:
+                        self._insert(item, node_level, reinserted)
+                    return
+                sibling = self._split_node(node)
+                if depth == 0:
+                    self.root = RTreeNode(is_leaf=False)
+                    self.root.entries = [(cover(node.entries), node), (cover(sibling.entries), sibling)]
+                    self.height += 1
+                    return
+                path[depth - 1].entries.append((cover(sibling.entries), sibling))
+            if depth > 0:
+                path[depth - 1].entries[slots[depth]] = (cover(node.entries), node)
+                path[depth - 1].touch()
+
+    def _choose_path(self, bbox, level):
+        """
+        Descend from the root to a node `level` levels above the leaves.
+        :return: Tuple of (nodes on the path, index of each node's entry in its parent, None for the root).
+        """
+        node = self.root
+        path, slots = [node], [None]
+        for node_level in range(self.height, level, -1):
+            slot = self._choose_subtree(node, bbox, overlap=node_level - 1 == level == 0)
+            node = node.entries[slot][1]
+            path.append(node)
+            slots.append(slot)
+        return path, slots
+
+    @staticmethod
+    def _choose_subtree(node, bbox, overlap):
+        """
+        R*-tree choose-subtree: the entry needing the least overlap enlargement when its children are leaves
+        (`overlap`), otherwise the least area enlargement; ties go to the smaller area.
+        """
+        mins, maxs, _ = node.arrays()
+        grown_mins, grown_maxs = np.minimum(mins, bbox.mins), np.maximum(maxs, bbox.maxs)
+        area = np.prod(maxs - mins, axis=1)
+        keys = [area, np.prod(grown_maxs - grown_mins, axis=1) - area]
+        if overlap:
+            before = overlap_areas(mins, maxs, mins, maxs)
+            after = overlap_areas(grown_mins, grown_maxs, mins, maxs)
+            np.fill_diagonal(before, 0)
+            np.fill_diagonal(after, 0)
+            keys.append((after - before).sum(axis=1))
+        return int(np.lexsort(keys)[0])
+
+    def _pick_reinsert(self, node):
+        """
+        Remove the `reinsert_fraction` of the node's entries whose centres lie farthest from the centre of the
+        node, and return them nearest first (close reinsert).
+        """
+        mins, maxs, _ = node.arrays()
+        centers = (mins + maxs) / 2
+        distance = (((centers - (mins.min(axis=0) + maxs.max(axis=0)) / 2)) ** 2).sum(axis=1)
+        order = np.argsort(distance, kind='stable').tolist()
+        count = max(1, int(self.reinsert_fraction * len(order)))
+        entries = node.entries
+        node.entries = [entries[i] for i in order[:-count]]
+        node.touch()
+        return [entries[i] for i in order[-count:]]
 
-
-def search_node(node, data, selected_numeric, parsed_conditions, non_numeric_conditions, matching_entries):
-    """Recursive function to search the R-tree."""
+    def _split_node(self, node):
+        """
+        R*-tree split. For every axis the entries are sorted by lower and by upper bound, and each sort gives
+        the distributions with at least min_entries per group. The axis with the smallest total margin over its
+        distributions wins, and on it the distribution with the least overlap (ties: least area).
+        The node keeps the first group; the new sibling holding the second group is returned.
+        """
+        entries = node.entries
+        mins, maxs, _ = node.arrays()
+        sizes = np.arange(self.min_entries, len(entries) - self.min_entries + 1)  # Size of the first group
+        best = None
+        for axis in range(mins.shape[1]):
+            margin = 0.0
+            candidates = []
+            for key in (mins[:, axis], maxs[:, axis]):
+                order = np.argsort(key, kind='stable')
+                low, high = mins[order], maxs[order]
+                first_low, first_high = np.minimum.accumulate(low)[sizes - 1], np.maximum.accumulate(high)[sizes - 1]
+                second_low = np.minimum.accumulate(low[::-1])[::-1][sizes]
+                second_high = np.maximum.accumulate(high[::-1])[::-1][sizes]
+                margin += (first_high - first_low).sum() + (second_high - second_low).sum()
+                overlap = np.prod(np.clip(np.minimum(first_high, second_high) - np.maximum(first_low, second_low),
+                                          0, None), axis=1)
+                area = np.prod(first_high - first_low, axis=1) + np.prod(second_high - second_low, axis=1)
+                choice = np.lexsort((area, overlap))[0]
+                candidates.append((overlap[choice], area[choice], order, sizes[choice]))
+            if best is None or margin < best[0]:
+                best = (margin, min(candidates, key=lambda c: (c[0], c[1])))
+        _, (_, _, order, size) = best
+        order = order.tolist()
+        sibling = RTreeNode(is_leaf=node.is_leaf)
+        node.entries = [entries[i] for i in order[:size]]
+        node.touch()
+        sibling.entries = [entries[i] for i in order[size:]]
+        return sibling
+
+
+def box_mask(mins, maxs, selected_numeric, parsed_conditions):
+    """
+    Test a block of boxes against the numeric conditions with one vectorized comparison per condition.
+    :param mins: (n, d) lower corners, one column per attribute of `selected_numeric`.
+    :param maxs: (n, d) upper corners.
+    :return: Boolean mask of the boxes that can hold a match.
+    """
+    mask = np.ones(len(mins), dtype=bool)
+    for idx, attr in enumerate(selected_numeric):
+        for op, val in parsed_conditions.get(attr, []):
+            if op == ">=":
+                mask &= maxs[:, idx] >= val
+            elif op == "<=":
+                mask &= mins[:, idx] <= val
+            elif op == ">":
+                mask &= maxs[:, idx] > val
+            elif op == "<":
+                mask &= mins[:, idx] < val
+    return mask
+
+
+def search_node(node, data, selected_numeric, parsed_conditions, encoded, matching_entries):
+    """
+    Recursive function to search the R-tree. Each node is tested as one block of arrays, and the row ids left in a
+    leaf are filtered on the dataset's categorical codes.
+    :param encoded: Dictionary of categorical attribute -> accepted codes (see CoffeeDataset.encode).
+    """
+    mins, maxs, refs = node.arrays()
+    mask = box_mask(mins, maxs, selected_numeric, parsed_conditions)
     if node.is_leaf:
-        for bbox, obj in node.entries:
-            row = data.loc[obj]
-            if satisfies_conditions(bbox, row, selected_numeric, parsed_conditions, non_numeric_conditions):
-                matching_entries.append(obj)
+        refs = refs[mask]
+        for attr, codes in encoded.items():
+            refs = refs[np.isin(data.codes[attr][refs], codes)]
+        matching_entries.extend(refs.tolist())
     else:
-        for bbox, child in node.entries:
-            if satisfies_conditions(bbox, None, selected_numeric, parsed_conditions, non_numeric_conditions):
-                search_node(child, data, selected_numeric, parsed_conditions, non_numeric_conditions, matching_entries)
+        for child in np.flatnonzero(mask).tolist():
+            search_node(refs[child], data, selected_numeric, parsed_conditions, encoded, matching_entries)
+
+
+class FlatRTree:
+    """
+    Pointer-free copy of an RTree. Nodes are stored breadth-first; the entries of node i are
+    entry_*[node_offsets[i]:node_offsets[i + 1]], where entry_ref is a child node index for inner nodes and a
+    row id for leaves. Entry boxes are copied as stored in the tree.
+    """
+
+    def __init__(self, node_offsets, node_is_leaf, entry_mins, entry_maxs, entry_ref):
+        self.node_offsets = node_offsets  # (m + 1,) int64
+        self.node_is_leaf = node_is_leaf  # (m,) uint8
+        self.entry_mins = entry_mins  # (e, d) float64
+        self.entry_maxs = entry_maxs  # (e, d) float64
+        self.entry_ref = entry_ref  # (e,) int32
+
+    @classmethod
+    def from_tree(cls, r_tree):
+        """Lay out an RTree breadth-first."""
+        nodes = [r_tree.root]
+        entries = []
+        offsets = [0]
+        for node in nodes:  # `nodes` grows while iterating, giving a breadth-first order
+            for bbox, child in node.entries:
+                if node.is_leaf:
+                    entries.append((bbox, child))
+                else:
+                    entries.append((bbox, len(nodes)))
+                    nodes.append(child)
+            offsets.append(len(entries))
+        dims = len(entries[0][0].mins) if entries else 0
+        return cls(
+            node_offsets=np.array(offsets, dtype=np.int64),
+            node_is_leaf=np.array([node.is_leaf for node in nodes], dtype=np.uint8),
+            entry_mins=np.array([bbox.mins for bbox, _ in entries], dtype=np.float64).reshape(len(entries), dims),
+            entry_maxs=np.array([bbox.maxs for bbox, _ in entries], dtype=np.float64).reshape(len(entries), dims),
+            entry_ref=np.array([ref for _, ref in entries], dtype=np.int32),
+        )
+
+    def to_arrays(self):
+        return {"node_offsets": self.node_offsets, "node_is_leaf": self.node_is_leaf, "entry_mins": self.entry_mins,
+                "entry_maxs": self.entry_maxs, "entry_ref": self.entry_ref}, {}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        return cls(arrays["node_offsets"], arrays["node_is_leaf"], arrays["entry_mins"], arrays["entry_maxs"],
+                   arrays["entry_ref"])
+
+    def search(self, data, selected_numeric, parsed_conditions, non_numeric_conditions):
+        """Same result, in the same order, as RTree.search on the original tree."""
+        encoded = {attr: data.encode(attr, values) for attr, values in non_numeric_conditions.items()}
+        matching_entries = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            start, end = self.node_offsets[node], self.node_offsets[node + 1]
+            mask = box_mask(self.entry_mins[start:end], self.entry_maxs[start:end], selected_numeric,
+                            parsed_conditions)
+            refs = self.entry_ref[start:end][mask]
+            if self.node_is_leaf[node]:
+                for attr, codes in encoded.items():
+                    refs = refs[np.isin(data.codes[attr][refs], codes)]
+                matching_entries.extend(refs.tolist())
+            else:
+                stack.extend(reversed(refs.tolist()))
+        return matching_entries
+
+    def nearest(self, point, weights=None):
+        """
+        Distance browsing: yield the row ids in increasing distance from `point`, best-first from a priority queue
+        of nodes keyed by the smallest distance from the point to their box (MINDIST). Rows are only found when
+        they are asked for, so the caller can stop, or come back for the next page, after any number of results.
+        Distances are Euclidean after multiplying each coordinate difference by its weight.
+        :param point: Query coordinates, one per dimension of the tree.
+        :param weights: Per-dimension scale factors (default 1 for every dimension).
+        :return: Generator of (row_id, distance) pairs.
+        """
+        query = np.asarray(point, dtype=np.float64)
+        weights = np.ones_like(query) if weights is None else np.asarray(weights, dtype=np.float64)
+        queue = [(0.0, 1, 0)]  # Min-heap of (squared distance, 0 for a row or 1 for a node, row id or node)
+        while queue:
+            dist, is_node, ref = heapq.heappop(queue)
+            if not is_node:
+                yield ref, math.sqrt(dist)
+                continue
+            start, end = self.node_offsets[ref], self.node_offsets[ref + 1]
+            # Per-dimension gap between the point and each entry box, zero where the point is inside it
+            gap = np.maximum(np.maximum(self.entry_mins[start:end] - query, query - self.entry_maxs[start:end]), 0)
+            kind = 0 if self.node_is_leaf[ref] else 1
+            for entry_dist, child in zip(((gap * weights) ** 2).sum(axis=1).tolist(),
+                                         self.entry_ref[start:end].tolist()):
+                heapq.heappush(queue, (entry_dist, kind, child))
+
+
+class HilbertRTree:
+    """
+    Packed Hilbert R-tree of points stored in NumPy arrays. Points are sorted by the Hilbert value of their cell on
+    a 2^bits grid; consecutive runs of `fanout` points form the leaves and consecutive runs of `fanout` nodes form
+    each level above, up to a single root. A query walks the tree one level at a time, testing the boxes of all
+    surviving nodes of the level with one vectorized comparison per condition, so a wide fan-out (32-256) keeps the
+    tree shallow without costing a Python step per entry. Appended points wait in a buffer and are merged into the
+    Hilbert order once it fills.
+    """
+
+    def __init__(self, keys, points, row_ids, low, scale, bits, fanout, node_mins, node_maxs, level_starts,
+                 buffer_size=1024):
+        self.keys = keys  # (n,) int64 sorted Hilbert values
+        self.points = points  # (n, d) float64, in Hilbert order
+        self.row_ids = row_ids  # (n,) int32, in Hilbert order
+        self.low = low  # (d,) float64 grid origin, fixed when the tree is built
+        self.scale = scale  # (d,) float64 grid cells per unit of every dimension
+        self.bits = bits
+        self.fanout = fanout
+        self.node_mins = node_mins  # (m, d) float64 node boxes, level by level from the leaves up to the root
+        self.node_maxs = node_maxs  # (m, d) float64
+        self.level_starts = level_starts  # (levels + 1,) int64, level L is node_*[level_starts[L]:level_starts[L + 1]]
+        self.buffer_size = buffer_size
+        self.buffer_points = []  # Appended points not merged into the Hilbert order yet
+        self.buffer_ids = []
+
+    @classmethod
+    def build(cls, points, row_ids=None, fanout=64, bits=16):
+        """
+        Sort the points once by Hilbert value and pack them bottom-up.
+        :param points: (n, d) array of coordinates.
+        :param row_ids: Row id of each point (defaults to 0..n-1).
+        :param fanout: Points per leaf and children per inner node.
+        :param bits: Grid resolution per dimension (at most 63 // d).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        n, dims = points.shape
+        bits = min(bits, 63 // dims)
+        row_ids = np.arange(n, dtype=np.int32) if row_ids is None else np.asarray(row_ids, dtype=np.int32)
+        low = points.min(axis=0) if n else np.zeros(dims)
+        high = points.max(axis=0) if n else np.zeros(dims)
+        scale = np.where(high > low, (2 ** bits - 1) / np.where(high > low, high - low, 1.0), 0.0)
+        tree = cls(None, None, None, low, scale, bits, fanout, None, None, None)
+        keys = hilbert_keys(tree._grid(points), bits)
+        order = np.argsort(keys, kind='stable')
+        tree.keys, tree.points, tree.row_ids = keys[order], points[order], row_ids[order]
+        tree._pack()
+        return tree
+
+    def __len__(self):
+        return len(self.row_ids) + len(self.buffer_ids)
+
+    def to_arrays(self):
+        # The buffer is saved as it is rather than flushed, so saving leaves the tree unchanged
+        buffer_points = np.array(self.buffer_points, dtype=np.float64).reshape(len(self.buffer_ids), len(self.low))
+        arrays = {"keys": self.keys, "points": self.points, "row_ids": self.row_ids, "low": self.low,
+                  "scale": self.scale, "node_mins": self.node_mins, "node_maxs": self.node_maxs,
+                  "level_starts": self.level_starts, "buffer_points": buffer_points,
+                  "buffer_ids": np.asarray(self.buffer_ids, dtype=np.int32)}
+        return arrays, {"bits": self.bits, "fanout": self.fanout, "buffer_size": self.buffer_size}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        tree = cls(arrays["keys"], arrays["points"], arrays["row_ids"], arrays["low"], arrays["scale"],
+                   params["bits"], params["fanout"], arrays["node_mins"], arrays["node_maxs"], arrays["level_starts"],
+                   params["buffer_size"])
+        tree.buffer_points, tree.buffer_ids = arrays["buffer_points"].tolist(), arrays["buffer_ids"].tolist()
+        return tree
+
+    def copy(self):
+        """Independent copy, e.g. of a shared index from registry.get_index that is going to be appended to."""
+        tree = HilbertRTree(self.keys.copy(), self.points.copy(), self.row_ids.copy(), self.low.copy(),
+                            self.scale.copy(), self.bits, self.fanout, self.node_mins.copy(), self.node_maxs.copy(),
+                            self.level_starts.copy(), self.buffer_size)
+        tree.buffer_points, tree.buffer_ids = [list(point) for point in self.buffer_points], list(self.buffer_ids)
+        return tree
+
+    def _grid(self, values):
+        """Quantise coordinates to grid cells; values outside the bounds seen at build time go to the edge cells."""
+        grid = np.floor((np.asarray(values, dtype=np.float64) - self.low) * self.scale)
+        return np.clip(grid, 0, 2 ** self.bits - 1).astype(np.int64)
+
+    def _pack(self):
+        """Recompute the node boxes of every level from the points."""
+        mins = maxs = self.points
+        level_mins, level_maxs = [], []
+        while len(mins) > 1 or not level_mins:
+            starts = np.arange(0, len(mins), self.fanout)
+            if len(mins):
+                mins, maxs = np.minimum.reduceat(mins, starts, axis=0), np.maximum.reduceat(maxs, starts, axis=0)
+            level_mins.append(mins)
+            level_maxs.append(maxs)
+        self.node_mins, self.node_maxs = np.concatenate(level_mins), np.concatenate(level_maxs)
+        self.level_starts = np.cumsum([0] + [len(level) for level in level_mins]).astype(np.int64)
+
+    def append(self, point, row_id):
+        """
+        Add a point; it is searched from the buffer until the buffer fills and is merged by flush().
+        An index returned by registry.get_index is shared by every caller, so append to a copy() of it.
+        """
+        self.buffer_points.append([float(value) for value in point])
+        self.buffer_ids.append(row_id)
+        if len(self.buffer_ids) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Merge the buffered points into the Hilbert order with one linear merge and repack the node boxes."""
+        if not self.buffer_ids:
+            return
+        points = np.array(self.buffer_points, dtype=np.float64).reshape(len(self.buffer_ids), -1)
+        keys = hilbert_keys(self._grid(points), self.bits)
+        order = np.argsort(keys, kind='stable')
+        at = np.searchsorted(self.keys, keys[order], side='right')
+        self.keys = np.insert(self.keys, at, keys[order])
+        self.points = np.insert(self.points, at, points[order], axis=0)
+        self.row_ids = np.insert(self.row_ids, at, np.asarray(self.buffer_ids, dtype=np.int32)[order])
+        self.buffer_points, self.buffer_ids = [], []
+        self._pack()
+
+    def search(self, data, selected_numeric, parsed_conditions, non_numeric_conditions):
+        """
+        Same matches as FlatRTree.search, in Hilbert order with buffered points last.
+        :param parsed_conditions: Dictionary of numeric attribute -> list of (operator, value).
+        :param non_numeric_conditions: Dictionary of categorical attribute -> list of accepted values.
+        """
+        encoded = {attr: data.encode(attr, values) for attr, values in non_numeric_conditions.items()}
+        positions = np.zeros(1 if len(self.row_ids) else 0, dtype=np.int64)  # Surviving nodes of the current level
+        for level in range(len(self.level_starts) - 2, -1, -1):
+            nodes = positions + self.level_starts[level]
+            positions = positions[box_mask(self.node_mins[nodes], self.node_maxs[nodes], selected_numeric,
+                                           parsed_conditions)]
+            below = len(self.row_ids) if level == 0 else self.level_starts[level] - self.level_starts[level - 1]
+            positions = expand_ranges(positions * self.fanout, np.minimum((positions + 1) * self.fanout, below))
+        points = self.points[positions]
+        row_ids = self.row_ids[positions[box_mask(points, points, selected_numeric, parsed_conditions)]]
+        if self.buffer_ids:
+            points = np.array(self.buffer_points, dtype=np.float64)
+            buffered = np.asarray(self.buffer_ids, dtype=np.int32)
+            row_ids = np.concatenate([row_ids, buffered[box_mask(points, points, selected_numeric,
+                                                                 parsed_conditions)]])
+        for attr, codes in encoded.items():
+            row_ids = row_ids[np.isin(data.codes[attr][row_ids], codes)]
+        return row_ids.tolist()
+
+
+class StandingQueries:
+    """
+    Continuous query index for saved alerts. The rectangles of the standing range queries are the entries of an
+    R-tree, so a newly arriving review is matched against all of them with one search for the rectangles that
+    contain its point, instead of re-running every query.
+    """
+    UNBOUNDED = 1e12  # Stands in for a missing bound, keeping the box areas the R-tree compares finite
+
+    def __init__(self, attributes=None, max_entries=16):
+        self.attributes = attributes or ["100g_USD", "rating", "review_date"]
+        self.tree = RTree(max_entries=max_entries)
+
+    @classmethod
+    def from_file(cls, filepath, max_entries=16):
+        """Bulk-load the queries of a query file such as queries.txt; each is identified by its position."""
+        index = cls(max_entries=max_entries)
+        boxes = [index._box(query) for query in load_queries(filepath)]
+        index.tree = RTree.bulk_load([lo for lo, _ in boxes], [hi for _, hi in boxes], list(range(len(boxes))),
+                                     max_entries)
+        return index
+
+    def __len__(self):
+        return len(self.tree.boxes)
+
+    def _box(self, ranges):
+        """Corners of a query rectangle; a missing attribute or a None bound leaves that side unbounded."""
+        mins, maxs = [], []
+        for attr in self.attributes:
+            low, high = ranges.get(attr) or (None, None)
+            mins.append(-self.UNBOUNDED if low is None else float(low))
+            maxs.append(self.UNBOUNDED if high is None else float(high))
+        return mins, maxs
+
+    def add(self, query_id, ranges):
+        """
+        Store a standing query.
+        :param ranges: Dictionary of attribute -> (min, max), as returned by dataset.parse_query_line.
+        """
+        self.tree.insert(BoundingBox(*self._box(ranges)), query_id)
+
+    def remove(self, query_id):
+        """Drop a standing query. :return: True if it was stored."""
+        return query_id in self.tree.boxes and self.tree.delete(self.tree.boxes[query_id], query_id)
+
+    def match(self, review):
+        """
+        Ids of the standing queries that a review satisfies.
+        :param review: Dictionary with a value for every indexed attribute, e.g. CoffeeDataset.record(row_id).
+        """
+        conditions = {attr: [(">=", review[attr]), ("<=", review[attr])] for attr in self.attributes}
+        return self.tree.search(None, self.attributes, conditions, {})
+
+
+def build_rtree(data, selected_numeric, max_entries=16, method="str"):
+    """
+    Build an R-tree of point boxes over the selected numeric attributes.
+    :param max_entries: Node capacity.
+    :param method: "str" (Sort-Tile-Recursive) or "hilbert" to bulk-load a packed tree, "rstar" to insert the
+                   rows one at a time.
+    """
+    points = data.points(selected_numeric)
+    if method != "rstar":
+        return RTree.bulk_load(points, points, list(range(len(points))), max_entries, method)
+    r_tree = RTree(max_entries=max_entries)
+    for idx, point in enumerate(points.tolist()):
+        r_tree.insert(BoundingBox(mins=point, maxs=point[:]), idx)
+    return r_tree
+
+
+def build_hilbert_rtree(data, selected_numeric, fanout=64):
+    """Pack a Hilbert R-tree over the selected numeric attributes."""
+    return HilbertRTree.build(data.points(selected_numeric), fanout=fanout)
 
 
 def rtree_main(selected_attributes, conditions, review_keywords=None, num_neighbors=None):
     """Main function for R-tree search with LSH integration."""
-    data = pd.read_csv("simplified_coffee.csv")
-    data["review_date"] = data["review_date"].apply(convert_date_to_numeric)
+    data = registry.get_data()
 
     numeric_attributes = ["100g_USD", "rating", "review_date"]
     selected_numeric = [attr for attr in selected_attributes if attr in numeric_attributes]
@@ -158,12 +761,9 @@ def rtree_main(selected_attributes, conditions, review_keywords=None, num_neighb
 
     r_tree = None
     if selected_numeric:
-        r_tree = RTree(max_entries=5)
-        for idx, row in data.iterrows():
-            mins = [row[attr] for attr in selected_numeric]
-            maxs = mins[:]
-            bbox = BoundingBox(mins=mins, maxs=maxs)
-            r_tree.insert(bbox, idx)
+        # One R-tree per set of indexed attributes, cached across queries
+        r_tree = registry.get_index("hilbert_rtree", lambda d: build_hilbert_rtree(d, selected_numeric),
+                                    key=tuple(selected_numeric), index_class=HilbertRTree)
 
     parsed_conditions = {}
     non_numeric_conditions = {}
@@ -193,20 +793,42 @@ def rtree_main(selected_attributes, conditions, review_keywords=None, num_neighb
 
     matching_entries = []
     if selected_numeric:
-        search_node(r_tree.root, data, selected_numeric, parsed_conditions, non_numeric_conditions, matching_entries)
+        matching_entries = r_tree.search(data, selected_numeric, parsed_conditions, non_numeric_conditions)
     else:
-        for idx, row in data.iterrows():
-            if all(satisfies_conditions(None, row, selected_numeric, parsed_conditions, non_numeric_conditions)
-                   for attr, condition in non_numeric_conditions.items()):
-                matching_entries.append(idx)
+        matching_entries = data.filter_categorical(np.arange(len(data)), non_numeric_conditions).tolist()
 
     if matching_entries:
-        matching_rows = data.loc[matching_entries, ['name', 'roaster', 'roast', 'loc_country', 'origin', '100g_USD',
-                                                    'rating', 'review_date', 'review']]
+        matching_rows = data.rows(matching_entries)
         if review_keywords:
-            review_index = matching_rows.columns.get_loc("review")
-            lsh_results = lsh_query(review_keywords.split(), num_neighbors, matching_rows.values.tolist(), review_index)
+            review_index = COLUMNS.index("review")
+            lsh_results = lsh_query(review_keywords.split(), num_neighbors, matching_rows, review_index)
             matching_rows = [row for row, _ in lsh_results]
-            matching_rows = pd.DataFrame(matching_rows, columns=['name', 'roaster', 'roast', 'loc_country', 'origin', '100g_USD', 'rating', 'review_date', 'review'])
-        return [tuple(row) for row in matching_rows.itertuples(index=False)]
+        return [tuple(row) for row in matching_rows]
     return []
+
+
+def rtree_nearest_main(point, weights=None):
+    """
+    Browse the coffees in increasing distance from `point` in (price, rating, review date) space, e.g.
+    itertools.islice(rtree_nearest_main(point), 10) for the first page and the next islice for the next one.
+    :param point: Dictionary with a value for '100g_USD', 'rating' and 'review_date' (YYYYMM), or a row id to
+                  find the coffees most like an existing one.
+    :param weights: Per-dimension scale factors; defaults to 1 / standard deviation of each attribute.
+    :return: Generator of rows, each with its distance appended.
+    """
+    selected_numeric = ["100g_USD", "rating", "review_date"]
+    data = registry.get_data()
+    r_tree = registry.get_index("rtree", lambda d: FlatRTree.from_tree(build_rtree(d, selected_numeric)),
+                                key=tuple(selected_numeric), index_class=FlatRTree)
+    query_id = None
+    if isinstance(point, dict):
+        point = [point[attr] for attr in selected_numeric]
+    else:
+        query_id = point
+        point = [data.value(attr, point) for attr in selected_numeric]
+    if weights is None:
+        weights = scale_weights(data, selected_numeric)
+
+    for row_id, distance in r_tree.nearest(point, weights):
+        if row_id != query_id:  # a row id query should not return the coffee itself
+            yield data.rows([row_id])[0] + [distance]
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import struct
+import numpy as np
+from dataset import CoffeeDataset, NUMERIC_ATTRIBUTES, CATEGORICAL_ATTRIBUTES, TEXT_ATTRIBUTES
+
+
+SNAPSHOT_MAGIC = b"COFFSNAP"
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 64  # Every array starts on a 64-byte boundary so it can be viewed straight from the mapping
+
+_PREAMBLE = struct.Struct("<8sII")  # magic, format version, header length
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_arrays(path, magic, version, arrays, meta):
+    """
+    Write named arrays and a JSON metadata header to a single binary file.
+    Layout: magic, version and header length, the JSON header, then each array's raw little-endian bytes,
+    aligned so the file can be memory-mapped and read without copying.
+    :param path: Output file.
+    :param magic: 8-byte file type marker.
+    :param version: Format version stored in the file.
+    :param arrays: Dictionary of name -> NumPy array.
+    :param meta: JSON-serialisable metadata.
+    """
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder('<'))
+              for name, array in arrays.items()}
+    # The header size depends on the offsets it stores, so lay the arrays out until it stops growing
+    header_size = 0
+    while True:
+        offset = _aligned(_PREAMBLE.size + header_size)
+        layout = {}
+        for name, array in arrays.items():
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = _aligned(offset + array.nbytes)
+        header = json.dumps({"arrays": layout, "meta": meta}).encode("utf-8")
+        if len(header) <= header_size:
+            break
+        header_size = len(header)
+    header = header.ljust(header_size)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(magic, version, header_size))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b"\0" * (layout[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_arrays(path, magic, version):
+    """
+    Memory-map a file written by write_arrays.
+    :return: Tuple of (dictionary of name -> read-only array view, metadata).
+    :raises ValueError: If the file has another magic or version, or is truncated or corrupt.
+    """
+    with open(path, "rb") as f:
+        try:
+            file_magic, file_version, header_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        except struct.error as exc:
+            raise ValueError(f"{path} is truncated: {exc}") from exc
+        if file_magic != magic:
+            raise ValueError(f"{path} is not a {magic.decode()} file")
+        if file_version != version:
+            raise ValueError(f"{path} has format version {file_version}, expected {version}")
+        header = json.loads(f.read(header_size).decode("utf-8"))
+
+    try:
+        mapping = np.memmap(path, dtype=np.uint8, mode="r")
+        arrays = {}
+        for name, info in header["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            count = int(np.prod(info["shape"], dtype=np.int64))
+            start, stop = info["offset"], info["offset"] + count * dtype.itemsize
+            if stop > len(mapping):
+                raise ValueError(f"{path} is truncated: array {name} ends at byte {stop} of {len(mapping)}")
+            arrays[name] = mapping[start:stop].view(dtype).reshape(info["shape"])
+        return arrays, header["meta"]
+    except (KeyError, TypeError) as exc:
+        raise ValueError(f"{path} has a corrupt header: {exc!r}") from exc
+
+
+def snapshot_path_for(csv_path):
+    """Default snapshot location for a CSV file (same name, .snap extension)."""
+    return os.path.splitext(csv_path)[0] + ".snap"
+
+
+def write_snapshot(dataset, path, source=None):
+    """
+    Save a CoffeeDataset as a snapshot file.
+    :param dataset: The dataset to save.
+    :param path: Output file.
+    :param source: Optional CSV path the dataset was read from; its size and mtime are recorded so stale
+                   snapshots can be detected.
+    """
+    arrays = {}
+    for attr in NUMERIC_ATTRIBUTES:
+        arrays[f"numeric/{attr}"] = dataset.numeric[attr]
+    for attr in CATEGORICAL_ATTRIBUTES:
+        arrays[f"codes/{attr}"] = dataset.codes[attr]
+    for attr in TEXT_ATTRIBUTES:
+        offsets, buffer = dataset.texts[attr]
+        arrays[f"text/{attr}/offsets"] = offsets
+        arrays[f"text/{attr}/buffer"] = buffer
+    meta = {"rows": len(dataset), "vocabularies": dataset.vocabularies, "checksum": dataset.checksum()}
+    if source is not None:
+        stat = os.stat(source)
+        meta["source"] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    write_arrays(path, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, arrays, meta)
+
+
+def load_snapshot(path):
+    """Memory-map a snapshot file as a CoffeeDataset. No text is parsed and no column is copied."""
+    arrays, meta = read_arrays(path, SNAPSHOT_MAGIC, SNAPSHOT_VERSION)
+    dataset = CoffeeDataset(
+        numeric={attr: arrays[f"numeric/{attr}"] for attr in NUMERIC_ATTRIBUTES},
+        codes={attr: arrays[f"codes/{attr}"] for attr in CATEGORICAL_ATTRIBUTES},
+        vocabularies=meta["vocabularies"],
+        texts={attr: (arrays[f"text/{attr}/offsets"], arrays[f"text/{attr}/buffer"]) for attr in TEXT_ATTRIBUTES},
+    )
+    dataset._checksum = meta["checksum"]
+    return dataset
+
+
+def is_fresh(snapshot_path, csv_path):
+    """Check that a snapshot exists and was written from the current version of `csv_path`."""
+    try:
+        with open(snapshot_path, "rb") as f:
+            file_magic, file_version, header_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if file_magic != SNAPSHOT_MAGIC or file_version != SNAPSHOT_VERSION:
+                return False
+            source = json.loads(f.read(header_size).decode("utf-8"))["meta"].get("source")
+        stat = os.stat(csv_path)
+    except (OSError, ValueError, struct.error):
+        return False
+    return source == {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the coffee reviews CSV into a binary snapshot.")
+    parser.add_argument("csv", nargs="?", default="simplified_coffee.csv", help="CSV file to convert")
+    parser.add_argument("-o", "--output", help="Snapshot file (defaults to the CSV name with a .snap extension)")
+    args = parser.parse_args()
+
+    output = args.output or snapshot_path_for(args.csv)
+    dataset = CoffeeDataset.from_csv(args.csv)
+    write_snapshot(dataset, output, source=args.csv)
+    print(f"Wrote {len(dataset)} rows to {output}")
+
+
+if __name__ == "__main__":
+    main()
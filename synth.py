@@ -0,0 +1,162 @@
+import argparse
+import calendar
+import csv
+import re
+from collections import Counter
+import numpy as np
+from dataset import COLUMNS, CATEGORICAL_ATTRIBUTES, convert_date_to_numeric
+
+
+DISTRIBUTIONS = ["uniform", "clustered", "skewed", "duplicate"]
+
+
+class Template:
+    """Value ranges, categorical frequencies and review vocabulary taken from an existing dataset."""
+
+    def __init__(self, filepath, zipf_exponent=1.1):
+        values = {attr: Counter() for attr in CATEGORICAL_ATTRIBUTES}
+        words = Counter()
+        prices, ratings, months = [], [], []
+        with open(filepath, encoding='utf-8', newline='') as csvfile:
+            for row in csv.DictReader(csvfile):
+                for attr in CATEGORICAL_ATTRIBUTES:
+                    values[attr][row[attr]] += 1
+                words.update(re.findall(r"[a-z]+(?:-[a-z]+)?", row['review'].lower()))
+                prices.append(float(row['100g_USD']))
+                ratings.append(int(float(row['rating'])))
+                date = convert_date_to_numeric(row['review_date'])
+                months.append(date // 100 * 12 + date % 100 - 1)
+
+        self.categories = {attr: (list(counter), np.array(list(counter.values()), dtype=np.float64) /
+                                  sum(counter.values())) for attr, counter in values.items()}
+        # Ranked by frequency in the template, drawn with Zipf weights 1 / rank^s
+        self.vocabulary = [word for word, _ in words.most_common()]
+        weights = 1.0 / np.arange(1, len(self.vocabulary) + 1) ** zipf_exponent
+        self.word_weights = weights / weights.sum()
+        self.price_range = (min(prices), max(prices))
+        self.rating_range = (min(ratings), max(ratings))
+        self.month_range = (min(months), max(months))  # Months since year 0
+
+
+def fixed_points(template, distribution, seed, clusters=20, pool=50):
+    """
+    Points shared by every chunk: cluster centres for "clustered", the distinct points for "duplicate".
+    :return: (m, 3) array of (price, rating, months since year 0), or None for the other distributions.
+    """
+    rng = np.random.default_rng(seed)
+    (price_lo, price_hi), (rating_lo, rating_hi), (month_lo, month_hi) = (
+        template.price_range, template.rating_range, template.month_range)
+    if distribution == "clustered":
+        return rng.uniform([price_lo, rating_lo, month_lo], [price_hi, rating_hi, month_hi], (clusters, 3))
+    if distribution == "duplicate":
+        return np.column_stack([np.round(rng.uniform(price_lo, price_hi, pool), 2),
+                                rng.integers(rating_lo, rating_hi + 1, pool),
+                                rng.integers(month_lo, month_hi + 1, pool)])
+    return None
+
+
+def numeric_columns(rng, template, size, distribution, points=None):
+    """
+    Draw prices, ratings and review months for `size` rows.
+    :param points: Output of fixed_points for the "clustered" and "duplicate" distributions.
+    :return: Tuple of (prices, ratings, months since year 0) arrays.
+    """
+    (price_lo, price_hi), (rating_lo, rating_hi), (month_lo, month_hi) = (
+        template.price_range, template.rating_range, template.month_range)
+    if distribution == "uniform":
+        prices = rng.uniform(price_lo, price_hi, size)
+        ratings = rng.integers(rating_lo, rating_hi + 1, size)
+        months = rng.integers(month_lo, month_hi + 1, size)
+    elif distribution == "clustered":
+        # Gaussian blobs around the fixed centres
+        spread = np.array([price_hi - price_lo, rating_hi - rating_lo, month_hi - month_lo]) * 0.02
+        drawn = points[rng.integers(0, len(points), size)] + rng.normal(0.0, 1.0, (size, 3)) * spread
+        prices, ratings, months = drawn[:, 0], np.rint(drawn[:, 1]), np.rint(drawn[:, 2])
+    elif distribution == "skewed":
+        # Long tail of expensive coffees, ratings bunched near the top, most reviews recent
+        prices = price_lo + rng.lognormal(np.log(5.0), 0.8, size)
+        ratings = rating_hi - np.floor(rng.exponential(2.5, size))
+        months = month_hi - np.floor(rng.exponential((month_hi - month_lo) / 6.0, size))
+    elif distribution == "duplicate":
+        # Every row repeats one of a few distinct points
+        drawn = points[rng.integers(0, len(points), size)]
+        prices, ratings, months = drawn[:, 0], drawn[:, 1], drawn[:, 2]
+    else:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    prices = np.round(np.clip(prices, price_lo, price_hi), 2)
+    ratings = np.clip(ratings, rating_lo, rating_hi).astype(np.int64)
+    months = np.clip(months, month_lo, month_hi).astype(np.int64)
+    return prices, ratings, months
+
+
+def reviews(rng, template, size, min_words=25, max_words=60):
+    """Generate review texts whose words follow the template's Zipfian vocabulary."""
+    lengths = rng.integers(min_words, max_words + 1, size)
+    words = rng.choice(len(template.vocabulary), size=int(lengths.sum()), p=template.word_weights)
+    texts = []
+    start = 0
+    for length in lengths.tolist():
+        text = " ".join(template.vocabulary[w] for w in words[start:start + length].tolist())
+        texts.append(text[:1].upper() + text[1:] + ".")
+        start += length
+    return texts
+
+
+def generate(output, rows, distribution="uniform", seed=0, template="simplified_coffee.csv", chunk_size=50000):
+    """
+    Write a synthetic dataset with the schema of simplified_coffee.csv, one chunk at a time.
+    :param output: CSV file to write.
+    :param rows: Number of rows.
+    :param distribution: One of DISTRIBUTIONS, applied to (price, rating, review date).
+    :param seed: Random seed; the same arguments always produce the same file.
+    :param template: Dataset providing value ranges, categorical frequencies and the review vocabulary.
+    :param chunk_size: Rows generated per batch; memory use is bounded by this, not by `rows`.
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    template = Template(template)
+    points = fixed_points(template, distribution, seed)
+    seeds = np.random.SeedSequence(seed)
+    with open(output, "w", encoding="utf-8", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(COLUMNS)
+        for start in range(0, rows, chunk_size):
+            size = min(chunk_size, rows - start)
+            rng = np.random.default_rng(seeds.spawn(1)[0])
+            prices, ratings, months = numeric_columns(rng, template, size, distribution, points)
+            categorical = {attr: rng.choice(len(names), size=size, p=weights)
+                           for attr, (names, weights) in template.categories.items()}
+            texts = reviews(rng, template, size)
+            for i in range(size):
+                origin = template.categories['origin'][0][categorical['origin'][i]]
+                month = int(months[i])
+                writer.writerow([
+                    f"{origin} Lot {start + i}",
+                    template.categories['roaster'][0][categorical['roaster'][i]],
+                    template.categories['roast'][0][categorical['roast'][i]],
+                    template.categories['loc_country'][0][categorical['loc_country'][i]],
+                    origin,
+                    float(prices[i]),
+                    int(ratings[i]),
+                    f"{calendar.month_name[month % 12 + 1]} {month // 12}",
+                    texts[i],
+                ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic coffee reviews dataset for scaling runs.")
+    parser.add_argument("output", help="CSV file to write")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of rows")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="uniform",
+                        help="Distribution of price, rating and review date")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--template", default="simplified_coffee.csv",
+                        help="Dataset to take value ranges, categories and review vocabulary from")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Rows generated per batch")
+    args = parser.parse_args()
+    generate(args.output, args.rows, args.distribution, args.seed, args.template, args.chunk_size)
+    print(f"Wrote {args.rows} {args.distribution} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
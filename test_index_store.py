@@ -0,0 +1,55 @@
+import pytest
+from dataset import NUMERIC_ATTRIBUTES
+from index_store import load_index, save_index
+from kdtree import FlatKDTree, build_flat_kd_tree
+from quadtree import FlatOctree, LinearOctree, build_linear_octree, build_octree
+from range_tree import FlatRangeTree, LayeredRangeTree, build_layered_range_tree, build_range_tree
+from rtree import FlatRTree, HilbertRTree, build_hilbert_rtree, build_rtree
+
+LOW, HIGH = [5.0, 90, 201801], [20.0, 94, 202206]
+RANGES = list(zip(LOW, HIGH))
+CONDITIONS = {attr: [(">=", lo), ("<=", hi)] for attr, lo, hi in zip(NUMERIC_ATTRIBUTES, LOW, HIGH)}
+
+# name -> (build(data), query(index, data))
+INDEXES = {
+    "kdtree": (build_flat_kd_tree, lambda index, data: (index.range_query(LOW, HIGH).tolist(),
+                                                         index.aggregate(LOW, HIGH)[0])),
+    "octree": (lambda data: FlatOctree.from_tree(build_octree(data)),
+               lambda index, data: index.range_query(LOW, HIGH).tolist()),
+    "linear_octree": (build_linear_octree, lambda index, data: (index.range_query(LOW, HIGH).tolist(),
+                                                                index.density(resolution=4)[0].tolist())),
+    "rtree": (lambda data: FlatRTree.from_tree(build_rtree(data, NUMERIC_ATTRIBUTES)),
+              lambda index, data: index.search(data, NUMERIC_ATTRIBUTES, CONDITIONS, {'roast': ['Medium']})),
+    "hilbert_rtree": (lambda data: build_hilbert_rtree(data, NUMERIC_ATTRIBUTES, fanout=8),
+                      lambda index, data: index.search(data, NUMERIC_ATTRIBUTES, CONDITIONS, {})),
+    "range_tree": (lambda data: build_range_tree(data, NUMERIC_ATTRIBUTES),
+                   lambda index, data: (index.search(RANGES), index.aggregate(RANGES)[0])),
+    "layered_range_tree": (lambda data: build_layered_range_tree(data, NUMERIC_ATTRIBUTES),
+                           lambda index, data: sorted(index.search(RANGES))),
+}
+CLASSES = {"kdtree": FlatKDTree, "octree": FlatOctree, "linear_octree": LinearOctree, "rtree": FlatRTree,
+           "hilbert_rtree": HilbertRTree, "range_tree": FlatRangeTree, "layered_range_tree": LayeredRangeTree}
+
+
+@pytest.mark.parametrize("name", list(INDEXES))
+def test_index_round_trip(dataset, tmp_path, name):
+    build, query = INDEXES[name]
+    index = build(dataset)
+    if name == "hilbert_rtree":
+        index.append([10.0, 92, 201905], 0)  # Buffered points are saved too
+    path = str(tmp_path / f"{name}.idx")
+    save_index(path, index, dataset)
+    loaded = load_index(path, dataset, CLASSES[name])
+    assert query(loaded, dataset) == query(index, dataset)
+
+
+def test_load_index_rejects_foreign_and_damaged_files(dataset, tmp_path):
+    path = str(tmp_path / "kdtree.idx")
+    save_index(path, build_flat_kd_tree(dataset), dataset)
+    with pytest.raises(ValueError):
+        load_index(path, dataset, FlatRTree)
+    content = open(path, "rb").read()
+    with open(path, "wb") as f:
+        f.write(content[:len(content) // 2])
+    with pytest.raises(ValueError):
+        load_index(path, dataset, FlatKDTree)
@@ -0,0 +1,103 @@
+import numpy as np
+from dataset import AGGREGATE_ATTRIBUTES, NUMERIC_ATTRIBUTES
+from kdtree import DynamicKDTree, FlatKDTree, build_flat_kd_tree, build_kd_tree, range_query
+
+
+def query_boxes(points, count=40, seed=0):
+    """Random query boxes whose corners are coordinates of the points, so bounds often fall exactly on points."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        corners = points[rng.integers(0, len(points), 2)]
+        yield corners.min(axis=0), corners.max(axis=0)
+
+
+def inside(points, low, high):
+    return ((points >= low) & (points <= high)).all(axis=1)
+
+
+def test_flat_kd_tree_empty():
+    """
+    An empty FlatKDTree answers range and aggregate queries with no rows instead of failing.
+    """
+    tree = FlatKDTree.build(np.empty((0, 2)))
+    assert len(tree.range_query([0, 0], [1, 1])) == 0
+    tree.augment(np.empty((0, 2)), ['a', 'b'])
+    count, sums, mins, maxs = tree.aggregate([0, 0], [1, 1])
+    assert count == 0
+    assert np.array_equal(sums, [0, 0])
+    assert np.all(np.isinf(mins)) and np.all(np.isinf(maxs))
+
+
+def test_build_kd_tree_range_query():
+    points = np.random.default_rng(1).integers(0, 6, (300, 3)).astype(np.float64)
+    root = build_kd_tree(points, list(range(len(points))))
+    for low, high in query_boxes(points):
+        found = range_query(root, low.tolist(), high.tolist())
+        assert sorted(found) == np.flatnonzero(inside(points, low, high)).tolist()
+
+
+def test_flat_kd_tree_range_query_and_aggregate(dataset):
+    tree = build_flat_kd_tree(dataset)
+    points, values = dataset.points(NUMERIC_ATTRIBUTES), dataset.points(AGGREGATE_ATTRIBUTES)
+    for low, high in query_boxes(points):
+        mask = inside(points, low, high)
+        assert sorted(tree.range_query(low, high).tolist()) == np.flatnonzero(mask).tolist()
+        count, sums, mins, maxs = tree.aggregate(low, high)
+        assert count == mask.sum()
+        assert np.allclose(sums, values[mask].sum(axis=0))
+        assert np.array_equal(mins, values[mask].min(axis=0, initial=np.inf))
+        assert np.array_equal(maxs, values[mask].max(axis=0, initial=-np.inf))
+
+
+def test_flat_kd_tree_in_filter(dataset):
+    attributes = NUMERIC_ATTRIBUTES + ['roast', 'loc_country']
+    tree = build_flat_kd_tree(dataset, attributes)
+    points = dataset.points(attributes)
+    rng = np.random.default_rng(2)
+    for low, high in query_boxes(points):
+        roasts = rng.choice(len(dataset.vocabularies['roast']), 2, replace=False)
+        countries = rng.choice(len(dataset.vocabularies['loc_country']), 3, replace=False)
+        # The box is open on the categorical axes; the IN filter restricts them
+        low[3:], high[3:] = -np.inf, np.inf
+        mask = inside(points, low, high) & np.isin(points[:, 3], roasts) & np.isin(points[:, 4], countries)
+        found = tree.range_query(low, high, allowed={3: roasts, 4: countries})
+        assert sorted(found.tolist()) == np.flatnonzero(mask).tolist()
+        assert tree.aggregate(low, high, allowed={3: roasts, 4: countries})[0] == mask.sum()
+
+
+def test_flat_kd_tree_knn_query():
+    points = np.random.default_rng(3).random((500, 3))
+    weights = np.array([1.0, 2.0, 0.5])
+    tree = FlatKDTree.build(points, leaf_size=8)
+    for query in np.random.default_rng(4).random((20, 3)):
+        distances = np.sqrt((((points - query) * weights) ** 2).sum(axis=1))
+        expected = np.argsort(distances, kind='stable')[:7]
+        found = tree.knn_query(query, 7, weights)
+        assert [row_id for row_id, _ in found] == expected.tolist()
+        assert np.allclose([distance for _, distance in found], distances[expected])
+
+
+def test_dynamic_kd_tree_matches_a_set_of_points():
+    rng = np.random.default_rng(5)
+    points = rng.integers(0, 20, (400, 2)).astype(np.float64)
+    tree = DynamicKDTree.build(points[:100], buffer_size=16)
+    live = set(range(100))
+    for row_id in range(100, 400):
+        tree.insert(points[row_id], row_id)
+        live.add(row_id)
+        if row_id % 3 == 0:
+            victim = int(rng.choice(sorted(live)))
+            assert tree.delete(points[victim], victim)
+            live.remove(victim)
+    assert not tree.delete(points[0] + 100, 0)
+    assert len(tree) == len(live)
+    alive = np.zeros(len(points), dtype=bool)
+    alive[sorted(live)] = True
+    for low, high in query_boxes(points):
+        expected = np.flatnonzero(inside(points, low, high) & alive)
+        assert sorted(tree.range_query(low, high).tolist()) == expected.tolist()
+    query = np.array([10.0, 10.0])
+    distances = np.sqrt(((points - query) ** 2).sum(axis=1))
+    found = tree.knn_query(query, 10)
+    assert np.allclose([distance for _, distance in found], np.sort(distances[alive])[:10])
+    assert all(row_id in live for row_id, _ in found)
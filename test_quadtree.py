@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from dataset import AGGREGATE_ATTRIBUTES, NUMERIC_ATTRIBUTES
+from quadtree import FlatOctree, LinearOctree, build_linear_octree, build_octree
+
+
+def query_boxes(points, count=40, seed=0):
+    """Random query boxes whose corners are coordinates of the points, so bounds often fall exactly on points."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        corners = points[rng.integers(0, len(points), 2)]
+        yield corners.min(axis=0), corners.max(axis=0)
+
+
+def inside(points, low, high):
+    return ((points >= low) & (points <= high)).all(axis=1)
+
+
+def test_octree_range_query(dataset):
+    root = build_octree(dataset, capacity=4, max_depth=6)
+    flat = FlatOctree.from_tree(root)
+    points = dataset.points(NUMERIC_ATTRIBUTES)
+    for low, high in query_boxes(points):
+        expected = np.flatnonzero(inside(points, low, high)).tolist()
+        assert sorted(root.range_query(low.tolist(), high.tolist())) == expected
+        assert sorted(flat.range_query(low, high).tolist()) == expected
+
+
+@pytest.mark.parametrize("dims", [1, 2, 3])
+def test_linear_octree_range_query(dims):
+    rng = np.random.default_rng(dims)
+    points = np.vstack([rng.random((300, dims)), rng.integers(0, 4, (300, dims)) / 4])
+    tree = LinearOctree.build(points, capacity=8)
+    for low, high in query_boxes(points):
+        assert sorted(tree.range_query(low, high).tolist()) == np.flatnonzero(inside(points, low, high)).tolist()
+    assert len(tree.range_query(np.full(dims, 2.0), np.full(dims, 3.0))) == 0
+    assert len(LinearOctree.build(np.empty((0, dims))).range_query(np.zeros(dims), np.ones(dims))) == 0
+
+
+def test_linear_octree_density(dataset):
+    attributes = ['100g_USD', 'rating']
+    tree = build_linear_octree(dataset, attributes)
+    points, prices = dataset.points(attributes), dataset.points(AGGREGATE_ATTRIBUTES)[:, 0]
+    counts, means, _ = tree.density(resolution=8, attribute='100g_USD')
+    level = 3
+    cells = tree._grid(points) >> (tree.bits - level)
+    expected = np.zeros((2 ** level, 2 ** level), dtype=np.int64)
+    np.add.at(expected, tuple(cells.T), 1)
+    assert np.array_equal(counts, expected)
+    assert np.isclose(np.nansum(means * counts), prices.sum())
+    for low, high in query_boxes(points, 10):
+        mask = inside(points, low, high)
+        counts, means, _ = tree.density(low, high, resolution=8, attribute='100g_USD')
+        assert counts.sum() == mask.sum()
+        assert np.isclose(np.nansum(means * counts), prices[mask].sum())
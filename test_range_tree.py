@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from dataset import AGGREGATE_ATTRIBUTES, NUMERIC_ATTRIBUTES
+from range_tree import LayeredRangeTree, build_layered_range_tree, build_range_tree
+
+
+def query_boxes(points, count=40, seed=0):
+    """Random query boxes whose corners are coordinates of the points, so bounds often fall exactly on points."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        corners = points[rng.integers(0, len(points), 2)]
+        yield corners.min(axis=0), corners.max(axis=0)
+
+
+def inside(points, low, high):
+    return ((points >= low) & (points <= high)).all(axis=1)
+
+
+@pytest.mark.parametrize("attributes", [['rating'], ['100g_USD', 'review_date'], NUMERIC_ATTRIBUTES])
+def test_range_tree_search_and_aggregate(dataset, attributes):
+    tree = build_range_tree(dataset, attributes)
+    layered = build_layered_range_tree(dataset, attributes)
+    points, values = dataset.points(attributes), dataset.points(AGGREGATE_ATTRIBUTES)
+    for low, high in query_boxes(points):
+        mask = inside(points, low, high)
+        ranges = list(zip(low.tolist(), high.tolist()))
+        assert sorted(tree.search(ranges)) == np.flatnonzero(mask).tolist()
+        assert sorted(layered.search(ranges)) == np.flatnonzero(mask).tolist()
+        count, sums, mins, maxs = tree.aggregate(ranges)
+        assert count == mask.sum()
+        assert np.allclose(sums, values[mask].sum(axis=0))
+        assert np.array_equal(mins, values[mask].min(axis=0, initial=np.inf))
+        assert np.array_equal(maxs, values[mask].max(axis=0, initial=-np.inf))
+
+
+@pytest.mark.parametrize("dims", [1, 2, 3])
+def test_layered_range_tree_with_ties(dims):
+    points = np.random.default_rng(dims).integers(0, 5, (257, dims)).astype(np.float64)
+    tree = LayeredRangeTree.build(points)
+    for low, high in query_boxes(points):
+        ranges = list(zip(low.tolist(), high.tolist()))
+        assert sorted(tree.search(ranges)) == np.flatnonzero(inside(points, low, high)).tolist()
+    assert tree.search([(9.0, 10.0)] * dims) == []
+    assert LayeredRangeTree.build(np.empty((0, dims))).search([(0.0, 1.0)] * dims) == []
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+from dataset import NUMERIC_ATTRIBUTES
+from rtree import BoundingBox, FlatRTree, HilbertRTree, RTree, StandingQueries, build_hilbert_rtree, build_rtree
+
+
+def query_boxes(points, count=40, seed=0):
+    """Random query boxes whose corners are coordinates of the points, so bounds often fall exactly on points."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        corners = points[rng.integers(0, len(points), 2)]
+        yield corners.min(axis=0), corners.max(axis=0)
+
+
+def inside(points, low, high):
+    return ((points >= low) & (points <= high)).all(axis=1)
+
+
+def conditions(attributes, low, high):
+    return {attr: [(">=", lo), ("<=", hi)] for attr, lo, hi in zip(attributes, low.tolist(), high.tolist())}
+
+
+@pytest.mark.parametrize("method", ["str", "hilbert", "rstar"])
+def test_rtree_search(dataset, method):
+    tree = build_rtree(dataset, NUMERIC_ATTRIBUTES, max_entries=8, method=method)
+    flat = FlatRTree.from_tree(tree)
+    points = dataset.points(NUMERIC_ATTRIBUTES)
+    roasts = dataset.codes['roast']
+    for i, (low, high) in enumerate(query_boxes(points)):
+        accepted = dataset.vocabularies['roast'][i % len(dataset.vocabularies['roast'])]
+        mask = inside(points, low, high) & np.isin(roasts, dataset.encode('roast', [accepted]))
+        for index in (tree, flat):
+            found = index.search(dataset, NUMERIC_ATTRIBUTES, conditions(NUMERIC_ATTRIBUTES, low, high),
+                                 {'roast': [accepted]})
+            assert sorted(found) == np.flatnonzero(mask).tolist()
+
+
+def test_rtree_insert_delete_update():
+    rng = np.random.default_rng(1)
+    tree = RTree(max_entries=4)
+    points = {}
+    for row_id in range(300):
+        points[row_id] = rng.integers(0, 30, 2).astype(np.float64)
+        tree.insert(BoundingBox(points[row_id].tolist(), points[row_id].tolist()), row_id)
+    for row_id in rng.choice(300, 120, replace=False).tolist():
+        assert tree.delete(tree.boxes[row_id], row_id)
+        del points[row_id]
+    for row_id in rng.choice(sorted(points), 80, replace=False).tolist():
+        points[row_id] = rng.integers(0, 30, 2).astype(np.float64)
+        assert tree.update(row_id, points[row_id])
+    assert not tree.delete(BoundingBox([100.0, 100.0], [100.0, 100.0]), 0)
+    assert not tree.update(10000, [0.0, 0.0])
+
+    row_ids = np.array(sorted(points))
+    coords = np.array([points[row_id] for row_id in row_ids])
+    attributes = ['x', 'y']
+    for low, high in query_boxes(coords):
+        found = tree.search(None, attributes, conditions(attributes, low, high), {})
+        assert sorted(found) == row_ids[inside(coords, low, high)].tolist()
+
+
+def test_flat_rtree_nearest(dataset):
+    flat = FlatRTree.from_tree(build_rtree(dataset, NUMERIC_ATTRIBUTES))
+    points = dataset.points(NUMERIC_ATTRIBUTES)
+    weights = 1.0 / points.std(axis=0)
+    query = points[5] + 0.25
+    browsed = list(flat.nearest(query, weights))
+    distances = np.sqrt((((points - query) * weights) ** 2).sum(axis=1))
+    assert sorted(row_id for row_id, _ in browsed) == list(range(len(points)))
+    assert np.allclose([distance for _, distance in browsed], np.sort(distances))
+    assert all(np.isclose(distance, distances[row_id]) for row_id, distance in browsed)
+
+
+def test_hilbert_rtree_search_with_buffer(dataset):
+    points = dataset.points(NUMERIC_ATTRIBUTES)
+    # The second half of the rows arrives one at a time into a copy, partly outside the bounds seen at build time
+    tree = HilbertRTree.build(points[:300], fanout=8)
+    tree.buffer_size = 64
+    grown = tree.copy()
+    for row_id in range(300, len(points)):
+        grown.append(points[row_id] * 1.5, row_id)
+    assert len(tree) == 300 and len(grown) == len(points)
+    moved = np.vstack([points[:300], points[300:] * 1.5])
+    for low, high in query_boxes(moved):
+        query = conditions(NUMERIC_ATTRIBUTES, low, high)
+        assert sorted(grown.search(dataset, NUMERIC_ATTRIBUTES, query, {})) == np.flatnonzero(
+            inside(moved, low, high)).tolist()
+        assert sorted(tree.search(dataset, NUMERIC_ATTRIBUTES, query, {})) == np.flatnonzero(
+            inside(points[:300], low, high)).tolist()
+    assert len(build_hilbert_rtree(dataset, NUMERIC_ATTRIBUTES)) == len(points)
+
+
+def test_standing_queries_match():
+    rng = np.random.default_rng(2)
+    attributes = ["100g_USD", "rating", "review_date"]
+    index = StandingQueries(attributes, max_entries=4)
+    queries = {}
+    for query_id in range(60):
+        low = rng.integers(0, 10, 3).astype(np.float64)
+        high = low + rng.integers(0, 5, 3)
+        ranges = {attr: (lo, hi) for attr, lo, hi in zip(attributes, low.tolist(), high.tolist())}
+        if query_id % 4 == 0:
+            ranges["rating"] = (None, high[1])  # Open lower bound
+        queries[query_id] = ranges
+        index.add(query_id, ranges)
+    for query_id in range(0, 60, 5):
+        assert index.remove(query_id)
+        del queries[query_id]
+    assert not index.remove(1000)
+    assert len(index) == len(queries)
+    for review in rng.integers(0, 15, (50, 3)).astype(np.float64):
+        review = dict(zip(attributes, review.tolist()))
+        expected = [query_id for query_id, ranges in queries.items()
+                    if all((low is None or low <= review[attr]) and (high is None or review[attr] <= high)
+                           for attr, (low, high) in ranges.items())]
+        assert sorted(index.match(review)) == expected
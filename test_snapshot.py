@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from dataset import COLUMNS
+from snapshot import is_fresh, load_snapshot, read_arrays, write_arrays, write_snapshot
+
+
+def test_snapshot_round_trip(dataset, tmp_path):
+    path = str(tmp_path / "coffee.snap")
+    write_snapshot(dataset, path)
+    loaded = load_snapshot(path)
+    assert len(loaded) == len(dataset)
+    assert loaded.checksum() == dataset.checksum()
+    row_ids = list(range(len(dataset)))
+    assert loaded.rows(row_ids, raw=True) == dataset.rows(row_ids, raw=True)
+    assert loaded.rows(row_ids[:5]) == dataset.rows(row_ids[:5])
+    assert len(loaded.record(0)) == len(COLUMNS)
+    assert not is_fresh(path, path)  # Written without a source CSV
+
+
+def test_read_arrays_rejects_damaged_files(tmp_path):
+    path = str(tmp_path / "arrays.bin")
+    arrays = {"a": np.arange(100, dtype=np.int64), "b": np.ones((10, 3))}
+    write_arrays(path, b"TESTFILE", 1, arrays, {"note": "x"})
+    loaded, meta = read_arrays(path, b"TESTFILE", 1)
+    assert meta == {"note": "x"} and all(np.array_equal(loaded[name], arrays[name]) for name in arrays)
+    with pytest.raises(ValueError):
+        read_arrays(path, b"TESTFILE", 2)
+    with pytest.raises(ValueError):
+        read_arrays(path, b"OTHERONE", 1)
+    content = open(path, "rb").read()
+    for cut in (0, 10, 40, len(content) - 8):
+        with open(path, "wb") as f:
+            f.write(content[:cut])
+        with pytest.raises(ValueError):
+            read_arrays(path, b"TESTFILE", 1)